@@ -1,15 +1,62 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from datetime import datetime
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timezone
+import base64
+import binascii
+import json
+import os
 import secrets
-from typing import List
+from typing import Any, Dict, List, Literal, Optional, Tuple, Union
 
-from core.auth import verify_admin_token
-from models.auth import Token, TokenCreate
+from core.auth import token_cache, verify_admin_token
+from models.auth import Token, TokenBulkCreate, TokenBulkRevoke, TokenCreate, TokenFields, UsageReport
+from services.usage_buffer import period_start
 
 router = APIRouter()
 security = HTTPBearer()
 
+# GET /auth/tokens pages through tokens in (created_at, _id) order; the
+# next page's cursor is returned in the X-Next-Cursor header
+TOKEN_PAGE_SIZE = int(os.getenv("TOKEN_PAGE_SIZE", "100"))
+TOKEN_PAGE_MAX = int(os.getenv("TOKEN_PAGE_MAX", "1000"))
+TOKEN_FIELDS = tuple(Token.model_fields)
+
+def new_token(token_data: Union[TokenCreate, TokenBulkCreate], created_at: datetime) -> dict:
+    token = {
+        "token": secrets.token_urlsafe(32),
+        "is_admin": token_data.is_admin,
+        "created_at": created_at
+    }
+    if token_data.requests_per_minute is not None:
+        token["requests_per_minute"] = token_data.requests_per_minute
+    return token
+
+def encode_cursor(document: dict) -> str:
+    key = f"{document['created_at'].isoformat()}|{document['_id']}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[datetime, Any]:
+    try:
+        created_at, _id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        created_at = datetime.fromisoformat(created_at)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    try:
+        return created_at, ObjectId(_id)
+    except InvalidId:
+        return created_at, _id
+
+def token_json(document: dict, fields: Tuple[str, ...]) -> Dict[str, Any]:
+    """The requested fields of a token document, as Token would serialize them."""
+    output = {}
+    for field in fields:
+        value = document.get(field)
+        output[field] = value.isoformat() if isinstance(value, datetime) else value
+    return output
+
 @router.post("/tokens", response_model=Token)
 async def create_token(
     request: Request,
@@ -19,26 +66,125 @@ async def create_token(
     """Create a new token (admin only)"""
     await verify_admin_token(request, credentials.credentials)
     
-    token = {
-        "token": secrets.token_urlsafe(32),
-        "is_admin": token_data.is_admin,
-        "created_at": datetime.utcnow()
-    }
+    token = new_token(token_data, datetime.utcnow())
     
     await request.app.mongodb.tokens.insert_one(token)
+    token_cache.invalidate(token["token"])
     return token
 
-@router.get("/tokens", response_model=List[Token])
-async def list_tokens(
+@router.post("/tokens/bulk", response_model=List[Token])
+async def create_tokens(
     request: Request,
+    token_data: TokenBulkCreate,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
-    """List all tokens (admin only)"""
+    """Create `count` tokens with the same settings in one write (admin only)"""
     await verify_admin_token(request, credentials.credentials)
     
-    tokens = await request.app.mongodb.tokens.find().to_list(length=None)
+    now = datetime.utcnow()
+    tokens = [new_token(token_data, now) for _ in range(token_data.count)]
+    
+    await request.app.mongodb.tokens.insert_many(tokens)
+    for token in tokens:
+        token_cache.invalidate(token["token"])
     return tokens
 
+@router.post("/tokens/revoke")
+async def revoke_tokens(
+    request: Request,
+    revoke_data: TokenBulkRevoke,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Delete several tokens in one write (admin only)"""
+    await verify_admin_token(request, credentials.credentials)
+    
+    result = await request.app.mongodb.tokens.delete_many({"token": {"$in": revoke_data.tokens}})
+    for token in revoke_data.tokens:
+        token_cache.invalidate(token)
+    return {"deleted": result.deleted_count, "requested": len(revoke_data.tokens)}
+
+@router.get(
+    "/tokens",
+    response_model=List[TokenFields],
+    responses={200: {
+        "description": "One page of tokens with the requested fields",
+        "headers": {"X-Next-Cursor": {
+            "description": "Cursor for the next page; absent on the last one",
+            "schema": {"type": "string"}
+        }},
+        "content": {"application/x-ndjson": {"schema": {"type": "string"}}}
+    }}
+)
+async def list_tokens(
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=TOKEN_PAGE_MAX, description=f"Page size (default {TOKEN_PAGE_SIZE})"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor of the previous page"),
+    fields: Optional[str] = Query(None, description="Comma-separated Token fields to return"),
+    is_admin: Optional[bool] = None,
+    last_used_after: Optional[datetime] = None,
+    last_used_before: Optional[datetime] = None,
+    format: Literal["json", "ndjson"] = "json",
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    List tokens oldest first, one page at a time (admin only).
+    
+    The response carries X-Next-Cursor while more tokens remain. With
+    format=ndjson (or Accept: application/x-ndjson) every matching token is
+    streamed as one JSON object per line, up to `limit` if given.
+    """
+    await verify_admin_token(request, credentials.credentials)
+    
+    selected = TOKEN_FIELDS
+    if fields:
+        selected = tuple(field.strip() for field in fields.split(",") if field.strip())
+        unknown = [field for field in selected if field not in TOKEN_FIELDS]
+        if unknown or not selected:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(TOKEN_FIELDS)}"
+            )
+    
+    query: Dict[str, Any] = {}
+    if is_admin is not None:
+        query["is_admin"] = is_admin
+    if last_used_after is not None or last_used_before is not None:
+        query["last_used"] = {}
+        if last_used_after is not None:
+            query["last_used"]["$gte"] = last_used_after
+        if last_used_before is not None:
+            query["last_used"]["$lt"] = last_used_before
+    if cursor is not None:
+        created_at, _id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$gt": created_at}},
+            {"created_at": created_at, "_id": {"$gt": _id}}
+        ]
+    
+    # Only what the response needs, plus the keyset fields
+    projection = {field: 1 for field in selected}
+    projection["created_at"] = 1
+    tokens = request.app.mongodb.tokens.find(query, projection).sort([("created_at", 1), ("_id", 1)])
+    
+    if format == "ndjson" or "application/x-ndjson" in request.headers.get("accept", ""):
+        if limit is not None:
+            tokens = tokens.limit(limit)
+        
+        async def lines():
+            # Serialized as the cursor reads each batch, never all at once
+            async for document in tokens:
+                yield json.dumps(token_json(document, selected)) + "\n"
+        
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+    
+    limit = limit or TOKEN_PAGE_SIZE
+    documents = await tokens.limit(limit + 1).to_list(length=limit + 1)
+    headers = {}
+    if len(documents) > limit:
+        documents = documents[:limit]
+        headers["X-Next-Cursor"] = encode_cursor(documents[-1])
+    return JSONResponse(content=[token_json(document, selected) for document in documents], headers=headers)
+
 @router.delete("/tokens/{token}")
 async def delete_token(
     request: Request,
@@ -49,7 +195,44 @@ async def delete_token(
     await verify_admin_token(request, credentials.credentials)
     
     result = await request.app.mongodb.tokens.delete_one({"token": token})
+    token_cache.invalidate(token)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Token not found")
     
-    return {"message": "Token deleted successfully"} 
+    return {"message": "Token deleted successfully"}
+
+@router.get("/stats")
+async def auth_stats(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Token cache metrics (admin only)"""
+    await verify_admin_token(request, credentials.credentials)
+    return {"token_cache": token_cache.stats()}
+
+@router.get("/usage", response_model=UsageReport)
+async def usage_report(
+    request: Request,
+    period: Literal["hour", "day", "month"] = "month",
+    at: Optional[datetime] = Query(None, description="Any time within the period (default: now, UTC)"),
+    token: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Per-token usage totals for one hour, day or month, busiest first (admin only)"""
+    await verify_admin_token(request, credentials.credentials)
+
+    if at is None:
+        at = datetime.utcnow()
+    elif at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    start = period_start(at, period)
+
+    # One precomputed rollup document per token, written by the usage buffer
+    query = {"period": period, "start": start}
+    if token is not None:
+        query["token"] = token
+    totals = await request.app.mongodb.usage_rollups.find(
+        query, {"_id": 0, "token": 1, "count": 1, "bytes": 1, "endpoints": 1}
+    ).sort("count", -1).limit(limit).to_list(length=limit)
+    return {"period": period, "start": start, "tokens": totals}
\ No newline at end of file
@@ -0,0 +1,98 @@
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Query, Request
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import List, Optional
+import os
+
+from api.moderate import read_batch_items
+from core.auth import verify_token
+from services.jobs import JobInputError, check_callback_url, job_summary, job_workers, resolve_local_path
+
+router = APIRouter()
+security = HTTPBearer()
+
+# Limits for one job; uploaded bytes are held in MongoDB until it finishes
+JOB_MAX_ITEMS = int(os.getenv("JOB_MAX_ITEMS", "10000"))
+JOB_MAX_TOTAL_SIZE = int(os.getenv("JOB_MAX_TOTAL_SIZE", str(256 * 1024 * 1024)))
+JOB_RESULTS_PAGE_MAX = 1000
+
+@router.post("", status_code=202)
+async def create_job(
+    request: Request,
+    files: Optional[List[UploadFile]] = File(None),
+    paths: Optional[List[str]] = Form(None),
+    callback_url: Optional[str] = Form(None),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Queue images for moderation and return a job id right away. Accepts
+    image files, zip/tar archives and/or `paths` of files under the server's
+    JOB_LOCAL_ROOT. Poll GET /moderate/jobs/{job_id} for progress and
+    results, or pass `callback_url` to be notified when the job finishes
+    (its host must be allowed by JOB_CALLBACK_HOSTS).
+    """
+    # Verify token
+    token_data = await verify_token(request, credentials.credentials)
+
+    if job_workers.queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is not available")
+    if callback_url:
+        try:
+            check_callback_url(callback_url)
+        except JobInputError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    paths = [path for path in paths or [] if path]
+    if not files and not paths:
+        raise HTTPException(status_code=400, detail="Provide files and/or paths")
+    if len(paths) > JOB_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Job exceeds maximum of {JOB_MAX_ITEMS} images")
+
+    items, uploads = [], {}
+    if files:
+        for filename, content_type, contents, error in await read_batch_items(
+            files, JOB_MAX_ITEMS - len(paths), JOB_MAX_TOTAL_SIZE
+        ):
+            item = {"filename": filename, "content_type": content_type}
+            if error is not None:
+                item["error"] = error
+            else:
+                uploads[len(items)] = contents
+            items.append(item)
+
+    # Paths are checked against the root now; the files are read by the worker
+    for path in paths:
+        try:
+            resolve_local_path(path)
+        except JobInputError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        items.append({"filename": os.path.basename(path), "path": path})
+
+    job = await job_workers.queue.create(token_data["token"], items, uploads, callback_url or None)
+    job_workers.notify()
+    return {"job_id": job["_id"], "status": job["status"], "total": job["total"]}
+
+@router.get("/{job_id}")
+async def get_job(
+    job_id: str,
+    request: Request,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=JOB_RESULTS_PAGE_MAX),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Job status with a page of per-image results in input order. Results
+    appear as chunks complete; `next_offset` is set while more are stored.
+    """
+    token_data = await verify_token(request, credentials.credentials)
+
+    if job_workers.queue is None:
+        raise HTTPException(status_code=503, detail="Job queue is not available")
+    job = await job_workers.queue.get(job_id)
+    # Other tokens' jobs are reported as missing rather than forbidden
+    if job is None or (job["token"] != token_data["token"] and not token_data.get("is_admin")):
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    results = await job_workers.queue.results(job_id, offset, limit)
+    last = results[-1]["index"] if results else None
+    next_offset = last + 1 if len(results) == limit and last + 1 < job["total"] else None
+    return {**job_summary(job), "results": results, "next_offset": next_offset}
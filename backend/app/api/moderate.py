@@ -1,23 +1,146 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime
-import tensorflow as tf
-import numpy as np
-from PIL import Image
-import io
+from typing import List
+import os
+import signal
 
-from core.auth import verify_token
-from db.mongodb import db
-from services.image_analyzer import analyze_image
+from core.auth import verify_token, verify_admin_token
+from core.metrics import stage_timer
+from models.auth import UsageRecord
+from services.archive import ArchiveError, extract_images, guess_image_type, is_archive
+from services.backends import MODERATION_BACKEND, create_backend
+from services.image_analyzer import PHASH_ALGORITHM, batcher, inference_pool, result_fingerprint
+from services.inference_pool import PoolSaturatedError
+from services.jobs import job_workers
+from services.model_registry import ModelNotReadyError
+from services.near_duplicate import NearDuplicateIndex
+from services.preprocessing import ImageTooLargeError
+from services.result_cache import ResultCache
+from services.taxonomy import TaxonomyError, taxonomy
+from services.upload import UploadTooLargeError, UploadTypeError, read_upload, upload_stats
+from services.usage_buffer import usage_buffer
 
 router = APIRouter()
 security = HTTPBearer()
 
 ALLOWED_MIME_TYPES = {"image/jpeg", "image/png", "image/gif"}
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(5 * 1024 * 1024)))  # 5MB
+
+# Limits for /moderate/batch, counted after archives are expanded
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "64"))
+BATCH_MAX_TOTAL_SIZE = int(os.getenv("BATCH_MAX_TOTAL_SIZE", str(64 * 1024 * 1024)))
+
+# Result cache keyed by a hash of the uploaded bytes
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+RESULT_CACHE_SHARED = os.getenv("RESULT_CACHE_SHARED", "false").lower() == "true"
+
+# Perceptual-hash index that lets re-encoded copies reuse earlier verdicts
+NEAR_DUPLICATE_ENABLED = os.getenv("NEAR_DUPLICATE_ENABLED", "true").lower() == "true"
+NEAR_DUPLICATE_MAX_DISTANCE = int(os.getenv("NEAR_DUPLICATE_MAX_DISTANCE", "4"))
+NEAR_DUPLICATE_PERSIST = os.getenv("NEAR_DUPLICATE_PERSIST", "true").lower() == "true"
+
+# Stage timings for /metrics; decode through mapping are timed in the analyzer
+READ_STAGE = stage_timer("read")
+DB_WRITE_STAGE = stage_timer("db_write")
+
+def near_duplicate_fingerprint() -> str:
+    return f"{result_fingerprint()}|{PHASH_ALGORITHM}"
+
+near_duplicates = NearDuplicateIndex(
+    fingerprint=near_duplicate_fingerprint(),
+    max_distance=NEAR_DUPLICATE_MAX_DISTANCE
+) if NEAR_DUPLICATE_ENABLED else None
+
+# The backend (or cascade of backends) that produces results
+backend = create_backend(MODERATION_BACKEND, near_duplicates)
+
+result_cache = ResultCache(
+    fingerprint=backend.fingerprint,
+    max_entries=RESULT_CACHE_SIZE,
+    ttl_seconds=RESULT_CACHE_TTL
+)
+
+def bind_database(db) -> None:
+    """Attach the shared MongoDB tiers once the client is connected."""
+    if RESULT_CACHE_SHARED:
+        result_cache.collection = db.moderation_cache
+    if near_duplicates is not None and NEAR_DUPLICATE_PERSIST:
+        near_duplicates.collection = db.phash_index
+
+async def apply_taxonomy_reload() -> bool:
+    """
+    Recompile the taxonomy from disk and, if it changed, stop reusing
+    verdicts made under the old one. Returns whether it changed.
+    """
+    previous = taxonomy.current.digest
+    taxonomy.reload()
+    if taxonomy.current.digest == previous:
+        return False
+    result_cache.invalidate(backend.fingerprint)
+    if near_duplicates is not None:
+        await near_duplicates.rebind(near_duplicate_fingerprint())
+    return True
+
+async def read_batch_items(files: List[UploadFile], max_files: int, max_total_size: int) -> list:
+    """
+    Expand uploaded images and zip/tar archives into (filename, content
+    type, bytes, error) items. Per-file problems become the item's error;
+    exceeding the count or total size limits raises a 400.
+    """
+    items = []
+    total_size = 0
+    for file in files:
+        if is_archive(file.filename, file.content_type):
+            try:
+                contents = await read_upload(file, max_total_size - total_size, require_image=False)
+            except UploadTooLargeError:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Batch exceeds maximum allowed size of {max_total_size/1024/1024}MB"
+                )
+            total_size += len(contents)
+            try:
+                members = extract_images(
+                    contents,
+                    max_members=max_files - len(items),
+                    max_member_size=MAX_FILE_SIZE,
+                    max_total_size=max_total_size - total_size
+                )
+            except ArchiveError as e:
+                raise HTTPException(status_code=400, detail=f"{file.filename}: {e}")
+            for name, member in members:
+                items.append((name, guess_image_type(name), member, None))
+            continue
+
+        contents, error = b"", None
+        if file.content_type not in ALLOWED_MIME_TYPES:
+            error = f"File type not allowed. Allowed types: {', '.join(ALLOWED_MIME_TYPES)}"
+        else:
+            try:
+                contents = await read_upload(file, MAX_FILE_SIZE)
+            except (UploadTooLargeError, UploadTypeError) as e:
+                error = str(e)
+        total_size += len(contents)
+        if total_size > max_total_size:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Batch exceeds maximum allowed size of {max_total_size/1024/1024}MB"
+            )
+        items.append((file.filename, file.content_type, contents, error))
+
+    if len(items) > max_files:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch exceeds maximum of {max_files} images"
+        )
+
+    return items
 
 @router.post("")
 async def moderate_image(
+    request: Request,
     file: UploadFile = File(...),
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ):
@@ -26,7 +149,7 @@ async def moderate_image(
     Returns a safety report with confidence scores for various categories.
     """
     # Verify token
-    token_data = await verify_token(credentials.credentials)
+    token_data = await verify_token(request, credentials.credentials)
     
     # Validate file type
     if file.content_type not in ALLOWED_MIME_TYPES:
@@ -35,31 +158,166 @@ async def moderate_image(
             detail=f"File type not allowed. Allowed types: {', '.join(ALLOWED_MIME_TYPES)}"
         )
     
-    # Read and validate file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(
-            status_code=400,
-            detail=f"File size exceeds maximum allowed size of {MAX_FILE_SIZE/1024/1024}MB"
-        )
+    # Read in chunks, rejecting oversized or non-image uploads early
+    try:
+        with READ_STAGE.time():
+            contents = await read_upload(file, MAX_FILE_SIZE)
+    except (UploadTooLargeError, UploadTypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     try:
-        # Convert to PIL Image
-        image = Image.open(io.BytesIO(contents))
+        # Identical uploads skip decode and inference entirely
+        cache_key = result_cache.key(contents)
+        analysis_result = await result_cache.get(cache_key)
+        cached = analysis_result is not None
+        near_duplicate = False
+        if not cached:
+            analysis_result = await backend.analyze(contents)
+            near_duplicate = analysis_result.pop("near_duplicate")
+            with DB_WRITE_STAGE.time():
+                await result_cache.set(cache_key, analysis_result)
         
-        # Analyze image
-        analysis_result = await analyze_image(image)
+        # Record usage (written in the background by the usage buffer)
+        usage_buffer.record(UsageRecord(
+            token=token_data["token"],
+            endpoint="moderate",
+            file_size=len(contents),
+            file_type=file.content_type
+        ))
         
-        # Record usage
-        await db.usages.insert_one({
-            "token": token_data["token"],
-            "endpoint": "moderate",
-            "timestamp": datetime.utcnow(),
-            "file_size": len(contents),
-            "file_type": file.content_type
-        })
-        
-        return analysis_result
+        return {**analysis_result, "cached": cached, "near_duplicate": near_duplicate}
         
+    except PoolSaturatedError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please try again later."
+        )
+    except ModelNotReadyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Model is loading. Please try again later."
+        )
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) 
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/batch")
+async def moderate_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """
+    Analyze many images in one request. Accepts several image files and/or
+    zip/tar archives of images. Results are returned in input order (archive
+    members in archive order); an item that can't be processed gets an
+    "error" entry instead of failing the whole request.
+    """
+    # Verify token
+    token_data = await verify_token(request, credentials.credentials)
+
+    # Expand the upload into (filename, content type, bytes, error) items
+    with READ_STAGE.time():
+        items = await read_batch_items(files, BATCH_MAX_FILES, BATCH_MAX_TOTAL_SIZE)
+
+    results = [None] * len(items)
+    to_analyze = []
+    for index, (filename, content_type, contents, error) in enumerate(items):
+        if error is not None:
+            results[index] = {"filename": filename, "error": error}
+            continue
+        # Identical uploads skip decode and inference entirely
+        cache_key = result_cache.key(contents)
+        cached_result = await result_cache.get(cache_key)
+        if cached_result is not None:
+            results[index] = {"filename": filename, **cached_result, "cached": True, "near_duplicate": False}
+            continue
+        to_analyze.append((index, cache_key))
+
+    # With tiling, a large batch gets fewer tiles per image than /moderate
+    # does; those results are returned but not cached, so the cache only
+    # ever holds what a single upload would have been given
+    cacheable = backend.full_analysis(len(to_analyze))
+    try:
+        analyzed = await backend.analyze_batch([items[index][2] for index, _ in to_analyze])
+    except PoolSaturatedError:
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy. Please try again later."
+        )
+    except ModelNotReadyError:
+        raise HTTPException(
+            status_code=503,
+            detail="Model is loading. Please try again later."
+        )
+
+    for (index, cache_key), outcome in zip(to_analyze, analyzed):
+        filename = items[index][0]
+        if isinstance(outcome, Exception):
+            results[index] = {"filename": filename, "error": str(outcome)}
+            continue
+        analysis_result = outcome
+        near_duplicate = analysis_result.pop("near_duplicate")
+        if cacheable:
+            with DB_WRITE_STAGE.time():
+                await result_cache.set(cache_key, analysis_result)
+        results[index] = {
+            "filename": filename,
+            **analysis_result,
+            "cached": False,
+            "near_duplicate": near_duplicate
+        }
+
+    # Record usage for every image that was moderated; the usage buffer
+    # writes them with insert_many
+    now = datetime.utcnow()
+    for index, result in enumerate(results):
+        if "error" not in result:
+            usage_buffer.record(UsageRecord(
+                token=token_data["token"],
+                endpoint="moderate/batch",
+                timestamp=now,
+                file_size=len(items[index][2]),
+                file_type=items[index][1]
+            ))
+
+    return {"results": results}
+
+@router.post("/taxonomy/reload")
+async def reload_taxonomy(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Recompile the label taxonomy from disk without a restart (admin only)"""
+    await verify_admin_token(request, credentials.credentials)
+    try:
+        await apply_taxonomy_reload()
+    except TaxonomyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Under the pre-fork server (server.py) the master passes the reload on
+    # to the other workers and to workers it starts later
+    master_pid = os.getenv("SERVER_MASTER_PID")
+    if master_pid:
+        os.kill(int(master_pid), signal.SIGUSR1)
+    return {**taxonomy.stats(), "all_workers": bool(master_pid)}
+
+@router.get("/stats")
+async def moderation_stats(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """Inference batching, pool and cache metrics (admin only)"""
+    await verify_admin_token(request, credentials.credentials)
+    return {
+        "backend": backend.stats(),
+        "taxonomy": taxonomy.stats(),
+        "batcher": batcher.stats(),
+        "pool": inference_pool.stats(),
+        "result_cache": result_cache.stats(),
+        "near_duplicates": near_duplicates.stats() if near_duplicates else None,
+        "usage_buffer": usage_buffer.stats(),
+        "jobs": job_workers.stats(),
+        "uploads": upload_stats.stats()
+    }
\ No newline at end of file
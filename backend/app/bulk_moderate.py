@@ -0,0 +1,446 @@
+"""
+Moderate a directory tree, a zip/tar archive or a JSONL manifest offline,
+straight through the analyzer: no HTTP, no auth, no MongoDB.
+
+Files are read by one thread into a bounded prefetch queue, decoded in
+parallel worker processes and run through the model in batches. Results are
+written in input order as JSONL or Parquet, and a checkpoint next to the
+output lets an interrupted run pick up where it stopped.
+
+Usage (from the app directory):
+    python bulk_moderate.py /data/images --output results.jsonl
+    python bulk_moderate.py photos.tar.gz --output results --format parquet
+    python bulk_moderate.py manifest.jsonl --output results.jsonl --resume
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.archive import IMAGE_EXTENSIONS
+from services.preprocessing import MODEL_INPUT_SIZE, BatchArena, load_frames, to_pixels
+from services.scoring import CATEGORIES
+from services.upload import sniff_image_type
+
+logger = logging.getLogger("bulk_moderate")
+
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(5 * 1024 * 1024)))
+
+# (key, loader) per input; the loader is only called for items not yet done.
+# Loaders take an optional maximum size and check it before reading.
+Item = Tuple[str, Callable[..., bytes]]
+
+
+class BulkError(Exception):
+    """Raised for unusable sources, outputs or checkpoints."""
+
+
+class FileTooLargeError(Exception):
+    """Raised by a loader when its input is larger than the maximum size."""
+
+
+def check_size(size: int, max_size: Optional[int]) -> None:
+    if max_size is not None and size > max_size:
+        raise FileTooLargeError(f"File exceeds maximum allowed size of {max_size/1024/1024}MB")
+
+
+def read_file(path: str, max_size: Optional[int] = None) -> bytes:
+    with open(path, "rb") as f:
+        check_size(os.fstat(f.fileno()).st_size, max_size)
+        if max_size is None:
+            return f.read()
+        # The file may have grown since the check
+        contents = f.read(max_size + 1)
+    check_size(len(contents), max_size)
+    return contents
+
+
+def read_zip_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo, max_size: Optional[int] = None) -> bytes:
+    check_size(info.file_size, max_size)
+    return archive.read(info)
+
+
+def read_tar_member(archive: tarfile.TarFile, info: tarfile.TarInfo, max_size: Optional[int] = None) -> bytes:
+    check_size(info.size, max_size)
+    return archive.extractfile(info).read()
+
+
+def iter_directory(root: str) -> Iterator[Item]:
+    """Image files under `root`, in a stable (sorted) order."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, name)
+                yield os.path.relpath(path, root), partial(read_file, path)
+
+
+def iter_archive(path: str) -> Iterator[Item]:
+    """Image members of a zip or tar archive, in archive order, read one at a time."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield info.filename, partial(read_zip_member, archive, info)
+        return
+    # Stream mode: members are read in order without seeking back
+    with tarfile.open(path, mode="r|*") as archive:
+        for info in archive:
+            if info.isfile() and info.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield info.name, partial(read_tar_member, archive, info)
+
+
+def iter_manifest(path: str, path_key: str = "path", id_key: str = "id") -> Iterator[Item]:
+    """
+    One JSON object per line naming an image by `path_key`; relative paths
+    are resolved against the manifest's directory. `id_key` (falling back to
+    the path) becomes the result key.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+                image_path = entry[path_key]
+            except (ValueError, KeyError, TypeError):
+                raise BulkError(f"{path}:{number}: expected a JSON object with a {path_key!r} field")
+            key = str(entry.get(id_key) or image_path)
+            yield key, partial(read_file, os.path.join(base, image_path))
+
+
+def iter_source(source: str, path_key: str = "path", id_key: str = "id") -> Iterator[Item]:
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if source.lower().endswith((".jsonl", ".ndjson")):
+        return iter_manifest(source, path_key, id_key)
+    if zipfile.is_zipfile(source) or tarfile.is_tarfile(source):
+        return iter_archive(source)
+    raise BulkError(f"{source}: not a directory, zip/tar archive or .jsonl manifest")
+
+
+def decode_pixels(contents: bytes) -> np.ndarray:
+    """Decode one image into uint8 (frames, 224, 224, 3) pixels; runs in a worker process."""
+    return to_pixels(load_frames(contents, MODEL_INPUT_SIZE))
+
+
+class JsonlWriter:
+    """Appends one JSON object per result; resuming truncates anything past the checkpoint."""
+
+    def __init__(self, path: str, state: Optional[Dict[str, Any]] = None):
+        self.path = path
+        self._file = open(path, "r+b" if state else "wb")
+        if state:
+            self._file.truncate(state["offset"])
+            self._file.seek(state["offset"])
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._file.write(b"".join(json.dumps(row).encode() + b"\n" for row in rows))
+
+    def commit(self) -> Dict[str, Any]:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"offset": self._file.tell()}
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Writes a directory of part-NNNNN.parquet files, one per commit, since a
+    Parquet file cannot be appended to. Needs pyarrow.
+    """
+
+    def __init__(self, path: str, state: Optional[Dict[str, Any]] = None):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise BulkError("Parquet output needs pyarrow (pip install pyarrow)")
+        self._pa, self._pq = pa, pq
+        self.schema = pa.schema([
+            ("key", pa.string()),
+            ("safe", pa.bool_()),
+            ("confidence", pa.float64()),
+            ("categories", pa.struct([(category, pa.float64()) for category in CATEGORIES])),
+            ("labels", pa.list_(pa.string())),
+            ("error", pa.string())
+        ])
+        self.path = path
+        self.parts = state["parts"] if state else 0
+        os.makedirs(path, exist_ok=True)
+        # Parts past the checkpoint were written by the interrupted run
+        for name in os.listdir(path):
+            if name.startswith("part-") and name.endswith(".parquet") and int(name[5:-8]) >= self.parts:
+                os.remove(os.path.join(path, name))
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, rows: List[Dict[str, Any]]) -> None:
+        self._rows.extend(rows)
+
+    def commit(self) -> Dict[str, Any]:
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self.schema)
+            part = os.path.join(self.path, f"part-{self.parts:05d}.parquet")
+            self._pq.write_table(table, part + ".tmp")
+            os.replace(part + ".tmp", part)
+            self.parts += 1
+            self._rows = []
+        return {"parts": self.parts}
+
+    def close(self) -> None:
+        pass
+
+
+WRITERS = {
+    "jsonl": JsonlWriter,
+    "parquet": ParquetWriter
+}
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        raise BulkError(f"Unreadable checkpoint {path}: {e}")
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    # Written aside and renamed, so a crash never leaves half a checkpoint
+    with open(path + ".tmp", "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(path + ".tmp", path)
+
+
+class Progress:
+    """Counts results and logs images/sec every `interval` seconds."""
+
+    def __init__(self, interval: float, already_done: int = 0):
+        self.interval = interval
+        self.already_done = already_done
+        self.processed = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def add(self, rows: List[Dict[str, Any]]) -> None:
+        self.processed += len(rows)
+        self.errors += sum(1 for row in rows if row.get("error"))
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            logger.info("%s", self.summary())
+
+    @property
+    def images_per_second(self) -> float:
+        return self.processed / max(time.perf_counter() - self.started, 1e-9)
+
+    def summary(self) -> str:
+        return (
+            f"{self.already_done + self.processed} done ({self.processed} this run, {self.errors} errors), "
+            f"{self.images_per_second:.1f} images/s"
+        )
+
+
+class BulkRunner:
+    """
+    Turns decoded images into result rows, one model batch at a time.
+    Images are collected until their frames fill a batch, packed into a
+    reused arena, and scored with the same code the API uses.
+    """
+
+    def __init__(self, batch_size: int):
+        from services.image_analyzer import build_result, merge_results, predict_batch
+
+        self.batch_size = batch_size
+        self._build_result = build_result
+        self._merge_results = merge_results
+        self._predict_batch = predict_batch
+        self._arena = BatchArena(batch_size)
+        self._pending: List[Tuple[str, Union[np.ndarray, str]]] = []
+        self._frames = 0
+
+    def add(self, key: str, pixels: Union[np.ndarray, str]) -> List[Dict[str, Any]]:
+        """Queue one image (its pixels, or an error message); returns any rows completed."""
+        self._pending.append((key, pixels))
+        if not isinstance(pixels, str):
+            self._frames += len(pixels)
+        return self.flush() if self._frames >= self.batch_size else []
+
+    def flush(self) -> List[Dict[str, Any]]:
+        pending, self._pending, self._frames = self._pending, [], 0
+        images = [pixels for _, pixels in pending if not isinstance(pixels, str)]
+        predictions = self._predict_batch(self._arena.pack(images)) if images else []
+
+        rows, offset = [], 0
+        for key, pixels in pending:
+            if isinstance(pixels, str):
+                rows.append({"key": key, "error": pixels})
+                continue
+            result = self._merge_results([self._build_result(row) for row in predictions[offset:offset + len(pixels)]])
+            offset += len(pixels)
+            rows.append({"key": key, **result})
+        return rows
+
+
+def read_ahead(items: Iterator[Item], skip: int, out: "queue.Queue", max_file_size: int) -> None:
+    """Reader thread: load inputs in order into the bounded queue, then a None sentinel."""
+    try:
+        for index, (key, load) in enumerate(items):
+            if index < skip:
+                continue
+            try:
+                # Sizes are checked before anything is read
+                contents = load(max_file_size)
+                error = None
+                if sniff_image_type(contents) is None:
+                    contents, error = None, "File content is not a supported image"
+            except (FileTooLargeError, OSError, KeyError, tarfile.TarError, zipfile.BadZipFile) as e:
+                contents, error = None, str(e)
+            out.put((key, contents, error))
+        out.put(None)
+    except BaseException as e:
+        out.put(e)
+
+
+def run(args: argparse.Namespace) -> Progress:
+    from services.image_analyzer import result_fingerprint
+    from services.model_registry import registry
+
+    checkpoint_path = args.checkpoint or f"{args.output}.checkpoint.json"
+    checkpoint = load_checkpoint(checkpoint_path) if args.resume else None
+
+    # Load the model first: the fingerprint depends on the runtime in use.
+    # Bulk runs analyze whole images, without tiles.
+    registry.load()
+    fingerprint = result_fingerprint(tiled=False)
+    source = os.path.abspath(args.source)
+    if checkpoint is not None:
+        if checkpoint["source"] != source or checkpoint["format"] != args.format:
+            raise BulkError(f"{checkpoint_path} belongs to a run over {checkpoint['source']} ({checkpoint['format']})")
+        if checkpoint["fingerprint"] != fingerprint:
+            raise BulkError(
+                f"{args.output} was produced with {checkpoint['fingerprint']}, not {fingerprint}; "
+                "write the new results to another output"
+            )
+        logger.info("Resuming after %d images", checkpoint["completed"])
+    completed = checkpoint["completed"] if checkpoint else 0
+
+    writer = WRITERS[args.format](args.output, checkpoint["writer"] if checkpoint else None)
+    progress = Progress(args.report_interval, already_done=completed)
+    runner = BulkRunner(args.batch_size)
+
+    def commit() -> None:
+        save_checkpoint(checkpoint_path, {
+            "source": source,
+            "format": args.format,
+            "fingerprint": fingerprint,
+            "completed": completed,
+            "writer": writer.commit(),
+            "updated_at": datetime.utcnow().isoformat()
+        })
+
+    def emit(rows: List[Dict[str, Any]]) -> None:
+        nonlocal completed, uncommitted
+        if rows:
+            writer.write(rows)
+            progress.add(rows)
+            completed += len(rows)
+            uncommitted += len(rows)
+            if uncommitted >= args.checkpoint_every:
+                commit()
+                uncommitted = 0
+
+    inputs: "queue.Queue" = queue.Queue(maxsize=args.prefetch)
+    reader = threading.Thread(
+        target=read_ahead,
+        args=(iter_source(args.source, args.path_key, args.id_key), completed, inputs, args.max_file_size),
+        daemon=True
+    )
+    reader.start()
+
+    # Spawned workers never inherit the model or TensorFlow's threads
+    decoding: deque = deque()
+    uncommitted = 0
+    context = multiprocessing.get_context("spawn")
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+            def finish_oldest() -> None:
+                key, decoded = decoding.popleft()
+                if isinstance(decoded, Future):
+                    try:
+                        decoded = decoded.result()
+                    except Exception as e:
+                        decoded = str(e) or type(e).__name__
+                emit(runner.add(key, decoded))
+
+            while True:
+                item = inputs.get()
+                if item is None:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                key, contents, error = item
+                decoding.append((key, error if error is not None else pool.submit(decode_pixels, contents)))
+                # Decoding runs ahead of inference by at most `prefetch` images
+                while len(decoding) >= args.prefetch:
+                    finish_oldest()
+            while decoding:
+                finish_oldest()
+            emit(runner.flush())
+    finally:
+        commit()
+        writer.close()
+    return progress
+
+
+def main() -> None:
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="Directory, zip/tar archive, or .jsonl manifest")
+    parser.add_argument("--output", required=True, help="Results file (jsonl) or directory (parquet)")
+    parser.add_argument("--format", choices=sorted(WRITERS), default="jsonl")
+    parser.add_argument("--resume", action="store_true", help="Continue from the output's checkpoint")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint path (default: OUTPUT.checkpoint.json)")
+    parser.add_argument("--checkpoint-every", type=int, default=1000, help="Images between checkpoints")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("BATCH_MAX_SIZE", "32")))
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Decode processes")
+    parser.add_argument("--prefetch", type=int, default=256, help="Images read/decoded ahead of inference")
+    parser.add_argument("--max-file-size", type=int, default=MAX_FILE_SIZE)
+    parser.add_argument("--path-key", default="path", help="Manifest field holding the image path")
+    parser.add_argument("--id-key", default="id", help="Manifest field used as the result key")
+    parser.add_argument("--report-interval", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+    args.prefetch = max(args.prefetch, 1)
+    args.checkpoint_every = max(args.checkpoint_every, 1)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    try:
+        progress = run(args)
+    except BulkError as e:
+        sys.exit(f"error: {e}")
+    logger.info("Finished: %s", progress.summary())
+
+
+if __name__ == "__main__":
+    main()
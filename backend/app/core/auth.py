@@ -1,11 +1,154 @@
 from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+import asyncio
+import logging
+import os
 import secrets
-from datetime import datetime
-from typing import Optional
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
 from models.auth import Token
+from services.usage_buffer import usage_buffer
 
 security = HTTPBearer()
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "60"))
+TOKEN_CACHE_NEGATIVE_TTL = float(os.getenv("TOKEN_CACHE_NEGATIVE_TTL", "10"))
+TOKEN_CACHE_NEGATIVE_SIZE = int(os.getenv("TOKEN_CACHE_NEGATIVE_SIZE", "1000"))
+
+class TokenCache:
+    """
+    TTL + LRU cache of token documents, so authenticated requests don't pay a
+    MongoDB round-trip each time. Unknown tokens are cached too (for a
+    shorter TTL) so repeated bad credentials don't reach the database. They
+    get their own, smaller LRU, so a flood of random tokens can't evict the
+    valid ones.
+
+    Every invalidation bumps `generation`; a lookup that started before one
+    passes the generation it saw to `set`, which then drops the result
+    instead of caching a document that may have just been revoked.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl_seconds: float = 60,
+        negative_ttl_seconds: float = 10,
+        max_negative_entries: int = 1000
+    ):
+        self.max_entries = max(1, max_entries)
+        self.max_negative_entries = max(1, max_negative_entries)
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        # token -> (expires_at, document)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # token -> (expires_at, None) for known-invalid tokens
+        self._negative: "OrderedDict[str, tuple]" = OrderedDict()
+        self.generation = 0
+
+        # Metrics
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str):
+        """Return (found, document); document is None for cached invalid tokens."""
+        entries = self._entries if token in self._entries else self._negative
+        entry = entries.get(token)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del entries[token]
+            self.misses += 1
+            return False, None
+        entries.move_to_end(token)
+        if entry[1] is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return True, entry[1]
+
+    def set(self, token: str, document: Optional[Dict[str, Any]], generation: Optional[int] = None) -> None:
+        """Cache a lookup result, unless an invalidation happened since `generation`."""
+        if generation is not None and generation != self.generation:
+            return
+        if document is not None:
+            entries, limit, ttl = self._entries, self.max_entries, self.ttl_seconds
+            self._negative.pop(token, None)
+        else:
+            entries, limit, ttl = self._negative, self.max_negative_entries, self.negative_ttl_seconds
+            self._entries.pop(token, None)
+        entries[token] = (time.monotonic() + ttl, document)
+        entries.move_to_end(token)
+        while len(entries) > limit:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Drop one token, or everything when no token is given."""
+        self.invalidations += 1
+        self.generation += 1
+        if token is None:
+            self._entries.clear()
+            self._negative.clear()
+        else:
+            self._entries.pop(token, None)
+            self._negative.pop(token, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "negative_entries": len(self._negative),
+            "max_negative_entries": self.max_negative_entries,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0
+        }
+
+token_cache = TokenCache(
+    max_entries=TOKEN_CACHE_SIZE,
+    ttl_seconds=TOKEN_CACHE_TTL,
+    negative_ttl_seconds=TOKEN_CACHE_NEGATIVE_TTL,
+    max_negative_entries=TOKEN_CACHE_NEGATIVE_SIZE
+)
+
+async def find_token(db, token: str) -> Optional[dict]:
+    """Look up a token document, going to MongoDB only on a cache miss."""
+    found, token_doc = token_cache.get(token)
+    if not found:
+        generation = token_cache.generation
+        token_doc = await db.tokens.find_one({"token": token})
+        # Skipped if the token was revoked or changed while we were reading it
+        token_cache.set(token, token_doc, generation)
+    return dict(token_doc) if token_doc is not None else None
+
+async def watch_token_changes(db) -> None:
+    """
+    Invalidate cached tokens when another replica inserts, updates or deletes
+    them. Requires MongoDB to run as a replica set; otherwise the watcher
+    logs the error and exits, and only the TTL bounds staleness.
+    """
+    try:
+        async with db.tokens.watch(full_document="updateLookup") as stream:
+            async for change in stream:
+                document = change.get("fullDocument") or {}
+                if "token" in document:
+                    token_cache.invalidate(document["token"])
+                else:
+                    # Delete events only carry the _id, so drop everything
+                    token_cache.invalidate()
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.warning("Token change stream stopped: %s", e)
 
 def generate_token() -> str:
     """Generate a secure random token."""
@@ -24,7 +167,7 @@ async def get_current_token(
         )
     
     token = credentials.credentials
-    token_doc = await request.app.mongodb.tokens.find_one({"token": token})
+    token_doc = await find_token(request.app.mongodb, token)
     
     if not token_doc:
         raise HTTPException(
@@ -33,11 +176,8 @@ async def get_current_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Update last used timestamp
-    await request.app.mongodb.tokens.update_one(
-        {"token": token},
-        {"$set": {"last_used": datetime.utcnow()}}
-    )
+    # Update last used timestamp (coalesced and written by the usage buffer)
+    usage_buffer.touch(token)
     
     return Token(**token_doc)
 
@@ -52,7 +192,7 @@ async def require_admin_token(token: Token = Depends(get_current_token)) -> Toke
 
 async def verify_token(request: Request, token: str) -> dict:
     """Verify if a token is valid and return its data"""
-    token_data = await request.app.mongodb.tokens.find_one({"token": token})
+    token_data = await find_token(request.app.mongodb, token)
     if not token_data:
         raise HTTPException(status_code=401, detail="Invalid token")
     return token_data
@@ -0,0 +1,97 @@
+import json
+import re
+from typing import Dict, Optional
+
+
+class _BodyTooLarge(Exception):
+    pass
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware that caps request body size per path.
+
+    A limit covers its path and everything below it ("/moderate" also covers
+    "/moderate/" and "/moderate/taxonomy/reload"); the longest matching path
+    wins, so "/moderate/batch" can have its own.
+
+    Requests whose Content-Length already exceeds the limit are answered with
+    413 before any of the body is read. Bodies without a usable Content-Length
+    are counted as they stream in and cut off with 413 as soon as they cross
+    the limit, so an oversized upload is never spooled in full.
+    """
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = {self._normalize(path): limit for path, limit in limits.items()}
+
+    @staticmethod
+    def _normalize(path: str) -> str:
+        return re.sub(r"/{2,}", "/", path).rstrip("/") or "/"
+
+    def limit_for(self, path: str) -> Optional[int]:
+        path = self._normalize(path)
+        while True:
+            if path in self.limits:
+                return self.limits[path]
+            if path == "/":
+                return None
+            path = path.rsplit("/", 1)[0] or "/"
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limit_for(scope.get("path", "/")) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # Once the limit is hit, whatever error the app produced is
+            # replaced by our 413
+            if exceeded:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded and not response_started:
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int) -> None:
+        body = json.dumps({
+            "detail": f"Request body exceeds maximum allowed size of {limit/1024/1024:.1f}MB"
+        }).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,336 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond stages to slow uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (labels, value) pairs of one metric, as produced at scrape time
+Samples = List[Tuple[Dict[str, str], float]]
+# (name, type, help, samples) for metrics computed by a collector
+Family = Tuple[str, str, str, Samples]
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+class _Value:
+    """A counter or gauge value for one label combination."""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _Timer:
+    __slots__ = ("_observe", "_started")
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+
+    def __enter__(self) -> "_Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._observe(time.perf_counter() - self._started)
+
+
+class _HistogramValue:
+    """Bucket counts, sum and count for one label combination."""
+
+    __slots__ = ("bounds", "counts", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bound plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        """Context manager that observes the seconds spent inside it."""
+        return _Timer(self.observe)
+
+
+class Metric:
+    """
+    Base for metrics with optional labels. `labels(*values)` returns the
+    child for one label combination; hot paths should look children up once
+    and keep them. Unlabelled metrics forward inc/set/observe to their only
+    child.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._only = self.labels()
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values: Any):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for key, child in list(self._children.items()):
+            yield self.name, dict(zip(self.labelnames, key)), child.value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._only.inc(amount)
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._only.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._only.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._only.set(value)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry=None
+    ):
+        self.bounds = tuple(sorted(float(bound) for bound in buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self._only.observe(value)
+
+    def time(self) -> _Timer:
+        return self._only.time()
+
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class MetricsRegistry:
+    """
+    Metrics of this process, rendered in the Prometheus text format.
+
+    Besides the metrics updated as work happens, collectors are called at
+    scrape time. They turn the counters that components already keep in
+    their stats() into metrics, which costs nothing between scrapes.
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def register(self, metric: Metric) -> None:
+        self._metrics.append(metric)
+
+    def register_collector(self, collector: Callable[[], Iterable[Family]]) -> None:
+        self._collectors.append(collector)
+
+    def register_stats(
+        self,
+        prefix: str,
+        stats: Callable[[], Dict[str, Any]],
+        counters: Sequence[str] = (),
+        gauges: Sequence[str] = (),
+        documentation: str = ""
+    ) -> None:
+        """Expose numeric fields of a stats() dict as `<prefix>_<field>` metrics."""
+        def collect() -> Iterable[Family]:
+            values = stats()
+            for kind, fields in (("counter", counters), ("gauge", gauges)):
+                for field in fields:
+                    value = values.get(field)
+                    if isinstance(value, (int, float)):
+                        yield f"{prefix}_{field}", kind, documentation or f"{prefix} {field}", [({}, float(value))]
+        self.register_collector(collect)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by method, route template and status", ["method", "route", "status"]
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by method and route template", ["method", "route"]
+)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+# Units differ by stage: read is timed per request, decode, mapping and
+# db_write per image, preprocess (normalizing into the batch) and inference
+# per model batch
+STAGE_DURATION = Histogram(
+    "moderation_stage_duration_seconds", "Time spent in each moderation stage", ["stage"]
+)
+MODEL_BATCH_SIZE = Histogram(
+    "model_batch_size", "Images per model forward pass", buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+TILES_PER_IMAGE = Histogram(
+    "moderation_tiles_per_image", "Model inputs analyzed per image in tiled mode, after early stopping",
+    buckets=(1, 2, 3, 5, 10, 17, 33)
+)
+MONGODB_COMMAND_DURATION = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by command and outcome", ["command", "outcome"]
+)
+
+
+def stage_timer(stage: str) -> _HistogramValue:
+    """The STAGE_DURATION child for `stage`; use `with stage_timer(...).time():`."""
+    return STAGE_DURATION.labels(stage)
+
+
+def route_template(scope) -> str:
+    """
+    The matched route's path with parameter values put back as "{name}",
+    rebuilt from the request path so it includes router prefixes.
+    """
+    if "endpoint" not in scope:
+        return "unmatched"
+    path_params = scope.get("path_params") or {}
+    if not path_params:
+        return scope["path"]
+    names = {str(value): name for name, value in path_params.items()}
+    return "/".join(
+        "{" + names[segment] + "}" if segment in names else segment
+        for segment in scope["path"].split("/")
+    )
+
+
+# Anything else is labelled "other", so junk methods can't add series
+HTTP_METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording in-flight requests plus a latency histogram
+    and a counter per route. Routes are labelled by their template
+    ("/moderate/jobs/{job_id}"), never the raw path, so label cardinality
+    stays bounded; requests that match no route share "unmatched". The
+    metric children for each (method, route) are looked up once and kept.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._series: Dict[Tuple[str, str], Tuple[_HistogramValue, Dict[int, _Value]]] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            method = scope["method"] if scope["method"] in HTTP_METHODS else "other"
+            key = (method, route_template(scope))
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = (HTTP_REQUEST_DURATION.labels(*key), {})
+            series[0].observe(elapsed)
+            counter = series[1].get(status)
+            if counter is None:
+                counter = series[1][status] = HTTP_REQUESTS.labels(*key, status)
+            counter.inc()
@@ -1,36 +1,158 @@
 from fastapi import Request, HTTPException
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
-from typing import Dict, Tuple
-import asyncio
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import threading
+import time
+
+from core.auth import find_token
+
+class InMemoryBackend:
+    """
+    Sliding-window counter kept in process memory.
+
+    Each key holds only the current and previous window counts, so memory
+    per key is constant regardless of request rate. Keys are spread over
+    `shards` dicts, each with its own lock, and keys idle for two full
+    windows are swept out periodically. Limits are per process; use a
+    shared backend to enforce them across workers. Also serves as the
+    stand-in backend for tests.
+    """
+
+    def __init__(self, shards: int = 16, sweep_every: int = 1000):
+        self._shards: List[Dict[str, list]] = [{} for _ in range(shards)]
+        self._locks = [threading.Lock() for _ in range(shards)]
+        self._ops = [0] * shards
+        self.sweep_every = sweep_every
+
+    def _shard(self, key: str) -> int:
+        return hash(key) % len(self._shards)
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        """Count one request; return (allowed, seconds until retry)."""
+        now = time.time()
+        current_window = int(now // window)
+        elapsed = now - current_window * window
+        shard_index = self._shard(key)
+        shard = self._shards[shard_index]
+
+        with self._locks[shard_index]:
+            self._ops[shard_index] += 1
+            if self._ops[shard_index] >= self.sweep_every:
+                self._ops[shard_index] = 0
+                self._sweep(shard, now)
+
+            # [window index, count in that window, count in the window before,
+            #  time after which the key no longer affects any decision]
+            entry = shard.get(key)
+            if entry is None or entry[0] < current_window - 1:
+                entry = shard[key] = [current_window, 0, 0, 0.0]
+            elif entry[0] == current_window - 1:
+                entry[:3] = [current_window, 0, entry[1]]
+            entry[3] = (current_window + 2) * window
+
+            allowed, retry_after = _evaluate(entry[1], entry[2], limit, window, elapsed)
+            if allowed:
+                entry[1] += 1
+            return allowed, retry_after
+
+    @staticmethod
+    def _sweep(shard: Dict[str, list], now: float) -> None:
+        idle = [key for key, entry in shard.items() if entry[3] < now]
+        for key in idle:
+            del shard[key]
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+class MongoBackend:
+    """
+    Sliding-window counter stored in a MongoDB collection, so every uvicorn
+    worker and replica shares the same counts. One document per key per
+    window, incremented atomically and expired by a TTL index on
+    `expires_at`.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def hit(self, key: str, limit: int, window: float) -> Tuple[bool, float]:
+        now = time.time()
+        current_window = int(now // window)
+        elapsed = now - current_window * window
+
+        current = await self.collection.find_one_and_update(
+            {"_id": f"{key}:{current_window}"},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "expires_at": datetime.utcnow() + timedelta(seconds=2 * window)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        previous = await self.collection.find_one({"_id": f"{key}:{current_window - 1}"})
+
+        allowed, retry_after = _evaluate(
+            current["count"] - 1, previous["count"] if previous else 0, limit, window, elapsed
+        )
+        if not allowed:
+            # Rejected requests shouldn't count against the window
+            await self.collection.update_one({"_id": f"{key}:{current_window}"}, {"$inc": {"count": -1}})
+        return allowed, retry_after
+
+def _evaluate(current: int, previous: int, limit: int, window: float, elapsed: float) -> Tuple[bool, float]:
+    """
+    Decide whether one more request fits, weighting the previous window by
+    how much of it still overlaps the sliding window.
+    """
+    weight = 1.0 - elapsed / window
+    if previous * weight + current + 1 <= limit:
+        return True, 0.0
+    if current + 1 > limit or previous == 0:
+        return False, window - elapsed
+    # Time until the previous window's share has decayed enough
+    needed_weight = (limit - current - 1) / previous
+    return False, max(0.0, window * (1.0 - needed_weight) - elapsed)
 
 class RateLimiter:
-    def __init__(self, requests_per_minute: int = 60):
+    def __init__(
+        self,
+        requests_per_minute: int = 60,
+        backend=None,
+        token_requests_per_minute: Optional[int] = None,
+        window_seconds: float = 60
+    ):
         self.requests_per_minute = requests_per_minute
-        self.requests: Dict[str, list] = {}
-        self.lock = asyncio.Lock()
-    
+        self.token_requests_per_minute = token_requests_per_minute
+        self.window_seconds = window_seconds
+        self.backend = backend or InMemoryBackend()
+
+    async def _client_key(self, request: Request) -> Tuple[str, int]:
+        """
+        Key authenticated requests by token, using the token's own
+        `requests_per_minute` quota when it has one, and everything else by
+        client IP.
+        """
+        if self.token_requests_per_minute is not None:
+            scheme, _, token = request.headers.get("authorization", "").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                token_doc = await find_token(request.app.mongodb, token)
+                if token_doc:
+                    limit = token_doc.get("requests_per_minute") or self.token_requests_per_minute
+                    digest = hashlib.sha256(token.encode()).hexdigest()[:32]
+                    return f"token:{digest}", limit
+        return f"ip:{request.client.host}", self.requests_per_minute
+
     async def check_rate_limit(self, request: Request) -> None:
         """Check if the request should be rate limited."""
-        client_ip = request.client.host
-        async with self.lock:
-            now = datetime.utcnow()
-            minute_ago = now - timedelta(minutes=1)
-            
-            # Clean up old requests
-            if client_ip in self.requests:
-                self.requests[client_ip] = [
-                    req_time for req_time in self.requests[client_ip]
-                    if req_time > minute_ago
-                ]
-            
-            # Check rate limit
-            if client_ip in self.requests and len(self.requests[client_ip]) >= self.requests_per_minute:
-                raise HTTPException(
-                    status_code=429,
-                    detail="Too many requests. Please try again later."
-                )
-            
-            # Add new request
-            if client_ip not in self.requests:
-                self.requests[client_ip] = []
-            self.requests[client_ip].append(now) 
\ No newline at end of file
+        key, limit = await self._client_key(request)
+        allowed, retry_after = await self.backend.hit(key, limit, self.window_seconds)
+        if not allowed:
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(max(1, int(retry_after + 0.5)))}
+            )
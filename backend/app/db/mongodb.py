@@ -1,17 +1,153 @@
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from pymongo import monitoring
+from pymongo.errors import OperationFailure, PyMongoError
+import asyncio
+import logging
 import os
+from typing import Optional
 from dotenv import load_dotenv
 
+from core.metrics import MONGODB_COMMAND_DURATION
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
 MONGODB_DB = os.getenv("MONGODB_DB", "image_moderation")
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 86400)))
+USAGE_BUCKET_RETENTION_SECONDS = int(os.getenv("USAGE_BUCKET_RETENTION_SECONDS", str(90 * 86400)))
+# Raw usage events expire only when they are being written and a retention
+# is set explicitly; rollups aren't backfilled from `usages`, so a TTL on an
+# existing deployment would delete all usage history from before the upgrade
+USAGE_RAW_EVENTS = os.getenv("USAGE_RAW_EVENTS", "false").lower() == "true"
+USAGE_RAW_RETENTION_SECONDS = int(os.getenv("USAGE_RAW_RETENTION_SECONDS", "0"))
+
+# Connection pool sizing and timeouts for the single shared client
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", "300000"))
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+MONGODB_STARTUP_TIMEOUT = float(os.getenv("MONGODB_STARTUP_TIMEOUT", "30"))
+
+class CommandTimer(monitoring.CommandListener):
+    """Feeds every command's server round-trip time into /metrics."""
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        MONGODB_COMMAND_DURATION.labels(event.command_name, "success").observe(event.duration_micros / 1e6)
+
+    def failed(self, event) -> None:
+        MONGODB_COMMAND_DURATION.labels(event.command_name, "failure").observe(event.duration_micros / 1e6)
 
-client = AsyncIOMotorClient(MONGODB_URI)
-db = client[MONGODB_DB]
+client: Optional[AsyncIOMotorClient] = None
+db: Optional[AsyncIOMotorDatabase] = None
+
+def connect() -> AsyncIOMotorDatabase:
+    """Create the process-wide client. Every module shares this one pool."""
+    global client, db
+    if client is None:
+        client = AsyncIOMotorClient(
+            MONGODB_URI,
+            maxPoolSize=MONGODB_MAX_POOL_SIZE,
+            minPoolSize=MONGODB_MIN_POOL_SIZE,
+            maxIdleTimeMS=MONGODB_MAX_IDLE_TIME_MS,
+            connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+            serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+            waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[CommandTimer()]
+        )
+        db = client[MONGODB_DB]
+    return db
+
+def close() -> None:
+    global client, db
+    if client is not None:
+        client.close()
+    client = None
+    db = None
+
+async def ping() -> bool:
+    """Readiness probe: True once the pool can reach a server."""
+    if db is None:
+        return False
+    try:
+        await db.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+async def wait_until_ready(timeout: float = MONGODB_STARTUP_TIMEOUT) -> None:
+    """Block startup until MongoDB answers, or raise after `timeout` seconds."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await ping():
+        if loop.time() >= deadline:
+            raise RuntimeError(f"MongoDB not reachable at {MONGODB_URI} after {timeout}s")
+        await asyncio.sleep(0.5)
+
+def raw_usage_index_options(raw_events: bool, retention_seconds: int) -> dict:
+    """Options for the `usages.timestamp` index: a TTL only when opted into."""
+    if raw_events and retention_seconds > 0:
+        return {"expireAfterSeconds": retention_seconds}
+    return {}
 
 # Create indexes
 async def create_indexes():
-    await db.tokens.create_index("token", unique=True)
-    await db.usages.create_index("token")
-    await db.usages.create_index("timestamp") 
\ No newline at end of file
+    indexes = [
+        (db.tokens, "token", {"unique": True}),
+        (db.tokens, [("created_at", 1), ("_id", 1)], {}),
+        (db.tokens, [("is_admin", 1), ("created_at", 1), ("_id", 1)], {}),
+        (db.usages, "token", {}),
+        (db.usages, "timestamp", raw_usage_index_options(USAGE_RAW_EVENTS, USAGE_RAW_RETENTION_SECONDS)),
+        (db.usage_buckets, [("token", 1), ("endpoint", 1), ("start", 1)], {"unique": True}),
+        (db.usage_buckets, "start", {"expireAfterSeconds": USAGE_BUCKET_RETENTION_SECONDS}),
+        (db.usage_rollups, [("token", 1), ("period", 1), ("start", 1)], {"unique": True}),
+        (db.usage_rollups, [("period", 1), ("start", 1), ("count", -1)], {}),
+        (db.moderation_cache, "created_at", {"expireAfterSeconds": RESULT_CACHE_TTL}),
+        (db.phash_index, [("fingerprint", 1), ("hash", 1)], {"unique": True}),
+        (db.rate_limits, "expires_at", {"expireAfterSeconds": 0}),
+        (db.jobs, [("status", 1), ("lease_until", 1), ("created_at", 1)], {}),
+        (db.jobs, "expires_at", {"expireAfterSeconds": 0}),
+        (db.job_images, [("job_id", 1), ("index", 1)], {"unique": True}),
+        (db.job_images, "created_at", {"expireAfterSeconds": JOB_RETENTION_SECONDS}),
+        (db.job_results, [("job_id", 1), ("index", 1)], {"unique": True}),
+        (db.job_results, "created_at", {"expireAfterSeconds": JOB_RETENTION_SECONDS})
+    ]
+    for collection, keys, options in indexes:
+        try:
+            await ensure_index(collection, keys, options)
+        except OperationFailure as e:
+            logger.error("Could not create index %s on %s: %s", keys, collection.name, e)
+
+# Server error codes for an index that exists with other options
+INDEX_CONFLICT_CODES = (85, 86)  # IndexOptionsConflict, IndexKeySpecsConflict
+
+async def ensure_index(collection, keys, options: dict) -> None:
+    """
+    create_index, except that an existing index on the same keys with a
+    different (or no) TTL is converted to the requested expiry rather than
+    left as it is, which would silently keep documents forever.
+    """
+    try:
+        await collection.create_index(keys, **options)
+        return
+    except OperationFailure as e:
+        if "expireAfterSeconds" not in options or e.code not in INDEX_CONFLICT_CODES:
+            raise
+    expire = options["expireAfterSeconds"]
+    key_pattern = {keys: 1} if isinstance(keys, str) else dict(keys)
+    try:
+        await collection.database.command(
+            "collMod", collection.name, index={"keyPattern": key_pattern, "expireAfterSeconds": expire}
+        )
+    except OperationFailure:
+        # Servers before 5.1 can't make an existing index a TTL index
+        await collection.drop_index(list(key_pattern.items()))
+        await collection.create_index(keys, **options)
+    logger.warning("Changed the TTL of index %s on %s to %ss", keys, collection.name, expire)
@@ -1,29 +1,136 @@
-from fastapi import FastAPI, HTTPException, Depends, Request
+import time
+
+_import_started = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
-from motor.motor_asyncio import AsyncIOMotorClient
+from fastapi.security import HTTPBearer
+from fastapi.responses import JSONResponse, PlainTextResponse
+from contextlib import asynccontextmanager
 from datetime import datetime
+import asyncio
 import os
 from dotenv import load_dotenv
-from core.rate_limit import RateLimiter
+from core.body_limit import BodySizeLimitMiddleware
+from core.metrics import CONTENT_TYPE, REGISTRY, MetricsMiddleware
+from core.rate_limit import InMemoryBackend, MongoBackend, RateLimiter
 from api.auth import router as auth_router
-from api.moderate import router as moderate_router
-from core.auth import verify_token
-from db.mongodb import db
+from api.jobs import router as jobs_router, JOB_MAX_TOTAL_SIZE
+from api.moderate import router as moderate_router, backend, bind_database, near_duplicates, result_cache
+from api.moderate import BATCH_MAX_TOTAL_SIZE, MAX_FILE_SIZE
+from core.auth import token_cache, watch_token_changes
+from db import mongodb
+from services.image_analyzer import batcher, inference_pool
+from services.jobs import job_workers
+from services.model_registry import registry
+from services.usage_buffer import usage_buffer
+
+# Time spent importing the app; TensorFlow is not part of it, the model
+# registry imports it in the background
+IMPORT_SECONDS = time.perf_counter() - _import_started
 
 # Load environment variables
 load_dotenv()
 
+# Initialize rate limiter. The "mongodb" backend shares counts across
+# workers and replicas; "memory" limits each process separately.
+RATE_LIMIT_REQUESTS = int(os.getenv("RATE_LIMIT_REQUESTS", "60"))
+RATE_LIMIT_TOKEN_REQUESTS = int(os.getenv("RATE_LIMIT_TOKEN_REQUESTS", "0")) or None
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+
+rate_limiter = RateLimiter(
+    requests_per_minute=RATE_LIMIT_REQUESTS,
+    backend=InMemoryBackend(),
+    token_requests_per_minute=RATE_LIMIT_TOKEN_REQUESTS
+)
+
+# /metrics in the Prometheus text format; components' own stats counters
+# are read at scrape time
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+
+REGISTRY.register_stats(
+    "moderation_batcher", batcher.stats,
+    counters=("batches_total", "items_total", "errors_total"),
+    gauges=("queue_depth", "max_queue_depth", "avg_queue_wait_ms")
+)
+REGISTRY.register_stats(
+    "moderation_inference_pool", inference_pool.stats,
+    counters=("admitted_total", "rejected_total"),
+    gauges=("pending", "max_pending", "background_pending", "max_background")
+)
+REGISTRY.register_stats(
+    "moderation_result_cache", result_cache.stats,
+    counters=("hits", "shared_hits", "misses"),
+    gauges=("entries", "hit_ratio")
+)
+if near_duplicates is not None:
+    REGISTRY.register_stats(
+        "moderation_near_duplicates", near_duplicates.stats,
+        counters=("hits", "misses"),
+        gauges=("entries", "hit_ratio")
+    )
+REGISTRY.register_stats(
+    "auth_token_cache", token_cache.stats,
+    counters=("hits", "negative_hits", "misses", "evictions", "invalidations"),
+    gauges=("entries", "negative_entries", "hit_ratio")
+)
+REGISTRY.register_stats(
+    "usage_buffer", usage_buffer.stats,
+    counters=("recorded_total", "flushed_total", "dropped_total", "rollup_dropped_total", "flush_errors_total"),
+    gauges=("buffered",)
+)
+REGISTRY.register_stats(
+    "moderation_jobs", job_workers.stats,
+    counters=("jobs_completed_total", "jobs_failed_total", "leases_lost_total", "items_processed_total"),
+    gauges=("workers",)
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the model in the background so liveness probes answer right away;
+    # backends that never call it (e.g. "fake", "vision") skip loading it
+    if backend.uses_model:
+        registry.start()
+
+    # One MongoDB client (and connection pool) for the whole process
+    app.mongodb = mongodb.connect()
+    await mongodb.wait_until_ready()
+    await mongodb.create_indexes()
+    bind_database(app.mongodb)
+    if RATE_LIMIT_BACKEND == "mongodb":
+        rate_limiter.backend = MongoBackend(app.mongodb.rate_limits)
+    if near_duplicates is not None:
+        await near_duplicates.load()
+
+    # Usage records and last_used updates are written behind the request
+    usage_buffer.start(app.mongodb)
+
+    # Background workers for /moderate/jobs; they share the MongoDB queue
+    # with every other replica
+    job_workers.start(app.mongodb, backend.analyze_batch)
+
+    # Cross-replica token cache invalidation (needs a replica set)
+    token_watcher = None
+    if os.getenv("TOKEN_CACHE_CHANGE_STREAM", "false").lower() == "true":
+        token_watcher = asyncio.create_task(watch_token_changes(app.mongodb))
+
+    yield
+
+    if token_watcher is not None:
+        token_watcher.cancel()
+    await job_workers.stop()
+    await usage_buffer.stop()
+    await batcher.stop()
+    inference_pool.shutdown()
+    mongodb.close()
+
 app = FastAPI(
     title="Image Moderation API",
     description="API for detecting and blocking harmful imagery",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
-# Initialize rate limiter
-rate_limiter = RateLimiter(requests_per_minute=60)
-
 # CORS middleware configuration
 app.add_middleware(
     CORSMiddleware,
@@ -33,25 +140,39 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Reject oversized upload bodies before they are parsed; the allowance
+# covers multipart framing around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+app.add_middleware(
+    BodySizeLimitMiddleware,
+    limits={
+        "/moderate": MAX_FILE_SIZE + MULTIPART_OVERHEAD,
+        "/moderate/batch": BATCH_MAX_TOTAL_SIZE + MULTIPART_OVERHEAD,
+        "/moderate/jobs": JOB_MAX_TOTAL_SIZE + MULTIPART_OVERHEAD
+    }
+)
+
 # Security bearer scheme
 security = HTTPBearer()
 
-# MongoDB connection
-@app.on_event("startup")
-async def startup_db_client():
-    app.mongodb_client = AsyncIOMotorClient(os.getenv("MONGODB_URI", "mongodb://localhost:27017"))
-    app.mongodb = app.mongodb_client[os.getenv("MONGODB_DB", "image_moderation")]
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    app.mongodb_client.close()
-
 # Rate limiting middleware
 @app.middleware("http")
 async def rate_limit_middleware(request: Request, call_next):
-    await rate_limiter.check_rate_limit(request)
+    # Exceptions raised in middleware bypass the handlers below, so respond here
+    try:
+        await rate_limiter.check_rate_limit(request)
+    except HTTPException as exc:
+        return JSONResponse(
+            status_code=exc.status_code,
+            content={"detail": exc.detail},
+            headers=exc.headers
+        )
     return await call_next(request)
 
+# Outermost, so latency includes rate limiting and body checks
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
 # Error handling
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -72,8 +193,32 @@ async def general_exception_handler(request: Request, exc: Exception):
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
+@app.get("/health/live")
+async def liveness_check():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    mongodb_ready = await mongodb.ping()
+    model_ready = registry.ready or not backend.uses_model
+    content = {
+        "status": "ready" if mongodb_ready and model_ready else "unavailable",
+        "mongodb": mongodb_ready,
+        "model": registry.stats(),
+        "import_seconds": IMPORT_SECONDS
+    }
+    if content["status"] != "ready":
+        return JSONResponse(status_code=503, content=content)
+    return content
+
+if METRICS_ENABLED:
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
 # Include routers
 app.include_router(auth_router, prefix="/auth", tags=["Authentication"])
+app.include_router(jobs_router, prefix="/moderate/jobs", tags=["Moderation"])
 app.include_router(moderate_router, prefix="/moderate", tags=["Moderation"])
 
 @app.get("/")
@@ -1,15 +1,33 @@
 from pydantic import BaseModel, Field
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Optional
 
 class TokenCreate(BaseModel):
     is_admin: bool = False
+    requests_per_minute: Optional[int] = None
+
+class TokenBulkCreate(BaseModel):
+    count: int = Field(ge=1, le=1000)
+    is_admin: bool = False
+    requests_per_minute: Optional[int] = None
+
+class TokenBulkRevoke(BaseModel):
+    tokens: List[str] = Field(min_length=1, max_length=1000)
 
 class Token(BaseModel):
     token: str
     is_admin: bool
     created_at: datetime
     last_used: Optional[datetime] = None
+    requests_per_minute: Optional[int] = None
+
+class TokenFields(BaseModel):
+    """A token as listed by GET /auth/tokens, which returns only the requested `fields`."""
+    token: Optional[str] = None
+    is_admin: Optional[bool] = None
+    created_at: Optional[datetime] = None
+    last_used: Optional[datetime] = None
+    requests_per_minute: Optional[int] = None
 
 class TokenResponse(BaseModel):
     token: str
@@ -21,4 +39,17 @@ class UsageRecord(BaseModel):
     endpoint: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     status: str = "success"
-    details: Optional[dict] = None 
\ No newline at end of file
+    file_size: Optional[int] = None
+    file_type: Optional[str] = None
+    details: Optional[dict] = None
+
+class UsageTotal(BaseModel):
+    token: str
+    count: int = 0
+    bytes: int = 0
+    endpoints: Dict[str, int] = {}
+
+class UsageReport(BaseModel):
+    period: str
+    start: datetime
+    tokens: List[UsageTotal] 
\ No newline at end of file
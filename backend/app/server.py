@@ -0,0 +1,414 @@
+"""
+Pre-fork production server: one master process and several uvicorn workers
+sharing a listening socket.
+
+The master imports the app and, when the model runtime survives fork()
+(TFLite; see services/runtimes.py), loads and warms up the model before
+forking. Workers then share the imported code, the interpreter and the
+mmap'd weights copy-on-write instead of each holding its own copy. With the
+Keras or ONNX runtimes each worker loads its own model after the fork, so
+memory grows with the worker count; export a TFLite model to share one
+(start.sh does this when several workers are asked for without a runtime).
+
+The master replaces workers that exit, and on SIGHUP restarts them one at a
+time, starting each replacement and waiting until it has finished startup
+before asking the old worker to drain its requests and exit. SIGTTIN and
+SIGTTOU add and remove a worker; SIGTERM and SIGINT stop everything
+gracefully.
+
+POST /moderate/taxonomy/reload recompiles the taxonomy in the worker that
+received it, which then sends SIGUSR1 to the master; the master reloads its
+own copy, for workers it forks later, and passes the signal on to every
+other worker.
+
+Every worker keeps its own in-process state (result cache, "memory" rate
+limits, /metrics, the compiled taxonomy), so run several workers with
+RATE_LIMIT_BACKEND=mongodb.
+
+Usage (from the app directory):
+    python server.py --workers 4
+    kill -HUP <master pid>    # graceful rolling restart
+    kill -USR1 <master pid>   # reload the taxonomy in every worker
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "7000"))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+# Load the model in the master before forking, when the runtime allows it
+SERVER_PRELOAD = os.getenv("SERVER_PRELOAD", "true").lower() == "true"
+# Seconds a stopping worker gets to finish in-flight requests
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30"))
+# Seconds a replacement worker gets to finish startup during a restart
+SERVER_STARTUP_TIMEOUT = float(os.getenv("SERVER_STARTUP_TIMEOUT", "120"))
+# Recycle a worker after this many requests (0: never)
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "0")) or None
+
+logger = logging.getLogger("server")
+
+
+def configure_threads(workers: int) -> None:
+    """
+    Split the cores between workers unless model threads are set explicitly,
+    so N workers don't each start a thread per core. Must run before the app
+    is imported, which reads the setting.
+    """
+    if workers > 1 and not os.getenv("MODEL_INTRA_OP_THREADS"):
+        os.environ["MODEL_INTRA_OP_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+
+
+def preload_model() -> bool:
+    """Load the model in this process if workers forked from it can use it."""
+    from api.moderate import backend
+    from services.model_registry import registry
+    from services.runtimes import FORK_SAFE_RUNTIMES
+
+    if not backend.uses_model:
+        return False
+    if registry.runtime not in FORK_SAFE_RUNTIMES:
+        logger.info(
+            "The %s runtime does not survive fork(); each worker loads its own model "
+            "(export a TFLite model to share one)", registry.runtime
+        )
+        return False
+    registry.load()
+    logger.info("Model loaded before forking: %s", registry.timings)
+    return True
+
+
+async def reload_taxonomy() -> None:
+    """Apply a taxonomy reload made in another process of this server."""
+    from api.moderate import apply_taxonomy_reload
+    from services.taxonomy import TaxonomyError
+
+    try:
+        await apply_taxonomy_reload()
+    except TaxonomyError as e:
+        logger.error("Taxonomy reload failed: %s", e)
+
+
+def bind_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class Worker:
+    def __init__(self, pid: int, ready_fd: int, taxonomy_generation: int = 0):
+        self.pid = pid
+        # Readable once the worker's lifespan startup has completed
+        self.ready_fd = ready_fd
+        self.ready = False
+        self.started_at = time.monotonic()
+        # The master's taxonomy generation when it was forked
+        self.taxonomy_generation = taxonomy_generation
+
+
+class Master:
+    """Forks, supervises and restarts the uvicorn worker processes."""
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int = 1,
+        graceful_timeout: int = 30,
+        startup_timeout: float = 120,
+        max_requests: Optional[int] = None,
+        log_level: str = "info"
+    ):
+        self.app = app
+        self.sock = sock
+        self.target = max(1, workers)
+        self.graceful_timeout = graceful_timeout
+        self.startup_timeout = startup_timeout
+        self.max_requests = max_requests
+        self.log_level = log_level
+        self.workers: Dict[int, Worker] = {}
+        self._signals: List[int] = []
+        self._stopping = False
+        self._failures = 0
+        self.taxonomy_generation = 0
+
+        # Metrics
+        self.spawned_total = 0
+        self.restarts_total = 0
+        self.crashes_total = 0
+        self.taxonomy_reloads_total = 0
+
+    # Worker side
+
+    def _run_worker(self, ready_fd: int) -> None:
+        import uvicorn
+
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU):
+            signal.signal(sig, signal.SIG_DFL)
+        # Taxonomy reloads arriving before startup finishes are resent by the master
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+        lifespan = self.app.router.lifespan_context
+
+        @asynccontextmanager
+        async def lifespan_with_ready(app):
+            async with lifespan(app) as state:
+                loop = asyncio.get_running_loop()
+                loop.add_signal_handler(signal.SIGUSR1, lambda: loop.create_task(reload_taxonomy()))
+                os.write(ready_fd, b"1")
+                os.close(ready_fd)
+                yield state
+
+        self.app.router.lifespan_context = lifespan_with_ready
+        config = uvicorn.Config(
+            self.app,
+            lifespan="on",
+            log_level=self.log_level,
+            limit_max_requests=self.max_requests,
+            timeout_graceful_shutdown=self.graceful_timeout
+        )
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    # Master side
+
+    def spawn(self) -> Worker:
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                self._run_worker(write_fd)
+            except BaseException:
+                logger.exception("Worker %d failed", os.getpid())
+                code = 1
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        worker = Worker(pid, read_fd, self.taxonomy_generation)
+        self.workers[pid] = worker
+        self.spawned_total += 1
+        logger.info("Started worker %d", pid)
+        return worker
+
+    def _poll_ready(self, timeout: float) -> None:
+        pending = {worker.ready_fd: worker for worker in self.workers.values() if worker.ready_fd >= 0}
+        if not pending:
+            time.sleep(timeout)
+            return
+        readable, _, _ = select.select(list(pending), [], [], timeout)
+        for fd in readable:
+            worker = pending[fd]
+            # An empty read means the worker exited before startup finished
+            worker.ready = os.read(fd, 1) == b"1"
+            os.close(fd)
+            worker.ready_fd = -1
+            if worker.ready:
+                self._failures = 0
+                if worker.taxonomy_generation != self.taxonomy_generation:
+                    self._signal_reload(worker)
+
+    def _forget(self, pid: int) -> Optional[Worker]:
+        worker = self.workers.pop(pid, None)
+        if worker is not None and worker.ready_fd >= 0:
+            os.close(worker.ready_fd)
+        return worker
+
+    def wait_ready(self, worker: Worker) -> bool:
+        deadline = time.monotonic() + self.startup_timeout
+        while worker.ready_fd >= 0 and time.monotonic() < deadline:
+            pid, _ = os.waitpid(worker.pid, os.WNOHANG)
+            if pid:
+                self._forget(pid)
+                return False
+            self._poll_ready(0.1)
+        return worker.ready
+
+    def stop(self, workers: List[Worker]) -> None:
+        """SIGTERM (uvicorn drains in-flight requests), then SIGKILL after the graceful timeout."""
+        for worker in workers:
+            self.workers.pop(worker.pid, None)
+            try:
+                os.kill(worker.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        remaining = {worker.pid: worker for worker in workers}
+        while remaining:
+            for pid in list(remaining):
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    done = pid
+                if done:
+                    worker = remaining.pop(pid)
+                    if worker.ready_fd >= 0:
+                        os.close(worker.ready_fd)
+            if remaining and time.monotonic() >= deadline:
+                for pid in remaining:
+                    logger.warning("Worker %d did not stop in time; killing it", pid)
+                    os.kill(pid, signal.SIGKILL)
+                deadline = float("inf")
+            time.sleep(0.05)
+
+    def restart(self) -> None:
+        """Replace every worker, one at a time, keeping capacity up throughout."""
+        for old in list(self.workers.values()):
+            if old.pid not in self.workers:
+                continue
+            new = self.spawn()
+            if not self.wait_ready(new):
+                logger.error("Replacement worker %d failed to start; keeping the remaining workers", new.pid)
+                if new.pid in self.workers:
+                    self.stop([new])
+                return
+            self.stop([old])
+            self.restarts_total += 1
+        logger.info("Restarted all workers")
+
+    def _signal_reload(self, worker: Worker) -> None:
+        try:
+            os.kill(worker.pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            return
+        worker.taxonomy_generation = self.taxonomy_generation
+
+    def reload_taxonomy(self) -> None:
+        """
+        Reload the taxonomy here, so workers forked from now on start with it,
+        and in every running worker. Workers still starting up are signalled
+        once they are ready; one that already has the new taxonomy (e.g. the
+        one that asked) finds it unchanged and keeps its caches.
+        """
+        asyncio.run(reload_taxonomy())
+        self.taxonomy_generation += 1
+        self.taxonomy_reloads_total += 1
+        for worker in list(self.workers.values()):
+            if worker.ready:
+                self._signal_reload(worker)
+        logger.info("Reloaded the taxonomy in all workers")
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            worker = self._forget(pid)
+            if worker is None:
+                continue
+            if not worker.ready:
+                self._failures += 1
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                logger.info("Worker %d exited", pid)  # e.g. after SERVER_MAX_REQUESTS
+            else:
+                self.crashes_total += 1
+                logger.warning("Worker %d died (status %d)", pid, status)
+
+    def _handle_signal(self, sig, frame) -> None:
+        self._signals.append(sig)
+
+    def run(self) -> None:
+        for sig in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU, signal.SIGUSR1):
+            signal.signal(sig, self._handle_signal)
+        # Tells workers where to send taxonomy reloads (api/moderate.py)
+        os.environ["SERVER_MASTER_PID"] = str(os.getpid())
+        logger.info("Master %d serving with %d workers", os.getpid(), self.target)
+
+        while not self._stopping:
+            self._reap()
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT):
+                    self._stopping = True
+                elif sig == signal.SIGHUP:
+                    self.restart()
+                elif sig == signal.SIGUSR1:
+                    self.reload_taxonomy()
+                elif sig == signal.SIGTTIN:
+                    self.target += 1
+                elif sig == signal.SIGTTOU and self.target > 1:
+                    self.target -= 1
+            if self._stopping:
+                break
+            if len(self.workers) > self.target:
+                newest = sorted(self.workers.values(), key=lambda worker: worker.started_at)
+                self.stop(newest[self.target:])
+            if len(self.workers) < self.target:
+                if self._failures:
+                    # Workers that die during startup are retried with backoff
+                    time.sleep(min(30, 2 ** (self._failures - 1)))
+                for _ in range(self.target - len(self.workers)):
+                    self.spawn()
+            self._poll_ready(0.5)
+
+        logger.info("Stopping %d workers", len(self.workers))
+        self.stop(list(self.workers.values()))
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "workers": len(self.workers),
+            "target": self.target,
+            "spawned_total": self.spawned_total,
+            "restarts_total": self.restarts_total,
+            "crashes_total": self.crashes_total,
+            "taxonomy_reloads_total": self.taxonomy_reloads_total
+        }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    parser.add_argument("--no-preload", action="store_true", help="load the model in each worker instead")
+    parser.add_argument("--graceful-timeout", type=int, default=SERVER_GRACEFUL_TIMEOUT)
+    parser.add_argument("--max-requests", type=int, default=SERVER_MAX_REQUESTS)
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+    configure_threads(args.workers)
+
+    from main import app
+
+    if SERVER_PRELOAD and not args.no_preload:
+        preload_model()
+    # Objects created so far are never collected, so the GC doesn't write to
+    # (and un-share) their pages in every worker
+    gc.collect()
+    gc.freeze()
+
+    master = Master(
+        app,
+        bind_socket(args.host, args.port),
+        workers=args.workers,
+        graceful_timeout=args.graceful_timeout,
+        startup_timeout=SERVER_STARTUP_TIMEOUT,
+        max_requests=args.max_requests,
+        log_level=args.log_level
+    )
+    master.run()
+    sys.exit(0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import io
+import mimetypes
+import tarfile
+import zipfile
+from typing import List, Tuple
+
+ARCHIVE_MIME_TYPES = {
+    "application/zip",
+    "application/x-zip-compressed",
+    "application/x-tar",
+    "application/gzip",
+    "application/x-gzip"
+}
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif")
+
+
+class ArchiveError(ValueError):
+    """Raised when an archive is malformed or exceeds the configured limits."""
+
+
+def is_archive(filename: str, content_type: str) -> bool:
+    return content_type in ARCHIVE_MIME_TYPES or (filename or "").lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def guess_image_type(name: str) -> str:
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def extract_images(
+    contents: bytes,
+    max_members: int,
+    max_member_size: int,
+    max_total_size: int
+) -> List[Tuple[str, bytes]]:
+    """
+    Return (name, bytes) for every image member of a zip or tar archive, in
+    archive order. Sizes are checked against the archive headers before
+    anything is decompressed, so oversized members are never inflated.
+    """
+    members: List[Tuple[str, bytes]] = []
+    total = 0
+
+    def check(name: str, size: int) -> None:
+        nonlocal total
+        if len(members) >= max_members:
+            raise ArchiveError(f"Archive holds more than the {max_members} images allowed")
+        if size > max_member_size:
+            raise ArchiveError(f"{name} exceeds maximum allowed size of {max_member_size/1024/1024}MB")
+        total += size
+        if total > max_total_size:
+            raise ArchiveError(f"Archive expands beyond {max_total_size/1024/1024}MB")
+
+    buffer = io.BytesIO(contents)
+    try:
+        if zipfile.is_zipfile(buffer):
+            with zipfile.ZipFile(buffer) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                        continue
+                    check(info.filename, info.file_size)
+                    members.append((info.filename, archive.read(info)))
+            return members
+
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer, mode="r:*") as archive:
+            for info in archive:
+                if not info.isfile() or not info.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                check(info.name, info.size)
+                members.append((info.name, archive.extractfile(info).read()))
+        return members
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ArchiveError(f"Invalid archive: {e}")
@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import os
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Union
+
+from services.image_analyzer import analyze_upload, analyze_uploads, result_fingerprint
+from services.scoring import CATEGORIES, SAFE_THRESHOLD, make_result
+from services.taxonomy import taxonomy
+from services.tiling import tile_budget
+from services.upload import Buffer
+
+# Which backend answers /moderate: "local", "vision", "fake" or "cascade"
+MODERATION_BACKEND = os.getenv("MODERATION_BACKEND", "local")
+
+# Cascade: the primary decides unless its highest category score lies within
+# CASCADE_BAND of SAFE_THRESHOLD, in which case the fallback is asked
+CASCADE_PRIMARY = os.getenv("CASCADE_PRIMARY", "local")
+CASCADE_FALLBACK = os.getenv("CASCADE_FALLBACK", "vision")
+CASCADE_BAND = float(os.getenv("CASCADE_BAND", "0.15"))
+
+# "google" talks to the Vision API; "stub" uses an in-process fake client
+VISION_CLIENT = os.getenv("VISION_CLIENT", "google")
+
+Outcome = Union[dict, Exception]
+
+
+class ModerationBackend(ABC):
+    """
+    Common interface for everything that can produce a moderation result.
+
+    Results use the shape built by services.scoring.make_result, plus
+    "backend" (the name of the backend that answered) and "near_duplicate"
+    (whether the verdict was reused from a perceptually similar image).
+    `analyze_batch` returns one entry per input in order; an item that fails
+    comes back as the exception rather than failing the whole batch.
+    """
+
+    name = "base"
+    # Whether answers need the in-process model, which is then loaded at startup
+    uses_model = False
+
+    @property
+    def fingerprint(self) -> str:
+        """Identifies the configuration behind a result, for cache keys."""
+        return self.name
+
+    def full_analysis(self, images: int) -> bool:
+        """Whether a batch of `images` is analyzed as each image would be alone, so results can be cached."""
+        return True
+
+    async def analyze(self, contents: Buffer) -> dict:
+        outcome = (await self.analyze_batch([contents]))[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    @abstractmethod
+    async def analyze_batch(self, contents_list: List[Buffer]) -> List[Outcome]:
+        ...
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name}
+
+    def _tag(self, result: dict, near_duplicate: bool = False) -> dict:
+        return {**result, "backend": self.name, "near_duplicate": near_duplicate}
+
+
+class LocalModelBackend(ModerationBackend):
+    """The in-process MobileNetV2 model, with optional near-duplicate reuse."""
+
+    name = "local"
+    uses_model = True
+
+    def __init__(self, near_duplicates=None):
+        self.near_duplicates = near_duplicates
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.name}:{result_fingerprint()}"
+
+    def full_analysis(self, images: int) -> bool:
+        # Large batches share the request's tile budget (services/tiling.py)
+        return tile_budget(images) == tile_budget()
+
+    async def analyze(self, contents: Buffer) -> dict:
+        result, near_duplicate = await analyze_upload(contents, self.near_duplicates)
+        return self._tag(result, near_duplicate)
+
+    async def analyze_batch(self, contents_list: List[Buffer]) -> List[Outcome]:
+        outcomes = await analyze_uploads(contents_list, self.near_duplicates)
+        return [
+            outcome if isinstance(outcome, Exception) else self._tag(*outcome)
+            for outcome in outcomes
+        ]
+
+
+class VisionBackend(ModerationBackend):
+    """Google Cloud Vision SafeSearch and labels (needs google-cloud-vision unless stubbed)."""
+
+    name = "vision"
+
+    def __init__(self, moderator=None):
+        if moderator is None:
+            from services.moderator import ImageModerator, StubVisionClient
+            moderator = ImageModerator(client=StubVisionClient() if VISION_CLIENT == "stub" else None)
+        self.moderator = moderator
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.name}:taxonomy={taxonomy.current.digest}"
+
+    async def analyze_batch(self, contents_list: List[Buffer]) -> List[Outcome]:
+        outcomes = await self.moderator.analyze_images(contents_list)
+        return [
+            outcome if isinstance(outcome, Exception) else self._tag(outcome)
+            for outcome in outcomes
+        ]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, **self.moderator.stats()}
+
+
+class FakeBackend(ModerationBackend):
+    """
+    Deterministic stand-in for tests and benchmarks. Scores are derived from
+    a hash of the image bytes, so the same image always gets the same result,
+    or are fixed when `scores` is given. `latency` simulates a slow backend.
+    """
+
+    name = "fake"
+
+    def __init__(self, scores: Optional[Dict[str, float]] = None, latency: float = 0.0):
+        self.scores = scores
+        self.latency = latency
+        self.calls_total = 0
+        self.images_total = 0
+
+    def score(self, contents: Buffer) -> dict:
+        if self.scores is not None:
+            categories = {category: float(self.scores.get(category, 0.0)) for category in CATEGORIES}
+        else:
+            digest = hashlib.blake2b(contents, digest_size=len(CATEGORIES)).digest()
+            categories = {category: value / 255 for category, value in zip(CATEGORIES, digest)}
+        return make_result(categories, ["fake"])
+
+    async def analyze_batch(self, contents_list: List[Buffer]) -> List[Outcome]:
+        self.calls_total += 1
+        self.images_total += len(contents_list)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return [self._tag(self.score(contents)) for contents in contents_list]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"name": self.name, "calls_total": self.calls_total, "images_total": self.images_total}
+
+
+class CascadeBackend(ModerationBackend):
+    """
+    Lets a cheap primary backend decide confident cases and sends only
+    uncertain images, whose highest category score lies within `band` of
+    SAFE_THRESHOLD, to an expensive fallback. If the fallback fails for an
+    item, the primary's verdict is kept. Results name the backend that
+    answered, and the stats show how much traffic the fallback was spared.
+    """
+
+    name = "cascade"
+
+    def __init__(self, primary: ModerationBackend, fallback: ModerationBackend, band: float = 0.15):
+        self.primary = primary
+        self.fallback = fallback
+        self.band = band
+        self.images_total = 0
+        self.escalated_total = 0
+        self.fallback_errors_total = 0
+
+    @property
+    def uses_model(self) -> bool:
+        return self.primary.uses_model or self.fallback.uses_model
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.name}({self.primary.fingerprint},{self.fallback.fingerprint},band={self.band})"
+
+    def full_analysis(self, images: int) -> bool:
+        return self.primary.full_analysis(images) and self.fallback.full_analysis(images)
+
+    def is_uncertain(self, result: dict) -> bool:
+        return abs((1 - result["confidence"]) - SAFE_THRESHOLD) <= self.band
+
+    async def analyze(self, contents: Buffer) -> dict:
+        # Single images keep the primary's single-image path (e.g. micro-batching)
+        result = await self.primary.analyze(contents)
+        self.images_total += 1
+        if not self.is_uncertain(result):
+            return result
+        self.escalated_total += 1
+        try:
+            return await self.fallback.analyze(contents)
+        except Exception:
+            self.fallback_errors_total += 1
+            return result
+
+    async def analyze_batch(self, contents_list: List[Buffer]) -> List[Outcome]:
+        outcomes = await self.primary.analyze_batch(contents_list)
+        uncertain = [
+            index for index, outcome in enumerate(outcomes)
+            if not isinstance(outcome, Exception) and self.is_uncertain(outcome)
+        ]
+        self.images_total += len(contents_list)
+        self.escalated_total += len(uncertain)
+        if uncertain:
+            escalated = await self.fallback.analyze_batch([contents_list[index] for index in uncertain])
+            for index, outcome in zip(uncertain, escalated):
+                if isinstance(outcome, Exception):
+                    self.fallback_errors_total += 1
+                    continue
+                outcomes[index] = outcome
+        return outcomes
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "band": self.band,
+            "images_total": self.images_total,
+            "escalated_total": self.escalated_total,
+            "fallback_errors_total": self.fallback_errors_total,
+            "escalation_ratio": self.escalated_total / self.images_total if self.images_total else 0.0,
+            "primary": self.primary.stats(),
+            "fallback": self.fallback.stats()
+        }
+
+
+BACKENDS = {
+    "local": LocalModelBackend,
+    "vision": VisionBackend,
+    "fake": FakeBackend
+}
+
+
+def create_backend(name: str, near_duplicates=None) -> ModerationBackend:
+    """Build the backend selected by name; "cascade" reads the CASCADE_* settings."""
+    if name == "cascade":
+        return CascadeBackend(
+            create_backend(CASCADE_PRIMARY, near_duplicates),
+            create_backend(CASCADE_FALLBACK, near_duplicates),
+            band=CASCADE_BAND
+        )
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown moderation backend: {name}")
+    if name == "local":
+        return LocalModelBackend(near_duplicates)
+    return BACKENDS[name]()
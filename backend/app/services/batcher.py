@@ -0,0 +1,140 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class BatchScheduler:
+    """
+    Collects single-image inference requests from concurrent coroutines into
+    batches and runs one forward pass per batch.
+
+    A batch is dispatched as soon as it holds `max_batch_size` items or the
+    oldest item has waited `max_wait_ms`, whichever comes first. If `runner`
+    is given, the forward pass is handed to it (e.g. an executor) instead of
+    running on the event loop. `collate` turns the queued items into the
+    model input (np.stack by default); its result only has to stay valid
+    until the forward pass returns, since batches run one at a time.
+    """
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        runner: Optional[Callable[..., Awaitable[Any]]] = None,
+        collate: Callable[[List[np.ndarray]], np.ndarray] = np.stack
+    ):
+        self.predict_fn = predict_fn
+        self.runner = runner
+        self.collate = collate
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.batch_sizes: Counter = Counter()
+        self.batches_total = 0
+        self.items_total = 0
+        self.errors_total = 0
+        self.queue_wait_seconds_total = 0.0
+        self.inference_seconds_total = 0.0
+        self.max_queue_depth = 0
+
+    def _ensure_started(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def submit(self, item: np.ndarray) -> np.ndarray:
+        """Queue a single preprocessed input and wait for its prediction row."""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    async def stop(self) -> None:
+        """Cancel the dispatch loop and fail any requests still waiting."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._queue is not None:
+            while not self._queue.empty():
+                _, future, _ = self._queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Batch scheduler stopped"))
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future, float]]:
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            # Drain whatever is already queued without yielding
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            started = time.perf_counter()
+            try:
+                inputs = self.collate([item for item, _, _ in batch])
+                outputs = await self._predict(inputs)
+            except Exception as e:
+                self.errors_total += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            self.batches_total += 1
+            self.items_total += len(batch)
+            self.batch_sizes[len(batch)] += 1
+            self.inference_seconds_total += finished - started
+            for index, (_, future, enqueued) in enumerate(batch):
+                self.queue_wait_seconds_total += started - enqueued
+                if not future.done():
+                    future.set_result(outputs[index])
+
+    async def _predict(self, inputs: np.ndarray) -> np.ndarray:
+        if self.runner is not None:
+            return await self.runner(self.predict_fn, inputs)
+        return self.predict_fn(inputs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return queue-depth and batch-size metrics for tuning."""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches_total": self.batches_total,
+            "items_total": self.items_total,
+            "errors_total": self.errors_total,
+            "avg_batch_size": self.items_total / self.batches_total if self.batches_total else 0.0,
+            "avg_queue_wait_ms": (
+                self.queue_wait_seconds_total / self.items_total * 1000.0 if self.items_total else 0.0
+            ),
+            "avg_inference_ms": (
+                self.inference_seconds_total / self.batches_total * 1000.0 if self.batches_total else 0.0
+            ),
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())}
+        }
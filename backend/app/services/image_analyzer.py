@@ -1,58 +1,294 @@
-import tensorflow as tf
+import asyncio
 import numpy as np
 from PIL import Image
-import io
+import os
+from functools import partial
+from typing import List, Optional, Tuple, Union
 
-# Load pre-trained model (using MobileNetV2 for demonstration)
-model = tf.keras.applications.MobileNetV2(weights='imagenet')
-preprocess_input = tf.keras.applications.mobilenet_v2.preprocess_input
-decode_predictions = tf.keras.applications.mobilenet_v2.decode_predictions
+from core.metrics import MODEL_BATCH_SIZE, TILES_PER_IMAGE, stage_timer
+from services.batcher import BatchScheduler
+from services.inference_pool import InferencePool
+from services.model_registry import registry
+from services.phash import HASH_FUNCTIONS
+from services.preprocessing import (
+    MODEL_INPUT_SIZE, BatchArena, downscale, frame_inputs, is_animated, normalize_into, open_image, pack_batch,
+    to_pixels
+)
+from services.scoring import CATEGORIES, SAFE_THRESHOLD, make_result
+from services.taxonomy import taxonomy
+from services.tiling import (
+    TILE_BUDGET, TILE_MIN_SIDE, TILE_OVERLAP, TILING_ENABLED, tile_budget, tile_inputs, wave_slices
+)
+from services.upload import Buffer
 
-async def analyze_image(image: Image.Image) -> dict:
+# TensorFlow and the model are loaded lazily by the registry; see
+# services/model_registry.py
+
+# Identifies the model and thresholds behind a result, for cache invalidation
+MODEL_VERSION = os.getenv("MODEL_VERSION", "mobilenet_v2-imagenet")
+
+# Micro-batching configuration
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "32"))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+
+# Inference executor configuration ("thread" or "process")
+INFERENCE_POOL = os.getenv("INFERENCE_POOL", "thread")
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0")) or None
+INFERENCE_MAX_PENDING = int(os.getenv("INFERENCE_MAX_PENDING", "64"))
+# Slots that background work (jobs) may hold; 0 means a quarter of the above
+INFERENCE_BACKGROUND_PENDING = int(os.getenv("INFERENCE_BACKGROUND_PENDING", "0")) or None
+
+# Perceptual hash used for near-duplicate lookups ("dhash" or "phash")
+PHASH_ALGORITHM = os.getenv("PHASH_ALGORITHM", "dhash")
+image_hash = HASH_FUNCTIONS[PHASH_ALGORITHM]
+
+# Stage timings for /metrics; see core/metrics.py
+DECODE_STAGE = stage_timer("decode")
+PREPROCESS_STAGE = stage_timer("preprocess")
+INFERENCE_STAGE = stage_timer("inference")
+MAPPING_STAGE = stage_timer("mapping")
+DB_WRITE_STAGE = stage_timer("db_write")
+
+def resize_for_model(image: Image.Image) -> Image.Image:
+    """Resize image to model's expected size"""
+    return downscale(image, MODEL_INPUT_SIZE)
+
+def preprocess_input(img_array: np.ndarray) -> np.ndarray:
+    """MobileNetV2 normalization: scale pixels from [0, 255] to [-1, 1]."""
+    return normalize_into(img_array, np.empty(img_array.shape, dtype=np.float32))
+
+def preprocess_image(image: Image.Image) -> np.ndarray:
+    """Convert a PIL image into a single uint8 (224, 224, 3) model input."""
+    return to_pixels([resize_for_model(image)])[0]
+
+def decode_upload(contents: Buffer, max_inputs: int = 1) -> Tuple[np.ndarray, Optional[int]]:
     """
-    Analyze an image for potentially harmful content.
-    Returns confidence scores for various safety categories.
+    Decode raw upload bytes into uint8 (frames, 224, 224, 3) pixels plus the
+    perceptual hash of the image. Still images have a single frame;
+    animated ones have up to GIF_SAMPLE_FRAMES. With `max_inputs` > 1 a
+    large still image becomes its thumbnail plus up to `max_inputs - 1`
+    tiles (services/tiling.py). Oversized images are rejected from their
+    header before any pixels are decoded. Normalization happens later, once
+    per batch.
+
+    The hash is None when several frames of an animation are analyzed: one
+    frame's hash can't stand for the others, so such uploads neither use
+    nor feed the near-duplicate index.
+    """
+    with DECODE_STAGE.time():
+        image = open_image(contents)
+        if max_inputs > 1:
+            frames = tile_inputs(image, max_inputs, MODEL_INPUT_SIZE)
+        else:
+            frames = frame_inputs(image, MODEL_INPUT_SIZE)
+        pixels = to_pixels(frames)
+    if is_animated(image) and len(frames) > 1:
+        return pixels, None
+    return pixels, image_hash(frames[0])
+
+def predict_batch(batch: np.ndarray) -> np.ndarray:
+    """Run one forward pass over a normalized (N, 224, 224, 3) float32 batch."""
+    model = registry.get()
+    MODEL_BATCH_SIZE.observe(len(batch))
+    # Calling the model directly skips the per-call setup that predict() does
+    with INFERENCE_STAGE.time():
+        return np.asarray(model(batch, training=False))
+
+def predict_inputs(parts: List[np.ndarray], max_batch: int = BATCH_MAX_SIZE) -> np.ndarray:
+    """
+    Normalize and run uint8 (N, 224, 224, 3) inputs through the model in
+    forward passes of at most `max_batch` images, returning the predictions
+    in order. Runs on the inference pool; one arena per call is reused for
+    every pass.
     """
-    # Resize image to model's expected size
-    image = image.convert('RGB')
-    image = image.resize((224, 224))
-    
-    # Convert to array and preprocess
-    img_array = tf.keras.preprocessing.image.img_to_array(image)
-    img_array = preprocess_input(img_array)
-    img_array = tf.expand_dims(img_array, 0)
-    
-    # Get predictions
-    predictions = model.predict(img_array)
-    decoded_predictions = decode_predictions(predictions, top=5)[0]
-    
-    # Convert predictions to safety categories
+    frames = [frame for part in parts for frame in part]
+    arena = BatchArena(min(max_batch, len(frames)))
+    predictions = [
+        predict_batch(pack_inputs(frames[start:start + max_batch], arena))
+        for start in range(0, len(frames), max_batch)
+    ]
+    return np.concatenate(predictions)
+
+def build_result(predictions: np.ndarray) -> dict:
+    """Map a single row of ImageNet predictions to safety categories."""
+    class_labels = registry.class_labels()
+
+    # Every class contributes its probability times its taxonomy weight, so
+    # the whole softmax vector is scored with one matmul (services/taxonomy.py).
     # This is a simplified example - in production, you'd want a more sophisticated
     # content classification model specifically trained for harmful content detection
+    scores = taxonomy.current.score_imagenet(predictions, class_labels)
+    categories = {category: float(score) for category, score in zip(CATEGORIES, scores)}
+
+    top = np.argsort(predictions)[::-1][:5]
+    return make_result(categories, [class_labels[index] for index in top])
+
+def merge_results(results: List[dict]) -> dict:
+    """
+    Combine the per-frame results of an animated image, or the per-tile
+    results of a tiled one: each category takes its worst score across
+    them, and labels come from the riskiest.
+    """
+    if len(results) == 1:
+        return results[0]
     categories = {
-        "violence": 0.0,
-        "nudity": 0.0,
-        "hate_symbols": 0.0,
-        "self_harm": 0.0,
-        "extremist_content": 0.0
+        name: max(result["categories"][name] for result in results)
+        for name in results[0]["categories"]
     }
-    
-    # Map ImageNet categories to safety categories (simplified example)
-    for _, label, confidence in decoded_predictions:
-        label = label.lower()
-        if any(word in label for word in ["weapon", "knife", "gun"]):
-            categories["violence"] = max(categories["violence"], confidence)
-        elif any(word in label for word in ["flesh", "body"]):
-            categories["nudity"] = max(categories["nudity"], confidence)
-        # Add more mappings as needed
-    
-    # Calculate overall safety score
-    max_risk = max(categories.values())
-    is_safe = max_risk < 0.5  # Threshold can be adjusted
-    
-    return {
-        "safe": is_safe,
-        "categories": categories,
-        "confidence": 1 - max_risk,
-        "labels": [label for _, label, _ in decoded_predictions]
-    } 
\ No newline at end of file
+    riskiest = min(results, key=lambda result: result["confidence"])
+    return make_result(categories, riskiest["labels"])
+
+def pack_inputs(items: List[np.ndarray], arena: Optional[BatchArena] = None) -> np.ndarray:
+    """Normalize uint8 images into one float32 batch, in `arena` if given."""
+    with PREPROCESS_STAGE.time():
+        return arena.pack(items) if arena is not None else pack_batch(items)
+
+def result_fingerprint(tiled: bool = True) -> str:
+    """
+    Version string that changes whenever the model, runtime, thresholds,
+    taxonomy or tiling do. Callers that never tile pass `tiled=False`.
+    """
+    fingerprint = f"{MODEL_VERSION}|{registry.runtime}|safe<{SAFE_THRESHOLD}|taxonomy={taxonomy.current.digest}"
+    if tiled and TILING_ENABLED:
+        fingerprint += f"|tiles={TILE_BUDGET},{TILE_MIN_SIDE},{TILE_OVERLAP}"
+    return fingerprint
+
+def observe_tiles(results: List[dict]) -> None:
+    if TILING_ENABLED:
+        TILES_PER_IMAGE.observe(len(results))
+
+def warm_up() -> None:
+    """Load and warm up this process's model copy before it takes work."""
+    registry.load()
+
+# Decode and inference run here, never on the event loop
+inference_pool = InferencePool(
+    kind=INFERENCE_POOL,
+    max_workers=INFERENCE_WORKERS,
+    max_pending=INFERENCE_MAX_PENDING,
+    max_background=INFERENCE_BACKGROUND_PENDING,
+    initializer=warm_up if INFERENCE_POOL == "process" else None
+)
+
+# Shared scheduler that groups concurrent requests into one forward pass.
+# It dispatches one batch at a time, so a single arena can be reused for
+# every batch it builds.
+batcher = BatchScheduler(
+    predict_batch,
+    max_batch_size=BATCH_MAX_SIZE,
+    max_wait_ms=BATCH_MAX_WAIT_MS,
+    runner=inference_pool.run,
+    collate=partial(pack_inputs, arena=BatchArena(BATCH_MAX_SIZE))
+)
+
+async def analyze_image(image: Image.Image) -> dict:
+    """
+    Analyze an image for potentially harmful content.
+    Returns confidence scores for various safety categories.
+    Raises PoolSaturatedError when the inference queue is full and
+    ModelNotReadyError while the model is still loading.
+    """
+    registry.ensure_ready()
+    async with inference_pool.admission():
+        img_array = await inference_pool.run(preprocess_image, image)
+        predictions = await batcher.submit(img_array)
+    return build_result(predictions)
+
+async def analyze_upload(contents: Buffer, near_duplicates=None) -> Tuple[dict, bool]:
+    """
+    Like analyze_image, but decoding also happens on the inference pool.
+    If a NearDuplicateIndex is given and holds a perceptually similar image,
+    its verdict is reused and inference is skipped. Returns the result and
+    whether it came from a near-duplicate.
+    """
+    registry.ensure_ready()
+    async with inference_pool.admission():
+        img_array, upload_hash = await inference_pool.run(decode_upload, contents, tile_budget())
+        if near_duplicates is not None and upload_hash is not None:
+            match = await near_duplicates.lookup(upload_hash)
+            if match is not None:
+                return match, True
+        # Tiles go through the model in waves; once one is unsafe the rest
+        # can't change the verdict
+        results = []
+        for wave in wave_slices(len(img_array)):
+            predictions = await asyncio.gather(*(batcher.submit(frame) for frame in img_array[wave]))
+            with MAPPING_STAGE.time():
+                results.extend(build_result(row) for row in predictions)
+            if not all(result["safe"] for result in results):
+                break
+    observe_tiles(results)
+    result = merge_results(results)
+    if near_duplicates is not None and upload_hash is not None:
+        with DB_WRITE_STAGE.time():
+            await near_duplicates.add(upload_hash, result)
+    return result, False
+
+async def analyze_uploads(
+    contents_list: List[Buffer],
+    near_duplicates=None
+) -> List[Union[Tuple[dict, bool], Exception]]:
+    """
+    Analyze many uploads as one unit of work: decode them concurrently on the
+    inference pool, then run every image that needs inference through the
+    model together (per wave of tiles, in tiled mode), packed on the pool in
+    forward passes of up to BATCH_MAX_SIZE. Items that fail to decode come
+    back as the exception instead of failing the whole call.
+    """
+    registry.ensure_ready()
+    max_inputs = tile_budget(len(contents_list))
+    # Each image takes its own slot, so batches are held to the same
+    # backpressure as that many single requests
+    async with inference_pool.admission(len(contents_list)):
+        decoded = await asyncio.gather(
+            *(inference_pool.run(decode_upload, contents, max_inputs) for contents in contents_list),
+            return_exceptions=True
+        )
+
+        results: List[Union[Tuple[dict, bool], Exception, None]] = [None] * len(decoded)
+        pending = []
+        for index, item in enumerate(decoded):
+            if isinstance(item, Exception):
+                results[index] = item
+                continue
+            img_array, upload_hash = item
+            if near_duplicates is not None and upload_hash is not None:
+                match = await near_duplicates.lookup(upload_hash)
+                if match is not None:
+                    results[index] = (match, True)
+                    continue
+            pending.append((index, img_array, upload_hash))
+
+        # Frames of every pending upload go through the model together, in
+        # passes of up to BATCH_MAX_SIZE; in tiled mode an upload drops out
+        # after the wave that finds it unsafe
+        item_results = {index: [] for index, _, _ in pending}
+        waves = {index: wave_slices(len(img_array)) for index, img_array, _ in pending}
+        remaining = list(pending)
+        wave = 0
+        while remaining:
+            parts = [img_array[waves[index][wave]] for index, img_array, _ in remaining]
+            predictions = await inference_pool.run(predict_inputs, parts)
+            offset = 0
+            for (index, _, _), part in zip(remaining, parts):
+                rows = predictions[offset:offset + len(part)]
+                offset += len(part)
+                with MAPPING_STAGE.time():
+                    item_results[index].extend(build_result(row) for row in rows)
+            wave += 1
+            remaining = [
+                item for item in remaining
+                if wave < len(waves[item[0]]) and all(result["safe"] for result in item_results[item[0]])
+            ]
+
+    # Verdicts reached on a reduced tile budget aren't indexed, or a single
+    # upload could later be given one
+    indexed = near_duplicates is not None and max_inputs == tile_budget()
+    for index, img_array, upload_hash in pending:
+        observe_tiles(item_results[index])
+        result = merge_results(item_results[index])
+        if indexed and upload_hash is not None:
+            with DB_WRITE_STAGE.time():
+                await near_duplicates.add(upload_hash, result)
+        results[index] = (result, False)
+    return results
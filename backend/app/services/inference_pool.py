@@ -0,0 +1,128 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+
+class PoolSaturatedError(RuntimeError):
+    """Raised when the inference pool has no room for another request."""
+
+
+# Set while running work that must not crowd out requests (e.g. jobs)
+_background: ContextVar[bool] = ContextVar("background", default=False)
+
+
+@contextmanager
+def background_work():
+    """Admit the inference started inside this block from the background budget."""
+    token = _background.set(True)
+    try:
+        yield
+    finally:
+        _background.reset(token)
+
+
+class InferencePool:
+    """
+    Runs CPU-bound decode and inference work off the event loop.
+
+    `kind` selects a thread pool (default, shares one model) or a process pool
+    (one model copy per process, loaded by `initializer`). Admission is bounded
+    by `max_pending`: once that many images are in flight, new requests are
+    rejected immediately instead of queueing up latency. Work admitted inside
+    `background_work()` may hold at most `max_background` of those slots, so
+    the rest stay free for interactive requests.
+    """
+
+    def __init__(
+        self,
+        kind: str = "thread",
+        max_workers: Optional[int] = None,
+        max_pending: int = 64,
+        max_background: Optional[int] = None,
+        initializer: Optional[Callable[[], None]] = None
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown inference pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max(1, max_pending)
+        if max_background is None:
+            max_background = self.max_pending // 4
+        self.max_background = min(max(1, max_background), self.max_pending)
+        self.initializer = initializer
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._background_pending = 0
+
+        # Metrics
+        self.admitted_total = 0
+        self.rejected_total = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # TensorFlow is not fork-safe, so worker processes are spawned
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=self.initializer
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers,
+                    thread_name_prefix="inference"
+                )
+        return self._executor
+
+    @asynccontextmanager
+    async def admission(self, images: int = 1):
+        """
+        Reserve one slot per image, or raise PoolSaturatedError. A request
+        with more images than `max_pending` needs the whole pool to be free;
+        background work is held to `max_background` slots the same way.
+        """
+        background = _background.get()
+        limit = self.max_background if background else self.max_pending
+        slots = min(max(1, images), limit)
+        if self._pending + slots > self.max_pending or (
+            background and self._background_pending + slots > self.max_background
+        ):
+            self.rejected_total += 1
+            raise PoolSaturatedError("Inference queue is full")
+        self._pending += slots
+        if background:
+            self._background_pending += slots
+        self.admitted_total += 1
+        try:
+            yield
+        finally:
+            self._pending -= slots
+            if background:
+                self._background_pending -= slots
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run `fn(*args)` on the pool and await its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), partial(fn, *args))
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "background_pending": self._background_pending,
+            "max_background": self.max_background,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total
+        }
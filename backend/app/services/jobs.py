@@ -0,0 +1,565 @@
+import asyncio
+import ipaddress
+import logging
+import os
+import random
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+from urllib.parse import urlparse
+
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import PyMongoError
+
+from models.auth import UsageRecord
+from services.inference_pool import PoolSaturatedError, background_work
+from services.model_registry import ModelNotReadyError
+from services.upload import sniff_image_type
+from services.usage_buffer import usage_buffer
+
+logger = logging.getLogger(__name__)
+
+# Workers per process; 0 makes this replica accept jobs without running them
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Images analyzed per step; progress is saved after each one
+JOB_CHUNK_SIZE = int(os.getenv("JOB_CHUNK_SIZE", "32"))
+# A job whose lease is not renewed for this long is picked up by another
+# worker; the holder renews it every third of that while it works
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1.0"))
+# Attempts after which a job that keeps failing or crashing its workers is
+# failed; jobs handed back on shutdown don't use one up
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", str(7 * 86400)))
+JOB_WEBHOOK_TIMEOUT = float(os.getenv("JOB_WEBHOOK_TIMEOUT", "10"))
+JOB_WEBHOOK_RETRIES = int(os.getenv("JOB_WEBHOOK_RETRIES", "3"))
+# Where callback_url may point: schemes, and hosts as exact names, ".example.com"
+# for its subdomains or "*" for any. No hosts disables callbacks. Whatever the
+# host, addresses that resolve to private, loopback, link-local or multicast
+# networks are refused when the callback is sent.
+JOB_CALLBACK_SCHEMES = [s.strip().lower() for s in os.getenv("JOB_CALLBACK_SCHEMES", "https").split(",") if s.strip()]
+JOB_CALLBACK_HOSTS = [h.strip().lower() for h in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()]
+# Directory that submitted file paths must resolve into; unset disables paths
+JOB_LOCAL_ROOT = os.getenv("JOB_LOCAL_ROOT", "")
+MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", str(5 * 1024 * 1024)))
+
+# Set far in the past so a new job is claimable right away
+UNLEASED = datetime(1970, 1, 1)
+
+QUEUED, RUNNING, COMPLETED, FAILED = "queued", "running", "completed", "failed"
+
+AnalyzeBatch = Callable[[List[bytes]], Awaitable[List[Any]]]
+
+
+class JobInputError(ValueError):
+    """Raised when a submitted file path or callback URL is not allowed, or a file cannot be read."""
+
+
+def resolve_local_path(path: str, root: str = JOB_LOCAL_ROOT) -> str:
+    """Resolve `path` inside `root`, refusing anything (symlinks included) outside it."""
+    if not root:
+        raise JobInputError("Local file paths are not enabled on this server")
+    root = os.path.realpath(root)
+    resolved = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, resolved]) != root:
+        raise JobInputError(f"{path}: outside of the allowed directory")
+    return resolved
+
+
+def read_local_image(path: str, max_size: int = MAX_FILE_SIZE) -> bytes:
+    """Read an image submitted by path, with the same limits as an upload."""
+    try:
+        resolved = resolve_local_path(path)
+        if os.path.getsize(resolved) > max_size:
+            raise JobInputError(f"{path}: file exceeds maximum allowed size of {max_size/1024/1024}MB")
+        with open(resolved, "rb") as f:
+            contents = f.read(max_size + 1)
+    except OSError as e:
+        raise JobInputError(f"{path}: {e.strerror or e}")
+    if sniff_image_type(contents[:16]) is None:
+        raise JobInputError(f"{path}: not a supported image")
+    return contents
+
+
+def check_callback_url(
+    url: str, schemes: Sequence[str] = JOB_CALLBACK_SCHEMES, hosts: Sequence[str] = JOB_CALLBACK_HOSTS
+) -> str:
+    """Check a callback URL's scheme and host against the allowlist."""
+    if not hosts:
+        raise JobInputError("Callbacks are not enabled on this server")
+    parsed = urlparse(url)
+    if parsed.scheme.lower() not in schemes:
+        raise JobInputError(f"callback_url must be a {' or '.join(schemes)} URL")
+    host = (parsed.hostname or "").lower()
+    allowed = any(
+        pattern == "*" or host == pattern or (pattern.startswith(".") and host.endswith(pattern))
+        for pattern in hosts
+    )
+    if not host or not allowed or parsed.username or parsed.password:
+        raise JobInputError("callback_url host is not allowed")
+    return url
+
+
+async def check_callback_address(url: str) -> None:
+    """Resolve the callback host and refuse it unless every address is public."""
+    parsed = urlparse(url)
+    port = parsed.port or (443 if parsed.scheme.lower() == "https" else 80)
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)
+    except OSError as e:
+        raise JobInputError(f"Cannot resolve callback host: {e}")
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            raise JobInputError("Callback host resolves to a non-public address")
+
+
+class JobQueue:
+    """
+    Durable job queue in MongoDB.
+
+    `jobs` holds one document per job, with its items, progress and lease.
+    Uploaded bytes wait in `job_images` until the job finishes, and each
+    item's result is upserted into `job_results` under (job_id, index), so
+    redoing a chunk after a crash overwrites rather than duplicates.
+
+    A worker claims a job with one `find_one_and_update` that only matches
+    jobs whose lease has expired, so two workers can never hold the same
+    job. The lease is renewed while a chunk runs and with every checkpoint;
+    a worker that dies stops renewing it and the job is resumed by another
+    worker from the last checkpoint. A worker that shuts down cleanly
+    releases its job instead, without counting the attempt.
+    """
+
+    def __init__(self, db, lease_seconds: float = 60.0, retention_seconds: int = 7 * 86400):
+        self.db = db
+        self.lease = timedelta(seconds=lease_seconds)
+        self.retention = timedelta(seconds=retention_seconds)
+
+    async def create(
+        self,
+        token: str,
+        items: List[Dict[str, Any]],
+        uploads: Dict[int, bytes],
+        callback_url: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Queue a job. `items` describe every input in order ("filename" plus
+        "path" for local files, or "error" for inputs rejected up front);
+        `uploads` maps item indexes to uploaded bytes.
+        """
+        now = datetime.utcnow()
+        job_id = uuid.uuid4().hex
+        if uploads:
+            # The images must be in place before the job becomes claimable
+            await self.db.job_images.insert_many(
+                [{"job_id": job_id, "index": index, "data": bytes(data), "created_at": now}
+                 for index, data in uploads.items()],
+                ordered=False
+            )
+        job = {
+            "_id": job_id,
+            "token": token,
+            "status": QUEUED,
+            "items": items,
+            "total": len(items),
+            "processed": 0,
+            "failed": 0,
+            "attempts": 0,
+            "worker": None,
+            "lease_until": UNLEASED,
+            "callback_url": callback_url,
+            "created_at": now,
+            "updated_at": now
+        }
+        await self.db.jobs.insert_one(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.jobs.find_one({"_id": job_id}, {"items": 0})
+
+    async def results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        cursor = self.db.job_results.find(
+            {"job_id": job_id, "index": {"$gte": offset}},
+            {"_id": 0, "job_id": 0, "created_at": 0}
+        ).sort("index", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """Lease the oldest job that nobody holds a live lease on."""
+        now = datetime.utcnow()
+        return await self.db.jobs.find_one_and_update(
+            {"status": {"$in": [QUEUED, RUNNING]}, "lease_until": {"$lte": now}},
+            {
+                "$set": {"status": RUNNING, "worker": worker, "lease_until": now + self.lease, "updated_at": now},
+                "$inc": {"attempts": 1}
+            },
+            sort=[("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def checkpoint(self, job_id: str, worker: str, processed: int) -> bool:
+        """Save progress and renew the lease; False if the lease was lost."""
+        now = datetime.utcnow()
+        result = await self.db.jobs.update_one(
+            {"_id": job_id, "worker": worker, "status": RUNNING},
+            {"$set": {"processed": processed, "lease_until": now + self.lease, "updated_at": now}}
+        )
+        return result.matched_count == 1
+
+    async def release(self, job_id: str, worker: str) -> bool:
+        """Hand a job back for another worker to claim right away, refunding the attempt."""
+        now = datetime.utcnow()
+        result = await self.db.jobs.update_one(
+            {"_id": job_id, "worker": worker, "status": RUNNING},
+            {
+                "$set": {"worker": None, "lease_until": UNLEASED, "updated_at": now},
+                "$inc": {"attempts": -1}
+            }
+        )
+        return result.matched_count == 1
+
+    async def save_results(self, job_id: str, results: Sequence[Dict[str, Any]]) -> None:
+        now = datetime.utcnow()
+        await self.db.job_results.bulk_write(
+            [
+                ReplaceOne(
+                    {"job_id": job_id, "index": result["index"]},
+                    {"job_id": job_id, **result, "created_at": now},
+                    upsert=True
+                )
+                for result in results
+            ],
+            ordered=False
+        )
+
+    async def load_uploads(self, job_id: str, indexes: Sequence[int]) -> Dict[int, bytes]:
+        cursor = self.db.job_images.find({"job_id": job_id, "index": {"$in": list(indexes)}}, {"_id": 0})
+        return {doc["index"]: bytes(doc["data"]) async for doc in cursor}
+
+    async def finish(
+        self, job_id: str, worker: str, status: str, error: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Mark a job completed or failed and release its uploaded images."""
+        now = datetime.utcnow()
+        failed = await self.db.job_results.count_documents({"job_id": job_id, "error": {"$exists": True}})
+        update = {
+            "status": status,
+            "failed": failed,
+            "worker": None,
+            "updated_at": now,
+            "finished_at": now,
+            "expires_at": now + self.retention
+        }
+        if error is not None:
+            update["error"] = error
+        job = await self.db.jobs.find_one_and_update(
+            {"_id": job_id, "worker": worker},
+            {"$set": update},
+            projection={"items": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            await self.db.job_images.delete_many({"job_id": job_id})
+        return job
+
+    async def record_callback(self, job_id: str, outcome: Dict[str, Any]) -> None:
+        await self.db.jobs.update_one({"_id": job_id}, {"$set": {"callback": outcome}})
+
+
+def job_summary(job: Dict[str, Any]) -> Dict[str, Any]:
+    """The public view of a job document, without items or lease bookkeeping."""
+    summary = {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "total": job["total"],
+        "processed": job["processed"],
+        "failed": job.get("failed", 0),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"]
+    }
+    for key in ("finished_at", "error"):
+        if job.get(key) is not None:
+            summary[key] = job[key]
+    # Whether the webhook got through, but not what it answered: the status
+    # and errors of arbitrary URLs would tell the submitter about the network
+    callback = job.get("callback")
+    if callback is not None:
+        summary["callback"] = {"delivered": callback.get("delivered", False), "attempts": callback.get("attempts", 0)}
+    return summary
+
+
+class JobWorkerPool:
+    """
+    Background workers that drain the job queue.
+
+    Each worker claims one job at a time and works through its items in
+    chunks of `chunk_size`, handing each chunk to `analyze_batch` (the
+    moderation backend) and checkpointing after it. A heartbeat renews the
+    lease while a chunk runs, however long it takes. A worker that finds
+    its lease taken over stops without touching the job again. Running more
+    workers here, or more replicas against the same database, scales
+    throughput; nothing is coordinated outside MongoDB.
+    """
+
+    def __init__(
+        self,
+        workers: int = 2,
+        chunk_size: int = 32,
+        lease_seconds: float = 60.0,
+        poll_interval: float = 1.0,
+        max_attempts: int = 3,
+        retention_seconds: int = 7 * 86400,
+        webhook_timeout: float = 10.0,
+        webhook_retries: int = 3
+    ):
+        self.workers = max(0, workers)
+        self.chunk_size = max(1, chunk_size)
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retention_seconds = retention_seconds
+        self.webhook_timeout = webhook_timeout
+        self.webhook_retries = max(1, webhook_retries)
+        self.queue: Optional[JobQueue] = None
+        self._analyze_batch: Optional[AnalyzeBatch] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._prefix = f"{socket.gethostname()}:{os.getpid()}"
+
+        # Metrics
+        self.jobs_claimed_total = 0
+        self.jobs_completed_total = 0
+        self.jobs_failed_total = 0
+        self.leases_lost_total = 0
+        self.items_processed_total = 0
+        self.webhook_errors_total = 0
+
+    def bind(self, db) -> None:
+        """Attach the queue; enough to submit and read jobs without running workers."""
+        self.queue = JobQueue(db, self.lease_seconds, self.retention_seconds)
+
+    def start(self, db, analyze_batch: AnalyzeBatch) -> None:
+        self.bind(db)
+        self._analyze_batch = analyze_batch
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._run(f"{self._prefix}:{number}"))
+            for number in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        """Stop the workers. Jobs they held resume elsewhere once their leases lapse."""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def notify(self) -> None:
+        """Wake idle workers in this process instead of waiting for the next poll."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self, worker: str) -> None:
+        while True:
+            try:
+                job = await self.queue.claim(worker)
+            except PyMongoError as e:
+                logger.warning("Job claim failed: %s", e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+
+            self.jobs_claimed_total += 1
+            try:
+                await self._process(worker, job)
+            except asyncio.CancelledError:
+                # Shutting down (e.g. a rolling restart): let the next worker
+                # resume from the last checkpoint without waiting out the lease
+                try:
+                    await self.queue.release(job["_id"], worker)
+                except PyMongoError as e:
+                    logger.warning("Could not release job %s: %s", job["_id"], e)
+                raise
+            except Exception as e:
+                # The lease runs out and another attempt picks the job up
+                logger.exception("Job %s failed on %s: %s", job["_id"], worker, e)
+
+    async def _process(self, worker: str, job: Dict[str, Any]) -> None:
+        job_id = job["_id"]
+        if job["attempts"] > self.max_attempts:
+            await self._finish(worker, job, FAILED, f"Abandoned after {self.max_attempts} attempts")
+            return
+
+        index = job["processed"]
+        while index < job["total"]:
+            end = min(index + self.chunk_size, job["total"])
+            results = await self._with_lease(worker, job_id, index, self._run_chunk(worker, job, range(index, end)))
+            if results is None:
+                self.leases_lost_total += 1
+                return
+            await self.queue.save_results(job_id, results)
+            self.items_processed_total += len(results)
+            index = end
+            if not await self.queue.checkpoint(job_id, worker, index):
+                self.leases_lost_total += 1
+                return
+
+        await self._finish(worker, job, COMPLETED)
+
+    async def _with_lease(self, worker: str, job_id: str, processed: int, work: Awaitable) -> Optional[Any]:
+        """Await `work` while renewing the lease; None, with `work` cancelled, if the lease is lost."""
+        task = asyncio.ensure_future(work)
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=self.lease_seconds / 3)
+                if done:
+                    return task.result()
+                try:
+                    renewed = await self.queue.checkpoint(job_id, worker, processed)
+                except PyMongoError as e:
+                    # The lease may still be live; try again on the next beat
+                    logger.warning("Lease renewal for job %s failed: %s", job_id, e)
+                    continue
+                if not renewed:
+                    return None
+        finally:
+            if not task.done():
+                task.cancel()
+
+    async def _run_chunk(self, worker: str, job: Dict[str, Any], indexes: range) -> Optional[List[Dict[str, Any]]]:
+        items = job["items"]
+        results: Dict[int, Dict[str, Any]] = {}
+        contents: Dict[int, bytes] = {}
+        uploads = await self.queue.load_uploads(job["_id"], indexes)
+        for index in indexes:
+            item = items[index]
+            if item.get("error"):
+                results[index] = {"index": index, "filename": item["filename"], "error": item["error"]}
+            elif item.get("path"):
+                try:
+                    contents[index] = await asyncio.to_thread(read_local_image, item["path"])
+                except JobInputError as e:
+                    results[index] = {"index": index, "filename": item["filename"], "error": str(e)}
+            elif index in uploads:
+                contents[index] = uploads[index]
+            else:
+                results[index] = {"index": index, "filename": item["filename"], "error": "Image data missing"}
+
+        if contents:
+            outcomes = await self._analyze(worker, job["_id"], indexes.start, list(contents.values()))
+            if outcomes is None:
+                return None
+            now = datetime.utcnow()
+            for index, outcome in zip(contents, outcomes):
+                filename = items[index]["filename"]
+                if isinstance(outcome, Exception):
+                    results[index] = {"index": index, "filename": filename, "error": str(outcome)}
+                    continue
+                results[index] = {"index": index, "filename": filename, "result": outcome}
+                usage_buffer.record(UsageRecord(
+                    token=job["token"],
+                    endpoint="moderate/jobs",
+                    timestamp=now,
+                    file_size=len(contents[index]),
+                    file_type=items[index].get("content_type") or sniff_image_type(contents[index][:16])
+                ))
+        return [results[index] for index in indexes]
+
+    async def _analyze(self, worker: str, job_id: str, processed: int, contents: List[bytes]) -> Optional[List[Any]]:
+        """
+        Run the backend, waiting out overload while keeping the lease alive.
+        Jobs only get the inference pool's background slots, so they never
+        take capacity that /moderate requests need.
+        """
+        while True:
+            try:
+                with background_work():
+                    return await self._analyze_batch(contents)
+            except (PoolSaturatedError, ModelNotReadyError):
+                await asyncio.sleep(self.poll_interval * (1 + random.random()))
+                if not await self.queue.checkpoint(job_id, worker, processed):
+                    return None
+
+    async def _finish(self, worker: str, job: Dict[str, Any], status: str, error: Optional[str] = None) -> None:
+        finished = await self.queue.finish(job["_id"], worker, status, error)
+        if finished is None:
+            self.leases_lost_total += 1
+            return
+        if status == COMPLETED:
+            self.jobs_completed_total += 1
+        else:
+            self.jobs_failed_total += 1
+        if job.get("callback_url"):
+            await self._send_callback(job["callback_url"], finished)
+
+    async def _send_callback(self, url: str, job: Dict[str, Any]) -> None:
+        """POST the job summary to the submitter's webhook, retrying with backoff."""
+        import httpx
+
+        payload = job_summary(job)
+        payload["results_url"] = f"/moderate/jobs/{job['_id']}"
+        body = {key: value.isoformat() if isinstance(value, datetime) else value for key, value in payload.items()}
+        outcome: Dict[str, Any] = {}
+        # Redirects are not followed, so they can't lead past the address check
+        async with httpx.AsyncClient(timeout=self.webhook_timeout, follow_redirects=False) as client:
+            for attempt in range(1, self.webhook_retries + 1):
+                try:
+                    # Checked on every attempt: the allowlist may have changed
+                    # since submission, and DNS answers can change between tries
+                    check_callback_url(url)
+                    await check_callback_address(url)
+                except JobInputError as e:
+                    outcome = {"error": str(e), "attempts": attempt}
+                    break
+                try:
+                    response = await client.post(url, json=body)
+                    outcome = {"status_code": response.status_code, "attempts": attempt}
+                    if response.status_code < 500:
+                        break
+                except httpx.HTTPError as e:
+                    outcome = {"error": str(e) or type(e).__name__, "attempts": attempt}
+                if attempt < self.webhook_retries:
+                    await asyncio.sleep(random.uniform(0, 2 ** attempt))
+        outcome["delivered"] = not outcome.get("error") and outcome.get("status_code", 0) < 400
+        if not outcome["delivered"]:
+            self.webhook_errors_total += 1
+            logger.warning("Webhook for job %s failed: %s", job["_id"], outcome)
+        await self.queue.record_callback(job["_id"], outcome)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._tasks),
+            "chunk_size": self.chunk_size,
+            "lease_seconds": self.lease_seconds,
+            "jobs_claimed_total": self.jobs_claimed_total,
+            "jobs_completed_total": self.jobs_completed_total,
+            "jobs_failed_total": self.jobs_failed_total,
+            "leases_lost_total": self.leases_lost_total,
+            "items_processed_total": self.items_processed_total,
+            "webhook_errors_total": self.webhook_errors_total
+        }
+
+
+job_workers = JobWorkerPool(
+    workers=JOB_WORKERS,
+    chunk_size=JOB_CHUNK_SIZE,
+    lease_seconds=JOB_LEASE_SECONDS,
+    poll_interval=JOB_POLL_INTERVAL,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    retention_seconds=JOB_RETENTION_SECONDS,
+    webhook_timeout=JOB_WEBHOOK_TIMEOUT,
+    webhook_retries=JOB_WEBHOOK_RETRIES
+)
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from services.runtimes import (
+    EXPORTERS, check_quantization, check_runtime, labels_path_for, load_runner,
+    read_class_index, write_class_index
+)
+
+logger = logging.getLogger(__name__)
+
+# Where to load the model from. MODEL_PATH may point at a pre-serialized
+# .keras/.h5 file or a SavedModel directory; MODEL_WEIGHTS may point at a
+# local MobileNetV2 weights file. With neither set, ImageNet weights are
+# downloaded on first load.
+MODEL_PATH = os.getenv("MODEL_PATH", "")
+MODEL_WEIGHTS = os.getenv("MODEL_WEIGHTS", "imagenet")
+MODEL_WARMUP_BATCH = int(os.getenv("MODEL_WARMUP_BATCH", "8"))
+
+# Inference runtime: "keras" (TensorFlow), or "tflite"/"onnx" with MODEL_PATH
+# pointing at an exported .tflite/.onnx file. Class labels for exported
+# models are read from MODEL_LABELS (default: MODEL_PATH + ".labels.json").
+MODEL_RUNTIME = os.getenv("MODEL_RUNTIME", "keras")
+MODEL_LABELS = os.getenv("MODEL_LABELS", "")
+# 0 leaves the runtime's default (usually one thread per core)
+MODEL_INTRA_OP_THREADS = int(os.getenv("MODEL_INTRA_OP_THREADS", "0")) or None
+MODEL_INTER_OP_THREADS = int(os.getenv("MODEL_INTER_OP_THREADS", "0")) or None
+MODEL_INPUT_SHAPE = (224, 224, 3)
+IMAGENET_CLASSES = 1000
+
+
+class ModelNotReadyError(RuntimeError):
+    """Raised when inference is requested before the model has loaded."""
+
+
+class _SavedModelRunner:
+    """Adapts a SavedModel's serving signature to the Keras call convention."""
+
+    def __init__(self, loaded):
+        self._signature = loaded.signatures["serving_default"]
+
+    def __call__(self, batch, training=False):
+        outputs = self._signature(batch)
+        return next(iter(outputs.values()))
+
+
+class ModelRegistry:
+    """
+    Owns the classification model and loads it off the request path.
+
+    `start()` kicks off loading in a background thread so the app can answer
+    liveness probes immediately; `ready` flips once the model is loaded and
+    warmed up. Import, load and warm-up timings are kept for reporting.
+    `runtime` selects Keras or an exported TFLite/ONNX model; every runtime
+    is called the same way, with a normalized float32 batch.
+    """
+
+    def __init__(
+        self,
+        model_path: str = "",
+        weights: str = "imagenet",
+        warmup_batch: int = 8,
+        runtime: str = "keras",
+        labels_path: str = "",
+        intra_op_threads: Optional[int] = None,
+        inter_op_threads: Optional[int] = None
+    ):
+        check_runtime(runtime)
+        self.model_path = model_path
+        self.weights = weights
+        self.warmup_batch = warmup_batch
+        self.runtime = runtime
+        self.labels_path = labels_path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.timings: Dict[str, float] = {}
+        self._model = None
+        self._class_index: Optional[List[Tuple[str, str]]] = None
+        self._class_labels: Optional[List[str]] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def load(self) -> None:
+        """Import TensorFlow, load and warm up the model (blocking, idempotent)."""
+        with self._lock:
+            if self.ready:
+                return
+            self.state = "loading"
+            try:
+                if self.runtime == "keras":
+                    started = time.perf_counter()
+                    import tensorflow as tf
+                    self.timings["tensorflow_import_seconds"] = time.perf_counter() - started
+
+                    started = time.perf_counter()
+                    self._configure_threads(tf)
+                    self._model = self._build(tf)
+                    self._class_index = self._keras_class_index(tf)
+                else:
+                    started = time.perf_counter()
+                    self._model = load_runner(
+                        self.runtime, self.model_path, self.intra_op_threads, self.inter_op_threads
+                    )
+                    self._class_index = read_class_index(self.labels_path or labels_path_for(self.model_path))
+                self._class_labels = [label for _, label in self._class_index]
+                self.timings["load_seconds"] = time.perf_counter() - started
+
+                started = time.perf_counter()
+                self._warm_up()
+                self.timings["warmup_seconds"] = time.perf_counter() - started
+
+                self.state = "ready"
+                logger.info("Model ready: %s", self.timings)
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                logger.exception("Model failed to load")
+                raise
+
+    def _configure_threads(self, tf) -> None:
+        # Only takes effect before TensorFlow's runtime has initialized
+        try:
+            if self.intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+            if self.inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+        except RuntimeError as e:
+            logger.warning("Could not apply TensorFlow thread settings: %s", e)
+
+    @staticmethod
+    def _keras_class_index(tf) -> List[Tuple[str, str]]:
+        # Decoding an identity matrix yields each class's (wnid, label) once
+        decode = tf.keras.applications.mobilenet_v2.decode_predictions
+        decoded = decode(np.eye(IMAGENET_CLASSES, dtype=np.float32), top=1)
+        return [(row[0][0], row[0][1]) for row in decoded]
+
+    def _build(self, tf):
+        if self.model_path:
+            if os.path.isdir(self.model_path):
+                return _SavedModelRunner(tf.saved_model.load(self.model_path))
+            return tf.keras.models.load_model(self.model_path, compile=False)
+        return tf.keras.applications.MobileNetV2(weights=self.weights)
+
+    def _warm_up(self) -> None:
+        # Run both the single-image and the batched shape once so neither
+        # pays first-call allocation costs on a real request
+        for size in sorted({1, self.warmup_batch}):
+            if size > 0:
+                self._model(np.zeros((size, *MODEL_INPUT_SHAPE), dtype=np.float32), training=False)
+
+    def start(self) -> None:
+        """Begin loading in the background; returns immediately."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._load_in_background())
+
+    async def _load_in_background(self) -> None:
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception:
+            pass  # state and error are recorded by load()
+
+    def ensure_ready(self) -> None:
+        if not self.ready:
+            raise ModelNotReadyError(f"Model is {self.state}")
+
+    def get(self):
+        self.ensure_ready()
+        return self._model
+
+    def decode_predictions(self, predictions: np.ndarray, top: int = 5):
+        """Keras-style [(wnid, label, score), ...] per row, for any runtime."""
+        self.ensure_ready()
+        predictions = np.asarray(predictions)
+        top_indices = np.argsort(predictions, axis=-1)[:, ::-1][:, :top]
+        return [
+            [(*self._class_index[index], float(row[index])) for index in indices]
+            for row, indices in zip(predictions, top_indices)
+        ]
+
+    def class_labels(self) -> List[str]:
+        """Human-readable label of every output class, in output order."""
+        self.ensure_ready()
+        return self._class_labels
+
+    def export(
+        self,
+        path: str,
+        runtime: str = "keras",
+        quantize: Optional[str] = None,
+        calibration_dir: Optional[str] = None
+    ) -> None:
+        """
+        Serialize the Keras model so later starts can skip the download, or
+        convert it for the TFLite/ONNX runtimes (optionally INT8-quantized,
+        calibrated on the images in `calibration_dir`). The class labels are
+        written next to the output for runtimes that don't import TensorFlow.
+        """
+        check_runtime(runtime)
+        check_quantization(quantize)
+        if self.runtime != "keras":
+            raise ValueError("Exporting needs the Keras model; run with MODEL_RUNTIME=keras")
+        if runtime == "keras" and quantize:
+            raise ValueError("Quantization needs the tflite or onnx runtime")
+        self.load()
+        if runtime == "keras":
+            self._model.save(path)
+        else:
+            EXPORTERS[runtime](self._model, path, quantize=quantize, calibration_dir=calibration_dir)
+        write_class_index(labels_path_for(path), self._class_index)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "source": self.model_path or f"MobileNetV2(weights={self.weights})",
+            "runtime": self.runtime,
+            "timings": self.timings
+        }
+
+
+registry = ModelRegistry(
+    model_path=MODEL_PATH,
+    weights=MODEL_WEIGHTS,
+    warmup_batch=MODEL_WARMUP_BATCH,
+    runtime=MODEL_RUNTIME,
+    labels_path=MODEL_LABELS,
+    intra_op_threads=MODEL_INTRA_OP_THREADS,
+    inter_op_threads=MODEL_INTER_OP_THREADS
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-serialize or convert the model for MODEL_PATH")
+    parser.add_argument("--export", required=True, help="Output path, e.g. /models/mobilenet_v2.keras")
+    parser.add_argument("--runtime", choices=["keras", "tflite", "onnx"], default="keras")
+    parser.add_argument("--quantize", choices=["int8"], default=None, help="Post-training quantization")
+    parser.add_argument("--calibration-dir", default=None, help="Representative images for INT8 calibration")
+    args = parser.parse_args()
+    registry.export(args.export, args.runtime, args.quantize, args.calibration_dir)
+    print(f"Model saved to {args.export} ({registry.timings})")
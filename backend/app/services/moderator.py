@@ -1,83 +1,230 @@
-from google.cloud import vision
-from PIL import Image
-import io
+import asyncio
 import os
-from typing import Dict, Any
+import random
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Sequence, Tuple, Union
+
+from services.scoring import make_result
+from services.taxonomy import taxonomy
+
+# The Vision API accepts at most this many images per batch_annotate_images call
+VISION_MAX_IMAGES_PER_CALL = 16
+VISION_MAX_CONCURRENCY = int(os.getenv("VISION_MAX_CONCURRENCY", "4"))
+VISION_MAX_RETRIES = int(os.getenv("VISION_MAX_RETRIES", "3"))
+VISION_BACKOFF_BASE = float(os.getenv("VISION_BACKOFF_BASE", "0.2"))
+VISION_BACKOFF_MAX = float(os.getenv("VISION_BACKOFF_MAX", "2.0"))
+# Overall deadline for one batch call, retries included
+VISION_DEADLINE = float(os.getenv("VISION_DEADLINE", "10"))
+VISION_LABEL_RESULTS = int(os.getenv("VISION_LABEL_RESULTS", "10"))
+
+# Feature.Type values, as plain ints so requests can be built without the client library
+SAFE_SEARCH_DETECTION = 6
+LABEL_DETECTION = 4
+
+# Likelihood enum (UNKNOWN .. VERY_LIKELY) mapped to probability scores
+LIKELIHOOD_SCORES = (0.0, 0.1, 0.3, 0.5, 0.7, 0.9)
+
+# HTTP-style status codes of transient API errors worth retrying
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class VisionError(Exception):
+    """Raised when the Vision API fails for an image or a call."""
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    # google.api_core exceptions carry the HTTP status as `code`
+    return getattr(error, "code", None) in RETRYABLE_STATUS_CODES
+
 
 class ImageModerator:
-    def __init__(self):
-        self.client = vision.ImageAnnotatorClient()
-        
+    """
+    Google Cloud Vision SafeSearch + label detection.
+
+    Each image is sent as one annotate request carrying both features, and
+    images are grouped into batch_annotate_images calls of up to 16. Calls
+    go through the async client, at most `max_concurrency` at a time, and
+    transient failures are retried with jittered exponential backoff until
+    the per-call deadline runs out. Pass `client` (e.g. StubVisionClient)
+    to run without the client library or network access.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_concurrency: int = VISION_MAX_CONCURRENCY,
+        max_retries: int = VISION_MAX_RETRIES,
+        deadline: float = VISION_DEADLINE,
+        backoff_base: float = VISION_BACKOFF_BASE,
+        backoff_max: float = VISION_BACKOFF_MAX
+    ):
+        self._client = client
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max(0, max_retries)
+        self.deadline = deadline
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # Metrics
+        self.calls_total = 0
+        self.images_total = 0
+        self.retries_total = 0
+        self.failures_total = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Imported here so the dependency is only needed when used; the
+            # async client must be created inside the running event loop
+            from google.cloud import vision
+            self._client = vision.ImageAnnotatorAsyncClient()
+        return self._client
+
     async def analyze_image(self, image_data: bytes) -> Dict[str, Any]:
         """Analyze an image for harmful content using Google Cloud Vision API."""
-        try:
-            # Create image object
-            image = vision.Image(content=image_data)
-            
-            # Perform safe search detection
-            safe_search = self.client.safe_search_detection(image=image).safe_search_annotation
-            
-            # Perform label detection for additional context
-            labels = self.client.label_detection(image=image).label_annotations
-            
-            # Map Google's likelihood to probability scores
-            likelihood_map = {
-                vision.Likelihood.UNKNOWN: 0.0,
-                vision.Likelihood.VERY_UNLIKELY: 0.1,
-                vision.Likelihood.UNLIKELY: 0.3,
-                vision.Likelihood.POSSIBLE: 0.5,
-                vision.Likelihood.LIKELY: 0.7,
-                vision.Likelihood.VERY_LIKELY: 0.9
-            }
-            
-            # Calculate overall safety score
-            safety_scores = {
-                "violence": likelihood_map[safe_search.violence],
-                "nudity": likelihood_map[safe_search.adult],
-                "hate_symbols": self._check_hate_symbols(labels),
-                "self_harm": self._check_self_harm(labels),
-                "extremist_content": self._check_extremist_content(labels)
-            }
-            
-            # Determine if image is safe (threshold at 0.7)
-            is_safe = all(score < 0.7 for score in safety_scores.values())
-            
-            # Calculate overall confidence
-            confidence = 1.0 - max(safety_scores.values())
-            
-            return {
-                "safe": is_safe,
-                "categories": safety_scores,
-                "confidence": confidence,
-                "labels": [label.description for label in labels[:5]]  # Top 5 labels
+        outcome = (await self.analyze_images([image_data]))[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    async def analyze_images(self, images: Sequence[bytes]) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Analyze many images with as few API calls as possible. Returns one
+        result per image in order; an image (or a whole call) that fails
+        comes back as a VisionError.
+        """
+        chunks = [
+            images[start:start + VISION_MAX_IMAGES_PER_CALL]
+            for start in range(0, len(images), VISION_MAX_IMAGES_PER_CALL)
+        ]
+        outcomes = await asyncio.gather(*(self._annotate(chunk) for chunk in chunks))
+        return [outcome for chunk_outcomes in outcomes for outcome in chunk_outcomes]
+
+    async def _annotate(self, images: Sequence[bytes]) -> List[Union[Dict[str, Any], Exception]]:
+        requests = [
+            {
+                "image": {"content": bytes(image_data)},
+                "features": [
+                    {"type_": SAFE_SEARCH_DETECTION},
+                    {"type_": LABEL_DETECTION, "max_results": VISION_LABEL_RESULTS}
+                ]
             }
-            
+            for image_data in images
+        ]
+        try:
+            response = await self._call(requests)
         except Exception as e:
-            raise Exception(f"Error analyzing image: {str(e)}")
-    
-    def _check_hate_symbols(self, labels) -> float:
-        """Check for hate symbols in image labels."""
-        hate_indicators = {'hate', 'symbol', 'flag', 'gesture', 'sign'}
-        return max(
-            (label.score for label in labels 
-             if any(indicator in label.description.lower() for indicator in hate_indicators)),
-            default=0.0
-        )
-    
-    def _check_self_harm(self, labels) -> float:
-        """Check for self-harm indicators in image labels."""
-        self_harm_indicators = {'self-harm', 'suicide', 'cut', 'wound', 'blood'}
-        return max(
-            (label.score for label in labels 
-             if any(indicator in label.description.lower() for indicator in self_harm_indicators)),
-            default=0.0
+            self.failures_total += 1
+            error = VisionError(f"Error analyzing image: {str(e)}")
+            return [error] * len(images)
+
+        outcomes = []
+        for item in response.responses:
+            if item.error.code:
+                outcomes.append(VisionError(f"Error analyzing image: {item.error.message}"))
+            else:
+                outcomes.append(self._build_result(item))
+        return outcomes
+
+    async def _call(self, requests: List[dict]):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+        attempt = 0
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise VisionError(f"Deadline of {self.deadline}s exceeded")
+            try:
+                async with self._semaphore:
+                    self.calls_total += 1
+                    self.images_total += len(requests)
+                    # The client's own retry is disabled so the deadline
+                    # covers every attempt
+                    return await asyncio.wait_for(
+                        self.client.batch_annotate_images(requests=requests, timeout=remaining, retry=None),
+                        remaining
+                    )
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+            # Full jitter: sleep a random time up to the exponential cap
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+            attempt += 1
+            self.retries_total += 1
+            await asyncio.sleep(min(delay, max(0.0, deadline - loop.time())))
+
+    def _build_result(self, response) -> Dict[str, Any]:
+        safe_search = response.safe_search_annotation
+        labels = list(response.label_annotations)
+
+        # Label-derived scores come from the taxonomy's precompiled patterns;
+        # SafeSearch likelihoods set the floor for violence and nudity
+        safety_scores = taxonomy.current.score_vision_labels(labels)
+        safety_scores["violence"] = max(safety_scores["violence"], LIKELIHOOD_SCORES[int(safe_search.violence)])
+        safety_scores["nudity"] = max(safety_scores["nudity"], LIKELIHOOD_SCORES[int(safe_search.adult)])
+
+        # Same threshold and result shape as every other backend
+        return make_result(
+            safety_scores,
+            [label.description for label in labels[:5]]  # Top 5 labels
         )
-    
-    def _check_extremist_content(self, labels) -> float:
-        """Check for extremist content indicators in image labels."""
-        extremist_indicators = {'weapon', 'terrorism', 'extremist', 'radical', 'protest'}
-        return max(
-            (label.score for label in labels 
-             if any(indicator in label.description.lower() for indicator in extremist_indicators)),
-            default=0.0
-        ) 
\ No newline at end of file
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls_total": self.calls_total,
+            "images_total": self.images_total,
+            "retries_total": self.retries_total,
+            "failures_total": self.failures_total
+        }
+
+
+class StubUnavailableError(ConnectionError):
+    """Transient error raised by StubVisionClient, like a 503 from the API."""
+
+    code = 503
+
+
+class StubVisionClient:
+    """
+    In-process stand-in for ImageAnnotatorAsyncClient, for tests and local
+    runs without network access. Every image gets the same annotations; the
+    first `failures` calls raise a retryable error and each call takes
+    `latency` seconds. `calls` records the number of images per call.
+    """
+
+    def __init__(
+        self,
+        safe_search: Optional[Dict[str, int]] = None,
+        labels: Sequence[Tuple[str, float]] = (),
+        failures: int = 0,
+        latency: float = 0.0
+    ):
+        self.safe_search = {"adult": 1, "violence": 1, **(safe_search or {})}
+        self.labels = list(labels)
+        self.failures = failures
+        self.latency = latency
+        self.calls: List[int] = []
+
+    async def batch_annotate_images(self, requests, timeout=None, retry=None):
+        self.calls.append(len(requests))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.failures > 0:
+            self.failures -= 1
+            raise StubUnavailableError("Service unavailable")
+        return SimpleNamespace(responses=[
+            SimpleNamespace(
+                error=SimpleNamespace(code=0, message=""),
+                safe_search_annotation=SimpleNamespace(**self.safe_search),
+                label_annotations=[
+                    SimpleNamespace(description=description, score=score)
+                    for description, score in self.labels
+                ]
+            )
+            for _ in requests
+        ])
@@ -0,0 +1,194 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_M1 = np.uint64(0x5555555555555555)
+_M2 = np.uint64(0x3333333333333333)
+_M4 = np.uint64(0x0F0F0F0F0F0F0F0F)
+_H01 = np.uint64(0x0101010101010101)
+
+def popcount64(values: np.ndarray) -> np.ndarray:
+    """Vectorized population count of a uint64 array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    x = values - ((values >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+def _to_signed(value: int) -> int:
+    """MongoDB stores int64, so fold unsigned 64-bit hashes into that range."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class HammingIndex:
+    """
+    Multi-index hash over 64-bit hashes for radius search in Hamming space.
+
+    Each hash is split into `max_distance + 1` disjoint bit ranges. Two hashes
+    within `max_distance` bits must agree exactly on at least one range
+    (pigeonhole), so a query only has to verify the entries that share a
+    range value with it. Ranges are kept as sorted arrays and probed with
+    binary search. New entries go to an unsorted tail that is scanned
+    linearly and merged into the sorted arrays once it grows large enough.
+    """
+
+    def __init__(self, max_distance: int = 4, min_merge_size: int = 4096):
+        self.max_distance = max(0, max_distance)
+        self.min_merge_size = min_merge_size
+        chunks = self.max_distance + 1
+        widths = [64 // chunks + (1 if i < 64 % chunks else 0) for i in range(chunks)]
+        self._ranges: List[Tuple[np.uint64, np.uint64]] = []
+        shift = 0
+        for width in widths:
+            mask = (1 << width) - 1 if width < 64 else (1 << 64) - 1
+            self._ranges.append((np.uint64(shift), np.uint64(mask)))
+            shift += width
+        self._key_dtype = np.uint32 if max(widths) <= 32 else np.uint64
+
+        self._hashes = np.empty(0, dtype=np.uint64)
+        self._sorted_keys: List[np.ndarray] = []
+        self._sorted_ids: List[np.ndarray] = []
+        self._tail: List[int] = []
+        self._values: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self._hashes) + len(self._tail)
+
+    def add(self, value_hash: int, value: Any = None) -> None:
+        self._tail.append(value_hash)
+        self._values.append(value)
+        if len(self._tail) >= max(self.min_merge_size, len(self._hashes) // 8):
+            self._merge()
+
+    def add_many(self, hashes: Sequence[int], values: Optional[Sequence[Any]] = None) -> None:
+        """Bulk insert; cheaper than repeated add() because it merges once."""
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if values is None:
+            values = [None] * len(hashes)
+        self._merge()
+        self._values.extend(values)
+        self._hashes = np.concatenate([self._hashes, hashes])
+        self._rebuild()
+
+    def _merge(self) -> None:
+        if not self._tail:
+            return
+        self._hashes = np.concatenate([self._hashes, np.array(self._tail, dtype=np.uint64)])
+        self._tail = []
+        self._rebuild()
+
+    def _rebuild(self) -> None:
+        id_dtype = np.uint32 if len(self._hashes) < 2 ** 32 else np.uint64
+        self._sorted_keys = []
+        self._sorted_ids = []
+        for shift, mask in self._ranges:
+            keys = ((self._hashes >> shift) & mask).astype(self._key_dtype)
+            order = np.argsort(keys, kind="stable").astype(id_dtype)
+            self._sorted_keys.append(keys[order])
+            self._sorted_ids.append(order)
+
+    def search(self, value_hash: int) -> Optional[Tuple[int, Any]]:
+        """Return (distance, value) of the closest entry within max_distance."""
+        query = np.uint64(value_hash)
+        best_distance = self.max_distance + 1
+        best_id = -1
+
+        if len(self._hashes):
+            candidates = []
+            for (shift, mask), keys, ids in zip(self._ranges, self._sorted_keys, self._sorted_ids):
+                key = self._key_dtype((query >> shift) & mask)
+                lo = np.searchsorted(keys, key, side="left")
+                hi = np.searchsorted(keys, key, side="right")
+                if hi > lo:
+                    candidates.append(ids[lo:hi])
+            if candidates:
+                candidate_ids = np.concatenate(candidates)
+                distances = popcount64(self._hashes[candidate_ids] ^ query)
+                position = int(np.argmin(distances))
+                if distances[position] < best_distance:
+                    best_distance = int(distances[position])
+                    best_id = int(candidate_ids[position])
+
+        if self._tail:
+            distances = popcount64(np.array(self._tail, dtype=np.uint64) ^ query)
+            position = int(np.argmin(distances))
+            if distances[position] < best_distance:
+                best_distance = int(distances[position])
+                best_id = len(self._hashes) + position
+
+        if best_id < 0:
+            return None
+        return best_distance, self._values[best_id]
+
+
+class NearDuplicateIndex:
+    """
+    Maps perceptual hashes to earlier moderation results so re-encoded,
+    resized or re-saved copies of an image can reuse a verdict. Entries are
+    persisted to MongoDB (when `collection` is set) and reloaded at startup.
+    """
+
+    def __init__(self, fingerprint: str, max_distance: int = 4, collection=None):
+        self.fingerprint = fingerprint
+        self.collection = collection
+        self.index = HammingIndex(max_distance=max_distance)
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    async def load(self, batch_size: int = 10000) -> int:
+        """Reload persisted hashes for the current fingerprint."""
+        if self.collection is None:
+            return 0
+        self.index = HammingIndex(max_distance=self.index.max_distance)
+        hashes, values = [], []
+        cursor = self.collection.find(
+            {"fingerprint": self.fingerprint},
+            {"_id": 0, "hash": 1, "result": 1}
+        ).batch_size(batch_size)
+        async for doc in cursor:
+            hashes.append(_to_unsigned(doc["hash"]))
+            values.append(doc["result"])
+        if hashes:
+            self.index.add_many(hashes, values)
+        return len(hashes)
+
+    async def rebind(self, fingerprint: str) -> int:
+        """Switch to a new fingerprint, dropping entries made under the old one."""
+        self.fingerprint = fingerprint
+        self.index = HammingIndex(max_distance=self.index.max_distance)
+        return await self.load()
+
+    async def lookup(self, value_hash: int) -> Optional[Dict[str, Any]]:
+        match = self.index.search(value_hash)
+        if match is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return match[1]
+
+    async def add(self, value_hash: int, result: Dict[str, Any]) -> None:
+        self.index.add(value_hash, result)
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"fingerprint": self.fingerprint, "hash": _to_signed(value_hash)},
+                {"$setOnInsert": {"result": result, "created_at": datetime.utcnow()}},
+                upsert=True
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.index),
+            "max_distance": self.index.max_distance,
+            "persistent": self.collection is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0
+        }
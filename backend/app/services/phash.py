@@ -0,0 +1,44 @@
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8
+PHASH_IMAGE_SIZE = 32
+
+def _pack_bits(bits: np.ndarray) -> int:
+    """Pack a flat boolean array (MSB first) into a Python int."""
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), "big")
+
+def dhash(image: Image.Image) -> int:
+    """
+    64-bit difference hash: compares horizontally adjacent pixels of a
+    9x8 grayscale thumbnail.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR),
+        dtype=np.int16
+    )
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+_DCT = _dct_matrix(PHASH_IMAGE_SIZE)
+
+def phash(image: Image.Image) -> int:
+    """
+    64-bit perceptual hash: low-frequency 8x8 block of the 2D DCT of a
+    32x32 grayscale thumbnail, thresholded at its median.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((PHASH_IMAGE_SIZE, PHASH_IMAGE_SIZE), Image.BILINEAR),
+        dtype=np.float64
+    )
+    low = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].ravel()
+    # The DC term dominates and carries no structure, so leave it out of the median
+    return _pack_bits(low > np.median(low[1:]))
+
+HASH_FUNCTIONS = {"dhash": dhash, "phash": phash}
@@ -0,0 +1,164 @@
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+from PIL import Image
+
+from services.upload import Buffer, BufferReader
+
+MODEL_INPUT_SIZE = (224, 224)
+
+# Images are rejected from their header dimensions, before any pixel data
+# is decoded, when they exceed this many pixels
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", str(40_000_000)))
+# Frames sampled from animated images; 1 keeps first-frame-only behaviour
+GIF_SAMPLE_FRAMES = int(os.getenv("GIF_SAMPLE_FRAMES", "3"))
+
+# Keep PIL's own bomb check in line with ours (it only warns below 2x)
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+
+class ImageTooLargeError(ValueError):
+    """Raised when an image's header declares more pixels than allowed."""
+
+
+def open_image(contents: Buffer) -> Image.Image:
+    """
+    Open an image lazily and validate its header dimensions. Nothing beyond
+    the header has been decoded when this returns.
+    """
+    try:
+        image = Image.open(BufferReader(contents))
+    except Image.DecompressionBombError as e:
+        # PIL refuses anything over twice its limit while opening it
+        raise ImageTooLargeError(str(e)) from e
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image dimensions {width}x{height} exceed the maximum of {MAX_IMAGE_PIXELS} pixels"
+        )
+    return image
+
+
+def downscale(image: Image.Image, size: Tuple[int, int] = MODEL_INPUT_SIZE) -> Image.Image:
+    """
+    Produce an RGB image of exactly `size` as cheaply as possible.
+
+    JPEGs are decoded with DCT scaling via draft(), which skips most of the
+    pixel work for large photos. Whatever is still much larger than the
+    target is shrunk with reduce() (box averaging by an integer factor)
+    before the final resample, so the resampling filter only ever sees an
+    image at most ~2x the target size.
+    """
+    if image.format == "JPEG" and image.mode in ("RGB", "L", "CMYK", "YCbCr"):
+        image.draft("RGB", size)
+
+    factor = min(image.width // (2 * size[0]), image.height // (2 * size[1]))
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    return image.resize(size, Image.BICUBIC)
+
+
+def sample_frames(image: Image.Image, max_frames: int = GIF_SAMPLE_FRAMES) -> List[Image.Image]:
+    """Return up to `max_frames` evenly spaced frames of an animated image."""
+    frame_count = getattr(image, "n_frames", 1)
+    if frame_count <= 1 or max_frames <= 1:
+        return [image]
+    indices = np.unique(np.linspace(0, frame_count - 1, min(max_frames, frame_count)).round().astype(int))
+    frames = []
+    for index in indices:
+        image.seek(int(index))
+        # convert() composites the current frame into a standalone image
+        frames.append(image.convert("RGB"))
+    return frames
+
+
+def to_pixels(frames: List[Image.Image]) -> np.ndarray:
+    """
+    Copy model-sized RGB frames into one uint8 (N, H, W, 3) array. Pixels
+    stay uint8, a quarter of the float32 size, until a batch is packed.
+    """
+    width, height = frames[0].size
+    pixels = np.empty((len(frames), height, width, 3), dtype=np.uint8)
+    for index, frame in enumerate(frames):
+        pixels[index] = np.asarray(frame)
+    return pixels
+
+
+def normalize_into(pixels: np.ndarray, out: np.ndarray) -> np.ndarray:
+    """
+    MobileNetV2 normalization, [0, 255] -> [-1, 1], computed in float32 over
+    the whole array at once and written into `out` with no temporaries.
+    """
+    np.multiply(pixels, np.float32(1 / 127.5), out=out, dtype=np.float32)
+    np.subtract(out, np.float32(1.0), out=out)
+    return out
+
+
+class BatchArena:
+    """
+    Reusable buffers for turning uint8 images into one contiguous float32
+    model batch: a [capacity, H, W, 3] uint8 staging area and a float32
+    buffer of the same shape that normalization writes into.
+
+    `pack()` returns a view into the arena that is only valid until the next
+    call, so an arena must belong to a single producer that waits for each
+    batch to be consumed (the batch scheduler runs one batch at a time).
+    Buffers grow when a larger batch arrives and are never shrunk.
+    """
+
+    def __init__(self, capacity: int, size: Tuple[int, int] = MODEL_INPUT_SIZE):
+        self.size = size
+        self.capacity = 0
+        self.grows_total = 0
+        self._pixels = np.empty((0, size[1], size[0], 3), dtype=np.uint8)
+        self._inputs = np.empty((0, size[1], size[0], 3), dtype=np.float32)
+        self.reserve(capacity)
+
+    def reserve(self, capacity: int) -> None:
+        if capacity <= self.capacity:
+            return
+        shape = (capacity, self.size[1], self.size[0], 3)
+        self._pixels = np.empty(shape, dtype=np.uint8)
+        self._inputs = np.empty(shape, dtype=np.float32)
+        self.capacity = capacity
+        self.grows_total += 1
+
+    def pack(self, items: Sequence[np.ndarray]) -> np.ndarray:
+        """
+        Stage uint8 images, each (H, W, 3) or (N, H, W, 3), and return the
+        normalized float32 batch.
+        """
+        count = sum(1 if item.ndim == 3 else len(item) for item in items)
+        self.reserve(count)
+        position = 0
+        for item in items:
+            if item.ndim == 3:
+                self._pixels[position] = item
+                position += 1
+            else:
+                self._pixels[position:position + len(item)] = item
+                position += len(item)
+        return normalize_into(self._pixels[:count], self._inputs[:count])
+
+
+def pack_batch(items: Sequence[np.ndarray]) -> np.ndarray:
+    """One-off packing into freshly allocated buffers, for callers that cannot share an arena."""
+    return BatchArena(0).pack(items)
+
+
+def frame_inputs(image: Image.Image, size: Tuple[int, int] = MODEL_INPUT_SIZE) -> List[Image.Image]:
+    """Decode and downscale the frame(s) of an opened image to analyze."""
+    return [downscale(frame, size) for frame in sample_frames(image)]
+
+
+def is_animated(image: Image.Image) -> bool:
+    return getattr(image, "n_frames", 1) > 1
+
+
+def load_frames(contents: Buffer, size: Tuple[int, int] = MODEL_INPUT_SIZE) -> List[Image.Image]:
+    """Header check, then decode and downscale the frame(s) to analyze."""
+    return frame_inputs(open_image(contents), size)
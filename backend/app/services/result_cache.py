@@ -0,0 +1,111 @@
+import hashlib
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+
+class ResultCache:
+    """
+    Two-tier cache of moderation results keyed by a hash of the upload bytes.
+
+    The first tier is an in-process LRU bounded by `max_entries` and
+    `ttl_seconds`. The optional second tier is a MongoDB collection shared by
+    every replica; its documents expire through a TTL index on `created_at`.
+    `fingerprint` identifies the model version and thresholds that produced a
+    result and is folded into every key, so changing either invalidates all
+    previous entries.
+    """
+
+    def __init__(
+        self,
+        fingerprint: str,
+        max_entries: int = 10000,
+        ttl_seconds: float = 3600,
+        collection=None
+    ):
+        self.fingerprint = fingerprint
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.collection = collection
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        # Metrics
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def key(self, contents: bytes) -> str:
+        """Return the cache key for a raw upload."""
+        digest = hashlib.blake2b(contents, digest_size=32).hexdigest()
+        return f"{self.fingerprint}:{digest}"
+
+    def invalidate(self, fingerprint: Optional[str] = None) -> None:
+        """Drop all local entries, optionally switching to a new fingerprint."""
+        if fingerprint is not None:
+            self.fingerprint = fingerprint
+        self._entries.clear()
+
+    def _get_local(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _set_local(self, key: str, result: Dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a result, checking the local tier before the shared one."""
+        result = self._get_local(key)
+        if result is not None:
+            self.hits += 1
+            return result
+
+        if self.collection is not None:
+            doc = await self.collection.find_one({"_id": key})
+            # The TTL monitor only runs once a minute, so check expiry here too
+            if doc and doc["created_at"] > datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                self.shared_hits += 1
+                self._set_local(key, doc["result"])
+                return doc["result"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a result in both tiers."""
+        self._set_local(key, result)
+        if self.collection is not None:
+            await self.collection.replace_one(
+                {"_id": key},
+                {
+                    "_id": key,
+                    "fingerprint": self.fingerprint,
+                    "result": result,
+                    "created_at": datetime.utcnow()
+                },
+                upsert=True
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "shared": self.collection is not None,
+            "fingerprint": self.fingerprint,
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0
+        }
@@ -0,0 +1,217 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# "keras" runs the TensorFlow model directly; "tflite" and "onnx" run a file
+# produced by `python services/model_registry.py --export ... --runtime ...`
+RUNTIMES = ("keras", "tflite", "onnx")
+# Runtimes whose loaded model keeps working in processes forked afterwards.
+# TensorFlow's and ONNX Runtime's thread pools don't survive fork(); the
+# TFLite interpreter does, and its weights are mmap'd from the model file.
+FORK_SAFE_RUNTIMES = ("tflite",)
+QUANTIZATION_MODES = (None, "int8")
+
+MODEL_INPUT_SHAPE = (224, 224, 3)
+
+# (wnid, label) per output class, written next to exported models so the
+# TFLite and ONNX runtimes never need to import TensorFlow
+ClassIndex = List[Tuple[str, str]]
+
+
+def labels_path_for(model_path: str) -> str:
+    return f"{model_path}.labels.json"
+
+
+def write_class_index(path: str, class_index: ClassIndex) -> None:
+    with open(path, "w") as f:
+        json.dump([list(entry) for entry in class_index], f)
+
+
+def read_class_index(path: str) -> ClassIndex:
+    with open(path) as f:
+        return [tuple(entry) for entry in json.load(f)]
+
+
+class TFLiteRunner:
+    """
+    Runs a .tflite model with the Keras call convention. Uses the standalone
+    tflite_runtime package when installed, else TensorFlow's interpreter.
+    The input tensor is resized whenever the batch size changes, and
+    quantized input/output tensors are (de)quantized transparently.
+    """
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self._interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size: Optional[int] = None
+        # An interpreter must not be invoked from two threads at once
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: np.ndarray, training: bool = False) -> np.ndarray:
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            scale, zero_point = self._input["quantization"]
+            if scale:
+                batch = np.round(batch / scale + zero_point)
+            self._interpreter.set_tensor(self._input["index"], batch.astype(self._input["dtype"], copy=False))
+            self._interpreter.invoke()
+            outputs = self._interpreter.get_tensor(self._output["index"])
+        scale, zero_point = self._output["quantization"]
+        if scale:
+            outputs = (outputs.astype(np.float32) - zero_point) * scale
+        return outputs
+
+
+class OnnxRunner:
+    """Runs an .onnx model on ONNX Runtime's CPU provider with the Keras call convention."""
+
+    def __init__(self, path: str, intra_op_threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        self._session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+
+    def __call__(self, batch: np.ndarray, training: bool = False) -> np.ndarray:
+        # InferenceSession.run is safe to call from several threads
+        return self._session.run(None, {self._input_name: batch.astype(np.float32, copy=False)})[0]
+
+
+def load_runner(
+    runtime: str,
+    path: str,
+    intra_op_threads: Optional[int] = None,
+    inter_op_threads: Optional[int] = None
+):
+    if runtime == "tflite":
+        return TFLiteRunner(path, num_threads=intra_op_threads)
+    if runtime == "onnx":
+        return OnnxRunner(path, intra_op_threads, inter_op_threads)
+    raise ValueError(f"Unknown model runtime: {runtime}")
+
+
+def calibration_batches(directory: Optional[str], count: int = 100) -> Iterator[np.ndarray]:
+    """
+    Yield normalized (1, 224, 224, 3) batches for post-training quantization.
+    Real images from `directory` should be used; without one, random inputs
+    are used and quantized accuracy will suffer.
+    """
+    from services.preprocessing import load_frames, pack_batch, to_pixels
+
+    if not directory:
+        logger.warning("No calibration images given; calibrating INT8 ranges on random inputs")
+        rng = np.random.default_rng(0)
+        for _ in range(count):
+            yield pack_batch([rng.integers(0, 256, size=MODEL_INPUT_SHAPE, dtype=np.uint8)])
+        return
+
+    produced = 0
+    for name in sorted(os.listdir(directory)):
+        if produced >= count:
+            break
+        try:
+            with open(os.path.join(directory, name), "rb") as f:
+                frames = load_frames(f.read())
+        except (OSError, ValueError):
+            continue
+        yield pack_batch([to_pixels(frames[:1])])
+        produced += 1
+
+
+def export_tflite(model, path: str, quantize: Optional[str] = None, calibration_dir: Optional[str] = None) -> None:
+    """
+    Convert a Keras model to TFLite. With quantize="int8", weights and
+    activations are quantized from calibration data; inputs and outputs stay
+    float32 so callers don't change.
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize == "int8":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = lambda: ([batch] for batch in calibration_batches(calibration_dir))
+    with open(path, "wb") as f:
+        f.write(converter.convert())
+
+
+def export_onnx(model, path: str, quantize: Optional[str] = None, calibration_dir: Optional[str] = None) -> None:
+    """
+    Convert a Keras model to ONNX (needs tf2onnx). With quantize="int8",
+    the graph is statically quantized (QDQ, per-channel int8 weights) with
+    ONNX Runtime's quantization tools.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    signature = (tf.TensorSpec((None, *MODEL_INPUT_SHAPE), tf.float32, name="input"),)
+    if quantize != "int8":
+        tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=path)
+        return
+
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class CalibrationReader(CalibrationDataReader):
+        def __init__(self, input_name: str, batches: Iterator[np.ndarray]):
+            self._input_name = input_name
+            self._batches = batches
+
+        def get_next(self):
+            batch = next(self._batches, None)
+            return None if batch is None else {self._input_name: batch}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        float_path = os.path.join(workdir, "float.onnx")
+        tf2onnx.convert.from_keras(model, input_signature=signature, opset=13, output_path=float_path)
+        quantize_static(
+            float_path,
+            path,
+            CalibrationReader("input", calibration_batches(calibration_dir)),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8
+        )
+
+
+EXPORTERS = {
+    "tflite": export_tflite,
+    "onnx": export_onnx
+}
+
+
+def top_k_agreement(reference: np.ndarray, candidate: np.ndarray, k: int = 1) -> float:
+    """Share of rows whose top-1 class in `reference` is within `candidate`'s top-k."""
+    expected = np.argmax(reference, axis=-1)
+    top = np.argsort(candidate, axis=-1)[:, ::-1][:, :k]
+    return float(np.mean([label in row for label, row in zip(expected, top)]))
+
+
+def check_runtime(runtime: str) -> None:
+    if runtime not in RUNTIMES:
+        raise ValueError(f"Unknown model runtime: {runtime}; expected one of {', '.join(RUNTIMES)}")
+
+
+def check_quantization(quantize: Optional[str]) -> None:
+    if quantize not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {quantize}")
+
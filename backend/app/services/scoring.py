@@ -0,0 +1,23 @@
+import os
+from typing import Dict, List
+
+# A category score at or above this marks the image unsafe. Every backend
+# uses the same threshold so their verdicts are comparable.
+SAFE_THRESHOLD = float(os.getenv("SAFE_THRESHOLD", "0.5"))
+
+CATEGORIES = ("violence", "nudity", "hate_symbols", "self_harm", "extremist_content")
+
+
+def empty_categories() -> Dict[str, float]:
+    return {category: 0.0 for category in CATEGORIES}
+
+
+def make_result(categories: Dict[str, float], labels: List[str]) -> dict:
+    """Build the public result shape from per-category scores."""
+    max_risk = max(categories.values())
+    return {
+        "safe": max_risk < SAFE_THRESHOLD,
+        "categories": categories,
+        "confidence": 1 - max_risk,
+        "labels": labels
+    }
@@ -0,0 +1,185 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from services.scoring import CATEGORIES, empty_categories
+
+logger = logging.getLogger(__name__)
+
+# Label-to-category rules; see taxonomy.json for the format
+TAXONOMY_PATH = os.getenv(
+    "TAXONOMY_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)), "taxonomy.json")
+)
+
+# Distinct Vision label strings whose categories are remembered
+LABEL_CACHE_SIZE = 10000
+
+# How ImageNet probabilities become category scores: "max" takes each
+# category's highest probability x weight among the top_k classes (the
+# original top-5 rules); "sum" adds probability x weight over every class
+IMAGENET_SCORING_METHODS = ("max", "sum")
+
+
+class TaxonomyError(ValueError):
+    """Raised when a taxonomy file is missing, malformed or names unknown categories."""
+
+
+def _compile_patterns(patterns: Sequence[str]) -> Optional[re.Pattern]:
+    # One case-insensitive alternation per category instead of a loop over words
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{pattern})" for pattern in patterns), re.IGNORECASE)
+
+
+class Taxonomy:
+    """
+    A compiled, immutable taxonomy.
+
+    ImageNet rules become a (classes x categories) weight matrix the first
+    time they meet the model's class labels. A class gets its explicit
+    weight from a rule's "classes", or the pattern weight of the first rule
+    (in file order) whose patterns its label matches. With the default
+    "max" scoring, each category takes the highest probability x weight
+    among the top_k classes; "sum" scores the whole softmax vector with one
+    matmul. Vision labels are matched against one precompiled regex per
+    category, and results are memoized per label.
+    """
+
+    def __init__(self, spec: Dict[str, Any], digest: str):
+        self.version = str(spec.get("version", ""))
+        self.digest = digest
+        scoring = spec.get("imagenet_scoring", {})
+        self.imagenet_method = scoring.get("method", "max")
+        if self.imagenet_method not in IMAGENET_SCORING_METHODS:
+            raise TaxonomyError(
+                f"Unknown imagenet_scoring method {self.imagenet_method!r}; "
+                f"expected one of {', '.join(IMAGENET_SCORING_METHODS)}"
+            )
+        self.imagenet_top_k = max(1, int(scoring.get("top_k", 5)))
+        self._imagenet_rules = []
+        for category, rule in spec.get("imagenet", {}).items():
+            self._check_category(category)
+            self._imagenet_rules.append((
+                CATEGORIES.index(category),
+                _compile_patterns(rule.get("patterns", [])),
+                float(rule.get("weight", 1.0)),
+                {name.lower(): float(weight) for name, weight in rule.get("classes", {}).items()}
+            ))
+        self._vision_patterns = {}
+        for category, patterns in spec.get("vision_labels", {}).items():
+            self._check_category(category)
+            self._vision_patterns[category] = _compile_patterns(patterns)
+
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_labels: Optional[Sequence[str]] = None
+        self._matrix_lock = threading.Lock()
+        self._label_cache: Dict[str, Tuple[str, ...]] = {}
+
+    @staticmethod
+    def _check_category(category: str) -> None:
+        if category not in CATEGORIES:
+            raise TaxonomyError(f"Unknown category {category!r}; expected one of {', '.join(CATEGORIES)}")
+
+    def imagenet_matrix(self, class_labels: Sequence[str]) -> np.ndarray:
+        """The float32 (len(class_labels), len(CATEGORIES)) weight matrix."""
+        if self._matrix_labels is not class_labels:
+            with self._matrix_lock:
+                if self._matrix_labels is not class_labels:
+                    matrix = np.zeros((len(class_labels), len(CATEGORIES)), dtype=np.float32)
+                    for index, label in enumerate(class_labels):
+                        name = label.lower()
+                        matched = False
+                        for column, pattern, weight, classes in self._imagenet_rules:
+                            if name in classes:
+                                matrix[index, column] = max(matrix[index, column], classes[name])
+                            elif not matched and pattern is not None and pattern.search(name):
+                                matrix[index, column] = max(matrix[index, column], weight)
+                                matched = True
+                    self._matrix = matrix
+                    self._matrix_labels = class_labels
+        return self._matrix
+
+    def score_imagenet(self, probabilities: np.ndarray, class_labels: Sequence[str]) -> np.ndarray:
+        """Category scores for a (classes,) or (N, classes) array of probabilities."""
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        matrix = self.imagenet_matrix(class_labels)
+        if self.imagenet_method == "sum":
+            scores = probabilities @ matrix
+        else:
+            k = min(self.imagenet_top_k, probabilities.shape[-1])
+            top = np.argpartition(-probabilities, k - 1, axis=-1)[..., :k]
+            top_probabilities = np.take_along_axis(probabilities, top, axis=-1)
+            scores = (top_probabilities[..., None] * matrix[top]).max(axis=-2)
+        return np.clip(scores, 0.0, 1.0)
+
+    def label_categories(self, description: str) -> Tuple[str, ...]:
+        """Categories a Vision label description indicates."""
+        categories = self._label_cache.get(description)
+        if categories is None:
+            categories = tuple(
+                category for category, pattern in self._vision_patterns.items()
+                if pattern is not None and pattern.search(description)
+            )
+            if len(self._label_cache) >= LABEL_CACHE_SIZE:
+                self._label_cache.clear()
+            self._label_cache[description] = categories
+        return categories
+
+    def score_vision_labels(self, labels) -> Dict[str, float]:
+        """Highest label score per category, for objects with .description and .score."""
+        scores = empty_categories()
+        for label in labels:
+            for category in self.label_categories(label.description):
+                scores[category] = max(scores[category], float(label.score))
+        return scores
+
+
+def load_taxonomy(path: str) -> Taxonomy:
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        spec = json.loads(raw)
+    except (OSError, ValueError) as e:
+        raise TaxonomyError(f"Could not load taxonomy from {path}: {e}")
+    try:
+        return Taxonomy(spec, hashlib.blake2b(raw, digest_size=8).hexdigest())
+    except re.error as e:
+        raise TaxonomyError(f"Invalid pattern in {path}: {e}")
+
+
+class TaxonomyStore:
+    """
+    Holds the active taxonomy and swaps in a newly compiled one on reload().
+    Readers take `current` once per call, so an in-flight request never sees
+    half of an old taxonomy and half of a new one. A reload that fails keeps
+    the previous taxonomy.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.reloads_total = 0
+        self.current = load_taxonomy(path)
+
+    def reload(self) -> Taxonomy:
+        taxonomy = load_taxonomy(self.path)
+        self.current = taxonomy
+        self.reloads_total += 1
+        logger.info("Taxonomy reloaded: version=%s digest=%s", taxonomy.version, taxonomy.digest)
+        return taxonomy
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "version": self.current.version,
+            "digest": self.current.digest,
+            "reloads_total": self.reloads_total
+        }
+
+
+taxonomy = TaxonomyStore(TAXONOMY_PATH)
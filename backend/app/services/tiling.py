@@ -0,0 +1,118 @@
+import math
+import os
+from typing import List, Tuple
+
+from PIL import Image
+
+from services.preprocessing import MODEL_INPUT_SIZE, downscale, frame_inputs, is_animated, open_image
+from services.upload import Buffer
+
+# Tiled analysis: besides the whole image squashed to the model's input, a
+# large photo is cut into overlapping crops so small regions keep enough
+# pixels to be recognised. Off by default; results change when it's enabled.
+TILING_ENABLED = os.getenv("TILING_ENABLED", "false").lower() == "true"
+# Model inputs allowed per image, the global thumbnail included
+TILE_BUDGET = int(os.getenv("TILE_BUDGET", "10"))
+# Model inputs allowed per request; images of a batch share it
+TILE_REQUEST_BUDGET = int(os.getenv("TILE_REQUEST_BUDGET", "64"))
+# Tiles never cover fewer source pixels per side than this, so small images
+# get few tiles (or none) and large ones get more, up to the budget
+TILE_MIN_SIDE = int(os.getenv("TILE_MIN_SIDE", "448"))
+# Fraction of a tile shared with its neighbour, so regions on a seam are
+# seen whole by at least one tile
+TILE_OVERLAP = float(os.getenv("TILE_OVERLAP", "0.25"))
+# Inputs per forward pass; analysis stops after the pass in which any input
+# scores unsafe. 0 runs all of an image's inputs in one pass.
+TILE_WAVE_SIZE = int(os.getenv("TILE_WAVE_SIZE", "5"))
+
+# (left, top, right, bottom) in source pixels
+Box = Tuple[int, int, int, int]
+
+
+def tile_budget(images: int = 1) -> int:
+    """Model inputs each of `images` uploads in one request may use (1: no tiles)."""
+    if not TILING_ENABLED:
+        return 1
+    return max(1, min(TILE_BUDGET, TILE_REQUEST_BUDGET // max(1, images)))
+
+
+def tile_grid(width: int, height: int, max_tiles: int, min_side: int = TILE_MIN_SIDE) -> Tuple[int, int]:
+    """
+    Columns and rows of tiles for an image: one per `min_side` source pixels
+    along each side, then the denser side is thinned until the grid fits in
+    `max_tiles`.
+    """
+    columns = max(1, width // min_side)
+    rows = max(1, height // min_side)
+    while columns * rows > max(1, max_tiles):
+        if columns >= rows:
+            columns -= 1
+        else:
+            rows -= 1
+    return columns, rows
+
+
+def plan_tiles(width: int, height: int, columns: int, rows: int, overlap: float = TILE_OVERLAP) -> List[Box]:
+    """Boxes of a `columns` x `rows` grid that covers the image, neighbours sharing `overlap`."""
+    def spans(length: int, count: int) -> List[Tuple[int, int]]:
+        size = length / (count - (count - 1) * overlap)
+        step = size * (1 - overlap)
+        return [(round(index * step), min(length, round(index * step + size))) for index in range(count)]
+
+    return [
+        (left, top, right, bottom)
+        for top, bottom in spans(height, rows)
+        for left, right in spans(width, columns)
+    ]
+
+
+def cut_tiles(image: Image.Image, boxes: List[Box], size: Tuple[int, int] = MODEL_INPUT_SIZE) -> List[Image.Image]:
+    """
+    The whole image followed by each box, all resized to `size`. The image
+    is decoded once, JPEGs at the smallest DCT scale that still gives every
+    tile at least `size` pixels.
+    """
+    width, height = image.size
+    if image.format == "JPEG" and image.mode in ("RGB", "L", "CMYK", "YCbCr"):
+        tile_width = min(right - left for left, _, right, _ in boxes)
+        tile_height = min(bottom - top for _, top, _, bottom in boxes)
+        image.draft("RGB", (
+            math.ceil(width * size[0] / tile_width),
+            math.ceil(height * size[1] / tile_height)
+        ))
+    scale = image.width / width
+    # A converted copy has no format, so downscale() won't try draft() again
+    image = image.convert("RGB")
+    tiles = [downscale(image, size)]
+    for left, top, right, bottom in boxes:
+        crop = image.crop((
+            int(left * scale), int(top * scale), math.ceil(right * scale), math.ceil(bottom * scale)
+        ))
+        tiles.append(downscale(crop, size))
+    return tiles
+
+
+def tile_inputs(image: Image.Image, max_inputs: int, size: Tuple[int, int] = MODEL_INPUT_SIZE) -> List[Image.Image]:
+    """
+    The model inputs for an opened image: the global thumbnail first, then
+    up to `max_inputs - 1` tiles. Images too small for a grid, and animated
+    images (whose frames are sampled instead), come back as frame_inputs()
+    would return them.
+    """
+    if max_inputs > 1 and not is_animated(image):
+        columns, rows = tile_grid(image.width, image.height, max_inputs - 1)
+        if columns * rows > 1:
+            return cut_tiles(image, plan_tiles(image.width, image.height, columns, rows), size)
+    return frame_inputs(image, size)
+
+
+def load_tiles(contents: Buffer, max_inputs: int, size: Tuple[int, int] = MODEL_INPUT_SIZE) -> List[Image.Image]:
+    """Header check, then tile_inputs()."""
+    return tile_inputs(open_image(contents), max_inputs, size)
+
+
+def wave_slices(count: int, wave_size: int = TILE_WAVE_SIZE) -> List[slice]:
+    """Consecutive forward passes over `count` inputs; the thumbnail is always in the first."""
+    if not TILING_ENABLED or wave_size <= 0 or count <= wave_size:
+        return [slice(0, count)]
+    return [slice(start, min(count, start + wave_size)) for start in range(0, count, wave_size)]
@@ -0,0 +1,142 @@
+import io
+import os
+from typing import Any, Dict, Optional, Union
+
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"\xff\xd8\xff": "image/jpeg",
+    b"GIF87a": "image/gif",
+    b"GIF89a": "image/gif"
+}
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class UploadTooLargeError(ValueError):
+    """Raised as soon as an upload is known to exceed the size limit."""
+
+
+class UploadTypeError(ValueError):
+    """Raised when the first bytes of an upload are not a supported image."""
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only, seekable file object over an in-memory buffer. Unlike
+    io.BytesIO it never copies a bytearray or memoryview up front, so PIL can
+    decode straight from the buffer the upload was read into.
+    """
+
+    def __init__(self, buffer: Buffer):
+        self._view = memoryview(buffer).cast("B")
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        size = min(len(target), len(self._view) - self._position)
+        target[:size] = self._view[self._position:self._position + size]
+        self._position += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = len(self._view) + offset
+        self._position = max(0, self._position)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+
+def sniff_image_type(header: Buffer) -> Optional[str]:
+    """Return the MIME type implied by an image's leading bytes, if any."""
+    header = bytes(header[:8])
+    for signature, mime_type in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return mime_type
+    return None
+
+
+class UploadStats:
+    """Counters describing how much upload data requests buffer."""
+
+    def __init__(self):
+        self.uploads_total = 0
+        self.bytes_total = 0
+        self.largest_upload_bytes = 0
+        self.rejected_too_large = 0
+        self.rejected_bad_type = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "uploads_total": self.uploads_total,
+            "bytes_total": self.bytes_total,
+            "largest_upload_bytes": self.largest_upload_bytes,
+            "rejected_too_large": self.rejected_too_large,
+            "rejected_bad_type": self.rejected_bad_type
+        }
+
+
+upload_stats = UploadStats()
+
+
+async def read_upload(
+    file: UploadFile,
+    max_size: int,
+    require_image: bool = True,
+    chunk_size: int = UPLOAD_CHUNK_SIZE
+) -> bytearray:
+    """
+    Read an upload in chunks into a single buffer of at most `max_size`
+    bytes. The declared size is checked before reading, the running size
+    after every chunk, and (when `require_image` is set) the image signature
+    from the first chunk, so oversized or non-image uploads are rejected
+    without being buffered in full.
+    """
+    if file.size is not None and file.size > max_size:
+        upload_stats.rejected_too_large += 1
+        raise UploadTooLargeError(f"File size exceeds maximum allowed size of {max_size/1024/1024}MB")
+
+    # Preallocate when the size is known so chunks are copied in exactly once
+    buffer = bytearray(file.size or 0)
+    view = memoryview(buffer)
+    length = 0
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if length == 0 and require_image and sniff_image_type(chunk) is None:
+            upload_stats.rejected_bad_type += 1
+            raise UploadTypeError("File content is not a supported image")
+        if length + len(chunk) > max_size:
+            upload_stats.rejected_too_large += 1
+            raise UploadTooLargeError(f"File size exceeds maximum allowed size of {max_size/1024/1024}MB")
+        if length + len(chunk) <= len(buffer):
+            view[length:length + len(chunk)] = chunk
+        else:
+            view.release()
+            del buffer[length:]
+            buffer += chunk
+            view = memoryview(buffer)
+        length += len(chunk)
+    view.release()
+    del buffer[length:]
+
+    upload_stats.uploads_total += 1
+    upload_stats.bytes_total += length
+    upload_stats.largest_upload_bytes = max(upload_stats.largest_upload_bytes, length)
+    return buffer
@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from models.auth import UsageRecord
+
+logger = logging.getLogger(__name__)
+
+USAGE_FLUSH_SIZE = int(os.getenv("USAGE_FLUSH_SIZE", "500"))
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "1.0"))
+USAGE_BUFFER_MAX = int(os.getenv("USAGE_BUFFER_MAX", "50000"))
+
+# Usage is counted in one `usage_buckets` document per token, endpoint and
+# "minute" or "hour", plus hour/day/month totals per token in `usage_rollups`
+USAGE_BUCKET = os.getenv("USAGE_BUCKET", "hour")
+USAGE_BUCKET_RETENTION_SECONDS = int(os.getenv("USAGE_BUCKET_RETENTION_SECONDS", str(90 * 86400)))
+
+# Raw per-image `usages` events are optional; they expire only when
+# USAGE_RAW_RETENTION_SECONDS is set (see db/mongodb.py)
+USAGE_RAW_EVENTS = os.getenv("USAGE_RAW_EVENTS", "false").lower() == "true"
+
+ROLLUP_PERIODS = ("hour", "day", "month")
+
+
+def period_start(when: datetime, period: str) -> datetime:
+    """Start of the minute, hour, day or month that contains `when`."""
+    if period == "minute":
+        return when.replace(second=0, microsecond=0)
+    if period == "hour":
+        return when.replace(minute=0, second=0, microsecond=0)
+    if period == "day":
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "month":
+        return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown usage period: {period}")
+
+
+class UsageBuffer:
+    """
+    Write-behind buffer for usage counts and token `last_used` updates.
+
+    Requests hand records over without awaiting MongoDB. Records are summed
+    in memory per token, endpoint and bucket (a minute or an hour), and a
+    background task flushes the sums whenever `flush_size` records are
+    waiting or every `flush_interval` seconds: one `$inc` upsert per bucket,
+    and one per token and hour/day/month rollup. So storage grows with
+    tokens times buckets, not with images, and a token's total for a period
+    is a single document read. All `last_used` updates seen since the
+    previous flush are coalesced into one `bulk_write`.
+
+    With `raw_events`, each record is also inserted into `usages` (expired
+    by a TTL index if USAGE_RAW_RETENTION_SECONDS is set). When more than
+    `max_buffered` records are waiting, new ones are dropped and counted
+    rather than growing memory without bound.
+    """
+
+    def __init__(
+        self,
+        flush_size: int = 500,
+        flush_interval: float = 1.0,
+        max_buffered: int = 50000,
+        bucket: str = "hour",
+        raw_events: bool = False
+    ):
+        if bucket not in ("minute", "hour"):
+            raise ValueError(f"Usage buckets must be \"minute\" or \"hour\", not {bucket!r}")
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.max_buffered = max(self.flush_size, max_buffered)
+        self.bucket = bucket
+        self.raw_events = raw_events
+        self._db = None
+        # (token, endpoint, bucket start) -> [images, bytes]
+        self._counts: Dict[Tuple[str, str, datetime], List[int]] = {}
+        self._pending = 0
+        self._records: List[Dict[str, Any]] = []
+        self._last_used: Dict[str, datetime] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+        # Metrics
+        self.recorded_total = 0
+        self.flushed_total = 0
+        self.dropped_total = 0
+        self.rollup_dropped_total = 0
+        self.flushes_total = 0
+        self.flush_errors_total = 0
+
+    def start(self, db) -> None:
+        self._db = db
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the flush loop and drain everything still buffered. The loop is
+        woken rather than cancelled, so a flush that is mid-write finishes
+        instead of losing the batch it already took.
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def record(self, usage: UsageRecord) -> None:
+        """Count a usage record towards the next flush."""
+        if self._pending >= self.max_buffered:
+            self.dropped_total += 1
+            return
+        key = (usage.token, usage.endpoint, period_start(usage.timestamp, self.bucket))
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0, 0]
+        counts[0] += 1
+        counts[1] += usage.file_size or 0
+        if self.raw_events:
+            self._records.append(usage.model_dump(exclude_none=True))
+        self._pending += 1
+        self.recorded_total += 1
+        if self._pending >= self.flush_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def touch(self, token: str, when: Optional[datetime] = None) -> None:
+        """Queue a `last_used` update; only the latest per token is written."""
+        when = when or datetime.utcnow()
+        previous = self._last_used.get(token)
+        if previous is None or when > previous:
+            self._last_used[token] = when
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write out everything buffered so far."""
+        if self._db is None:
+            return
+        counts, self._counts = self._counts, {}
+        pending, self._pending = self._pending, 0
+        records, self._records = self._records, []
+        last_used, self._last_used = self._last_used, {}
+        if not counts and not last_used:
+            return
+
+        self.flushes_total += 1
+        # Buckets and rollups are written independently, so a failure is
+        # reported against the store that actually missed the records
+        if counts:
+            try:
+                await self._write_buckets(counts)
+                self.flushed_total += pending
+            except Exception as e:
+                self.flush_errors_total += 1
+                self.dropped_total += pending
+                logger.warning("Dropped usage buckets for %d records: %s", pending, e)
+            try:
+                await self._write_rollups(counts)
+            except Exception as e:
+                self.flush_errors_total += 1
+                self.rollup_dropped_total += pending
+                logger.warning("Dropped usage rollups for %d records: %s", pending, e)
+        if records:
+            try:
+                await self._db.usages.insert_many(records, ordered=False)
+            except Exception as e:
+                self.flush_errors_total += 1
+                logger.warning("Dropped %d raw usage events: %s", len(records), e)
+        if last_used:
+            try:
+                await self._db.tokens.bulk_write(
+                    [
+                        UpdateOne({"token": token}, {"$max": {"last_used": when}})
+                        for token, when in last_used.items()
+                    ],
+                    ordered=False
+                )
+            except Exception as e:
+                self.flush_errors_total += 1
+                logger.warning("Failed to update last_used for %d tokens: %s", len(last_used), e)
+
+    async def _write_buckets(self, counts: Dict[Tuple[str, str, datetime], List[int]]) -> None:
+        await self._db.usage_buckets.bulk_write(
+            [
+                UpdateOne(
+                    {"token": token, "endpoint": endpoint, "start": start},
+                    {"$inc": {"count": images, "bytes": size}, "$setOnInsert": {"granularity": self.bucket}},
+                    upsert=True
+                )
+                for (token, endpoint, start), (images, size) in counts.items()
+            ],
+            ordered=False
+        )
+
+    async def _write_rollups(self, counts: Dict[Tuple[str, str, datetime], List[int]]) -> None:
+        rollups: Dict[Tuple[str, str, datetime], Dict[str, int]] = {}
+        for (token, endpoint, start), (images, size) in counts.items():
+            for period in ROLLUP_PERIODS:
+                increments = rollups.setdefault((token, period, period_start(start, period)), {})
+                for field, amount in (("count", images), ("bytes", size), (f"endpoints.{endpoint}", images)):
+                    increments[field] = increments.get(field, 0) + amount
+
+        await self._db.usage_rollups.bulk_write(
+            [
+                UpdateOne({"token": token, "period": period, "start": start}, {"$inc": increments}, upsert=True)
+                for (token, period, start), increments in rollups.items()
+            ],
+            ordered=False
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "buffered": self._pending,
+            "buckets": len(self._counts),
+            "bucket": self.bucket,
+            "raw_events": self.raw_events,
+            "pending_last_used": len(self._last_used),
+            "max_buffered": self.max_buffered,
+            "recorded_total": self.recorded_total,
+            "flushed_total": self.flushed_total,
+            "dropped_total": self.dropped_total,
+            "rollup_dropped_total": self.rollup_dropped_total,
+            "flushes_total": self.flushes_total,
+            "flush_errors_total": self.flush_errors_total
+        }
+
+
+usage_buffer = UsageBuffer(
+    flush_size=USAGE_FLUSH_SIZE,
+    flush_interval=USAGE_FLUSH_INTERVAL,
+    max_buffered=USAGE_BUFFER_MAX,
+    bucket=USAGE_BUCKET,
+    raw_events=USAGE_RAW_EVENTS
+)
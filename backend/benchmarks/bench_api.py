@@ -0,0 +1,372 @@
+"""
+Load test of the HTTP API: requests per second, p50/p95/p99 latency and
+memory for /moderate and the token endpoints, at several concurrency levels.
+
+The app runs either in-process (httpx over ASGI, no sockets) or in a local
+uvicorn subprocess, against an in-memory MongoDB stand-in (mongomock-motor)
+seeded with an admin token, a user token and `--tokens` extra tokens. Uploads
+come from a seeded synthetic corpus of JPEG, PNG and animated GIF images of
+mixed sizes. Each upload gets a unique suffix after the image data so every
+request misses the result cache, unless `--cache` is given.
+
+The default "fake" backend keeps the model out of the measurement, so the
+numbers describe the HTTP, auth, upload and database path; pass
+`--backend local` (with the usual MODEL_* settings) for end-to-end numbers.
+Memory is the server process's RSS after each level and its peak so far; in
+in-process mode that process also runs the load generator.
+
+Save a baseline once, then compare later runs on the same machine against it;
+a run whose req/s drops, or whose p95/p99 or peak memory grows, by more than
+`--tolerance` exits with status 1.
+
+Usage (from the backend directory):
+    python benchmarks/bench_api.py --mode inprocess uvicorn --concurrency 1 8 32 --requests 400
+    python benchmarks/bench_api.py --save-baseline bench_api_baseline.json
+    python benchmarks/bench_api.py --baseline bench_api_baseline.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+ADMIN_TOKEN = "bench-admin-token"
+USER_TOKEN = "bench-user-token"
+
+SCENARIOS = ["moderate", "auth_list", "auth_create"]
+
+# (width, height) of the synthetic uploads, from thumbnails to photos
+CORPUS_SIZES = [(64, 64), (320, 240), (800, 600), (1600, 1200)]
+CORPUS_FORMATS = [("JPEG", "image/jpeg", "jpg"), ("PNG", "image/png", "png"), ("GIF", "image/gif", "gif")]
+
+# Metrics compared against the baseline: (name, True if higher is better)
+COMPARED = [("rps", True), ("p95_ms", False), ("p99_ms", False), ("peak_rss_mb", False)]
+
+
+def configure_environment(args) -> None:
+    """Settings the app reads at import time; call before importing it."""
+    os.environ["MODERATION_BACKEND"] = args.backend
+    # Limits sized for real clients would turn the benchmark into 429s
+    os.environ["RATE_LIMIT_REQUESTS"] = str(10 ** 9)
+    os.environ["RATE_LIMIT_TOKEN_REQUESTS"] = "0"
+
+
+def use_mock_mongodb() -> None:
+    """Point db.mongodb at mongomock-motor instead of a real server."""
+    import mongomock_motor
+    from mongomock import collection
+    from db import mongodb
+
+    mongodb.AsyncIOMotorClient = lambda uri, **options: mongomock_motor.AsyncMongoMockClient(uri)
+
+    # mongomock's bulk builder predates the `sort` argument pymongo passes
+    # for UpdateOne/ReplaceOne, which the usage buffer's flush uses
+    for name in ("add_update", "add_replace"):
+        original = getattr(collection.BulkOperationBuilder, name)
+
+        def without_sort(self, *args, _original=original, **kwargs):
+            kwargs.pop("sort", None)
+            return _original(self, *args, **kwargs)
+
+        setattr(collection.BulkOperationBuilder, name, without_sort)
+
+
+async def seed_tokens(db, extra: int) -> None:
+    now = datetime.utcnow()
+    await db.tokens.insert_many(
+        [
+            {"token": ADMIN_TOKEN, "is_admin": True, "created_at": now},
+            {"token": USER_TOKEN, "is_admin": False, "created_at": now}
+        ]
+        + [{"token": f"bench-extra-{index}", "is_admin": False, "created_at": now} for index in range(extra)]
+    )
+
+
+def build_corpus(seed: int, max_file_size: int) -> List[Tuple[str, bytes, str]]:
+    """(filename, bytes, content type) per size and format, deterministic for a seed."""
+    rng = np.random.default_rng(seed)
+    corpus = []
+    for width, height in CORPUS_SIZES:
+        # Smooth colour fields plus noise: compresses like a photo, not like a flat fill
+        coarse = rng.integers(0, 256, size=(height // 16 + 1, width // 16 + 1, 3), dtype=np.uint8)
+        base = np.asarray(Image.fromarray(coarse).resize((width, height), Image.BILINEAR), dtype=np.int16)
+        pixels = np.clip(base + rng.integers(-12, 13, size=base.shape), 0, 255).astype(np.uint8)
+        image = Image.fromarray(pixels)
+        for image_format, content_type, extension in CORPUS_FORMATS:
+            buffer = io.BytesIO()
+            if image_format == "GIF":
+                frames = [image.rotate(angle).convert("P") for angle in (0, 90, 180)]
+                frames[0].save(buffer, "GIF", save_all=True, append_images=frames[1:], duration=100, loop=0)
+            elif image_format == "JPEG":
+                image.save(buffer, image_format, quality=90)
+            else:
+                image.save(buffer, image_format)
+            data = buffer.getvalue()
+            if len(data) + 8 <= max_file_size:
+                corpus.append((f"{width}x{height}.{extension}", data, content_type))
+    return corpus
+
+
+class Workload:
+    """Builds the request for one scenario; `index` makes uploads unique."""
+
+    def __init__(self, corpus: List[Tuple[str, bytes, str]], unique: bool):
+        self.corpus = corpus
+        self.unique = unique
+
+    async def send(self, client: httpx.AsyncClient, scenario: str, index: int) -> int:
+        if scenario == "moderate":
+            filename, data, content_type = self.corpus[index % len(self.corpus)]
+            if self.unique:
+                # Decoders ignore bytes after the image's end marker
+                data = data + index.to_bytes(8, "big")
+            response = await client.post(
+                "/moderate",
+                files={"file": (filename, data, content_type)},
+                headers={"Authorization": f"Bearer {USER_TOKEN}"}
+            )
+        elif scenario == "auth_list":
+            response = await client.get("/auth/tokens", headers={"Authorization": f"Bearer {ADMIN_TOKEN}"})
+        elif scenario == "auth_create":
+            response = await client.post(
+                "/auth/tokens", json={"is_admin": False}, headers={"Authorization": f"Bearer {ADMIN_TOKEN}"}
+            )
+        else:
+            raise ValueError(f"Unknown scenario: {scenario}")
+        return response.status_code
+
+
+def memory_mb(pid: int) -> Tuple[Optional[float], Optional[float]]:
+    """Current and peak resident set size of a process, from /proc (Linux only)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status if ":" in line)
+    except OSError:
+        return None, None
+    return int(fields["VmRSS"].split()[0]) / 1024, int(fields["VmHWM"].split()[0]) / 1024
+
+
+async def run_level(client, workload: Workload, scenario: str, concurrency: int, requests: int, offset: int) -> dict:
+    """Closed loop: `concurrency` clients each send their next request as soon as one returns."""
+    latencies = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index, errors
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            started = time.perf_counter()
+            try:
+                status = await workload.send(client, scenario, offset + index)
+            except httpx.HTTPError:
+                status = 0
+            latencies.append(time.perf_counter() - started)
+            if not 200 <= status < 300:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    timings = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": requests / elapsed,
+        "p50_ms": float(np.percentile(timings, 50)),
+        "p95_ms": float(np.percentile(timings, 95)),
+        "p99_ms": float(np.percentile(timings, 99))
+    }
+
+
+@asynccontextmanager
+async def in_process_app(args):
+    """The app's lifespan run in this process, reached through httpx's ASGI transport."""
+    use_mock_mongodb()
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        await seed_tokens(main.app.mongodb, args.tokens)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client, os.getpid()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def uvicorn_app(args):
+    """This script started again with --serve, as a single uvicorn worker on a free port."""
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--backend", args.backend, "--tokens", str(args.tokens)]
+    server = subprocess.Popen(command)
+    limits = httpx.Limits(max_connections=max(args.concurrency), max_keepalive_connections=max(args.concurrency))
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+            deadline = time.monotonic() + args.startup_timeout
+            while True:
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+                try:
+                    if (await client.get("/health/ready")).status_code == 200:
+                        break
+                except httpx.HTTPError:
+                    pass
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"uvicorn not ready after {args.startup_timeout}s")
+                await asyncio.sleep(0.2)
+            yield client, server.pid
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def serve(args) -> None:
+    import uvicorn
+
+    use_mock_mongodb()
+    import main
+
+    lifespan = main.app.router.lifespan_context
+
+    @asynccontextmanager
+    async def seeded_lifespan(app):
+        async with lifespan(app):
+            await seed_tokens(app.mongodb, args.tokens)
+            yield
+
+    main.app.router.lifespan_context = seeded_lifespan
+    uvicorn.run(main.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+APP_MODES = {"inprocess": in_process_app, "uvicorn": uvicorn_app}
+
+
+async def run_mode(mode: str, args, workload: Workload) -> Dict[str, dict]:
+    results = {}
+    async with APP_MODES[mode](args) as (client, pid):
+        offset = 0
+        for scenario in args.scenarios:
+            for index in range(args.warmup):
+                await workload.send(client, scenario, offset + index)
+            offset += args.warmup
+            for concurrency in args.concurrency:
+                result = await run_level(client, workload, scenario, concurrency, args.requests, offset)
+                offset += args.requests
+                result["rss_mb"], result["peak_rss_mb"] = memory_mb(pid)
+                results[f"{mode}/{scenario}/{concurrency}"] = result
+                print_row(mode, scenario, concurrency, result)
+    return results
+
+
+def print_row(mode: str, scenario: str, concurrency: int, result: dict) -> None:
+    memory = "".join(
+        f"{value:>10.1f}" if value is not None else f"{'-':>10}"
+        for value in (result["rss_mb"], result["peak_rss_mb"])
+    )
+    print(
+        f"{mode:<11}{scenario:<13}{concurrency:>6}{result['rps']:>10.1f}{result['p50_ms']:>9.1f}"
+        f"{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['errors']:>8}{memory}",
+        flush=True
+    )
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """Regressions beyond `tolerance` (a fraction) against the baseline's results."""
+    regressions = []
+    for key, result in results.items():
+        if result["errors"]:
+            regressions.append(f"{key}: {result['errors']} failed requests")
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        for metric, higher_is_better in COMPARED:
+            value, expected = result.get(metric), reference.get(metric)
+            if value is None or not expected:
+                continue
+            change = value / expected - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{key}: {metric} {expected:.1f} -> {value:.1f} ({change:+.0%})")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", nargs="+", choices=sorted(APP_MODES), default=["inprocess", "uvicorn"])
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario and concurrency level")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests before each scenario")
+    parser.add_argument("--backend", default="fake", help="MODERATION_BACKEND for the app")
+    parser.add_argument("--cache", action="store_true", help="repeat identical uploads, so the result cache answers")
+    parser.add_argument("--tokens", type=int, default=100, help="extra tokens seeded for GET /auth/tokens")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--save-baseline", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="compare against this JSON file; regressions exit 1")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative change (0.25 = 25%%)")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    configure_environment(args)
+    if args.serve:
+        serve(args)
+        return
+
+    from api.moderate import MAX_FILE_SIZE
+
+    corpus = build_corpus(args.seed, MAX_FILE_SIZE)
+    sizes = sorted(len(data) for _, data, _ in corpus)
+    print(f"corpus: {len(corpus)} images, {sizes[0] / 1024:.0f} KB to {sizes[-1] / 1024:.0f} KB")
+    workload = Workload(corpus, unique=not args.cache)
+
+    print(
+        f"{'mode':<11}{'scenario':<13}{'conc':>6}{'req/s':>10}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        f"{'errors':>8}{'rss MB':>10}{'peak MB':>10}"
+    )
+    results = {}
+    for mode in args.mode:
+        results.update(asyncio.run(run_mode(mode, args, workload)))
+
+    config = {key: getattr(args, key) for key in ("backend", "cache", "requests", "tokens", "seed")}
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2, sort_keys=True)
+        print(f"\nbaseline written to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print(f"\nwarning: baseline config {baseline.get('config')} differs from this run's {config}")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print(f"\nno regressions beyond {args.tolerance:.0%} against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Decode + resize cost of the reduced-cost path (draft/reduce) against the
+previous full decode followed by a single resize.
+
+Each path runs in a fresh process so peak RSS reflects only that path.
+
+Usage (from the backend directory):
+    python benchmarks/bench_decode.py --repeat 20
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.preprocessing import MODEL_INPUT_SIZE, load_frames  # noqa: E402
+
+
+def make_corpus(seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+
+    def photo(width: int, height: int) -> Image.Image:
+        # Smooth gradients plus noise compress and decode like a real photo
+        y, x = np.mgrid[0:height, 0:width]
+        base = np.stack([x * 255 // width, y * 255 // height, (x + y) * 255 // (width + height)], axis=-1)
+        noise = rng.integers(0, 32, size=(height, width, 3))
+        return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+    corpus = {}
+    for name, (width, height), fmt in [
+        ("jpeg_12mp", (4000, 3000), "JPEG"),
+        ("jpeg_2mp", (1600, 1200), "JPEG"),
+        ("png_6mp", (3000, 2000), "PNG")
+    ]:
+        buffer = io.BytesIO()
+        photo(width, height).save(buffer, format=fmt, quality=90)
+        corpus[name] = buffer.getvalue()
+
+    frames = [photo(640, 480) for _ in range(4)] * 5
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format="GIF", save_all=True, append_images=frames[1:], duration=50)
+    corpus["gif_20_frames"] = buffer.getvalue()
+    return corpus
+
+
+def baseline(contents: bytes) -> None:
+    # The previous path: decode every pixel, then resize once
+    Image.open(io.BytesIO(contents)).convert("RGB").resize(MODEL_INPUT_SIZE)
+
+
+def reduced(contents: bytes) -> None:
+    load_frames(contents, MODEL_INPUT_SIZE)
+
+
+def peak_rss_kb() -> int:
+    # ru_maxrss survives exec, so a spawned child would report the parent's
+    # peak; VmHWM is reset for each new process image
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def measure(path: str, contents: bytes, repeat: int, queue) -> None:
+    fn = {"baseline": baseline, "reduced": reduced}[path]
+    rss_before = peak_rss_kb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(contents)
+        timings.append(time.perf_counter() - started)
+    rss_after = peak_rss_kb()
+    queue.put((float(np.median(timings)), (rss_after - rss_before) / 1024))
+
+
+def run(path: str, contents: bytes, repeat: int) -> tuple:
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(path, contents, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.seed)
+    print(f"{'image':<16}{'path':<10}{'median ms':>12}{'peak +MB':>12}")
+    for name, contents in corpus.items():
+        results = {}
+        for path in ("baseline", "reduced"):
+            results[path] = run(path, contents, args.repeat)
+            seconds, peak_mb = results[path]
+            print(f"{name:<16}{path:<10}{seconds * 1000:>12.2f}{peak_mb:>12.1f}")
+        speedup = results["baseline"][0] / results["reduced"][0]
+        print(f"{'':<16}{'speedup':<10}{speedup:>11.1f}x")
+
+
+if __name__ == "__main__":
+    main()
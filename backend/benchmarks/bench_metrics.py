@@ -0,0 +1,112 @@
+"""
+Cost of the /metrics instrumentation: per-operation cost of counters,
+histograms and stage timers, and the per-request overhead MetricsMiddleware
+adds to a trivial in-process ASGI app (the worst case, since real requests
+do far more work).
+
+Usage (from the backend directory):
+    python benchmarks/bench_metrics.py --operations 200000 --requests 5000 --rounds 3
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from core.metrics import Counter, Histogram, MetricsMiddleware, MetricsRegistry  # noqa: E402
+
+
+def per_operation_ns(fn, operations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(operations):
+        fn()
+    return (time.perf_counter() - started) / operations * 1e9
+
+
+def build_app(instrumented: bool) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        return {"id": item_id}
+
+    if instrumented:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def per_request_us(app: FastAPI, requests: int) -> float:
+    """Drive the ASGI app directly, so no HTTP client cost hides the difference."""
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    def scope(index: int) -> dict:
+        return {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": f"/items/{index}", "raw_path": f"/items/{index}".encode(),
+            "root_path": "", "query_string": b"", "headers": [], "client": ("bench", 1), "server": ("bench", 80)
+        }
+
+    for index in range(200):  # warm up
+        await app(scope(index), receive, send)
+    started = time.perf_counter()
+    for index in range(requests):
+        await app(scope(index), receive, send)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--operations", type=int, default=200000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    registry = MetricsRegistry()
+    counter = Counter("bench_total", "bench", ["route"], registry=registry)
+    histogram = Histogram("bench_seconds", "bench", ["stage"], registry=registry)
+    counter_child = counter.labels("/items/{item_id}")
+    histogram_child = histogram.labels("decode")
+
+    def timed():
+        with histogram_child.time():
+            pass
+
+    print(f"{'operation':<32}{'ns/op':>10}")
+    for name, fn in [
+        ("counter.inc (bound child)", counter_child.inc),
+        ("counter.labels(...).inc", lambda: counter.labels("/items/{item_id}").inc()),
+        ("histogram.observe (bound)", lambda: histogram_child.observe(0.0042)),
+        ("stage timer (with ...time())", timed)
+    ]:
+        print(f"{name:<32}{per_operation_ns(fn, args.operations):>10.0f}")
+
+    for _ in range(1000):
+        histogram_child.observe(0.01)
+    started = time.perf_counter()
+    registry.render()
+    print(f"{'render (2 metrics)':<32}{(time.perf_counter() - started) * 1e9:>10.0f}")
+
+    # Interleaved rounds, best of each, to keep machine noise out of the difference
+    apps = {False: build_app(False), True: build_app(True)}
+    best = {False: float("inf"), True: float("inf")}
+    for _ in range(args.rounds):
+        for instrumented, app in apps.items():
+            best[instrumented] = min(best[instrumented], asyncio.run(per_request_us(app, args.requests)))
+    plain, instrumented = best[False], best[True]
+    print()
+    print(f"{'app':<32}{'us/request':>12}")
+    print(f"{'without middleware':<32}{plain:>12.1f}")
+    print(f"{'with MetricsMiddleware':<32}{instrumented:>12.1f}")
+    print(f"{'overhead':<32}{instrumented - plain:>12.1f}  ({(instrumented / plain - 1) * 100:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
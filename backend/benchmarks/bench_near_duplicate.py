@@ -0,0 +1,82 @@
+"""
+Lookup latency of the near-duplicate Hamming index at large sizes.
+
+Usage (from the backend directory):
+    python benchmarks/bench_near_duplicate.py --sizes 1000000 10000000
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.near_duplicate import HammingIndex  # noqa: E402
+
+
+def flip_bits(rng: np.random.Generator, value: int, count: int) -> int:
+    for bit in rng.choice(64, size=count, replace=False):
+        value ^= 1 << int(bit)
+    return value
+
+
+def run(size: int, queries: int, max_distance: int, seed: int) -> dict:
+    rng = np.random.default_rng(seed)
+    hashes = rng.integers(0, np.iinfo(np.uint64).max, size=size, dtype=np.uint64, endpoint=True)
+
+    index = HammingIndex(max_distance=max_distance)
+    started = time.perf_counter()
+    index.add_many(hashes)
+    build_seconds = time.perf_counter() - started
+
+    # Half the queries are perturbed copies of indexed hashes, half are random misses
+    probes = []
+    for i in range(queries):
+        if i % 2 == 0:
+            base = int(hashes[rng.integers(0, size)])
+            probes.append(flip_bits(rng, base, int(rng.integers(0, max_distance + 1))))
+        else:
+            probes.append(int(rng.integers(0, np.iinfo(np.uint64).max, dtype=np.uint64, endpoint=True)))
+
+    latencies = []
+    found = 0
+    for probe in probes:
+        started = time.perf_counter()
+        match = index.search(probe)
+        latencies.append(time.perf_counter() - started)
+        found += match is not None
+
+    latencies_us = np.array(latencies) * 1e6
+    return {
+        "size": size,
+        "build_s": build_seconds,
+        "p50_us": float(np.percentile(latencies_us, 50)),
+        "p99_us": float(np.percentile(latencies_us, 99)),
+        "mean_us": float(latencies_us.mean()),
+        "hit_rate": found / queries,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'entries':>12} {'build s':>9} {'p50 us':>9} {'p99 us':>9} {'mean us':>9} {'hits':>6} {'rss MB':>9}")
+    for size in args.sizes:
+        r = run(size, args.queries, args.max_distance, args.seed)
+        print(
+            f"{r['size']:>12,} {r['build_s']:>9.2f} {r['p50_us']:>9.1f} {r['p99_us']:>9.1f} "
+            f"{r['mean_us']:>9.1f} {r['hit_rate']:>6.2f} {r['max_rss_mb']:>9.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
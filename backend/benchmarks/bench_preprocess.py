@@ -0,0 +1,70 @@
+"""
+Time and allocations per image for turning decoded 224x224 images into a
+model batch: the previous per-image float32 path against the reusable
+uint8 -> float32 batch arena.
+
+Usage (from the backend directory):
+    python benchmarks/bench_preprocess.py --batch-sizes 1 8 32 --repeat 200
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.preprocessing import MODEL_INPUT_SIZE, BatchArena, to_pixels  # noqa: E402
+
+
+def previous_path(images, _arena) -> np.ndarray:
+    # img_to_array -> preprocess_input -> stack, one float32 copy per step
+    arrays = [np.asarray(image, dtype=np.float32) for image in images]
+    arrays = [array / 127.5 - 1.0 for array in arrays]
+    return np.stack(arrays)
+
+
+def arena_path(images, arena: BatchArena) -> np.ndarray:
+    return arena.pack([to_pixels([image]) for image in images])
+
+
+def measure(fn, images, arena, repeat: int) -> tuple:
+    fn(images, arena)  # warm up, and let the arena reach its working size
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(images, arena)
+    seconds = (time.perf_counter() - started) / repeat
+
+    tracemalloc.start()
+    fn(images, arena)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds / len(images), peak / len(images)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    width, height = MODEL_INPUT_SIZE
+    print(f"{'batch':>6}{'path':>10}{'us/image':>12}{'peak KB/image':>16}")
+    for batch_size in args.batch_sizes:
+        images = [
+            Image.fromarray(rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8))
+            for _ in range(batch_size)
+        ]
+        arena = BatchArena(batch_size)
+        for name, fn in (("previous", previous_path), ("arena", arena_path)):
+            seconds, peak = measure(fn, images, arena, args.repeat)
+            print(f"{batch_size:>6}{name:>10}{seconds * 1e6:>12.1f}{peak / 1024:>16.1f}")
+
+
+if __name__ == "__main__":
+    main()
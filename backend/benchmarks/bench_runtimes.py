@@ -0,0 +1,97 @@
+"""
+Latency and throughput of each inference runtime per batch size: Keras,
+TFLite and ONNX Runtime, each in float32 and post-training INT8.
+
+The Keras model comes from MODEL_PATH, or MobileNetV2 with MODEL_WEIGHTS;
+it is converted into a temporary directory for the other runtimes. Variants
+whose packages (tf2onnx, onnxruntime) are missing are skipped.
+
+Usage (from the backend directory):
+    python benchmarks/bench_runtimes.py --batch-sizes 1 8 32 --threads 4
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.runtimes import EXPORTERS, load_runner, top_k_agreement  # noqa: E402
+
+VARIANTS = [
+    ("keras", None),
+    ("tflite", None),
+    ("tflite", "int8"),
+    ("onnx", None),
+    ("onnx", "int8")
+]
+
+
+def load_keras_model(weights: str):
+    import tensorflow as tf
+    if os.getenv("MODEL_PATH"):
+        return tf.keras.models.load_model(os.environ["MODEL_PATH"], compile=False)
+    return tf.keras.applications.MobileNetV2(weights=None if weights == "none" else weights)
+
+
+def measure(run, batch: np.ndarray, repeat: int) -> dict:
+    run(batch)  # warm up (and let TFLite size its tensors)
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run(batch)
+        timings.append(time.perf_counter() - started)
+    timings = np.array(timings)
+    return {
+        "p50_ms": float(np.percentile(timings, 50) * 1000),
+        "p95_ms": float(np.percentile(timings, 95) * 1000),
+        "images_per_second": len(batch) / float(timings.mean())
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--threads", type=int, default=0, help="intra-op threads (0: runtime default)")
+    parser.add_argument("--weights", default=os.getenv("MODEL_WEIGHTS", "imagenet"),
+                        help='MobileNetV2 weights when MODEL_PATH is unset ("none" for random)')
+    parser.add_argument("--calibration-dir", default=None, help="Representative images for INT8 calibration")
+    args = parser.parse_args()
+
+    model = load_keras_model(args.weights)
+    rng = np.random.default_rng(0)
+    batches = {
+        size: (rng.integers(0, 256, size=(size, 224, 224, 3)).astype(np.float32) / 127.5 - 1.0)
+        for size in args.batch_sizes
+    }
+    reference = {size: np.asarray(model(batch, training=False)) for size, batch in batches.items()}
+
+    print(f"{'runtime':<14}{'batch':>6}{'p50 ms':>10}{'p95 ms':>10}{'img/s':>10}{'top1 agree':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for runtime, quantize in VARIANTS:
+            name = runtime + ("-int8" if quantize else "")
+            if runtime == "keras":
+                run = lambda batch: np.asarray(model(batch, training=False))  # noqa: E731
+            else:
+                path = os.path.join(workdir, f"{name}.{runtime}")
+                try:
+                    EXPORTERS[runtime](model, path, quantize=quantize, calibration_dir=args.calibration_dir)
+                    run = load_runner(runtime, path, intra_op_threads=args.threads or None)
+                except ImportError as e:
+                    print(f"{name:<14}skipped ({e})")
+                    continue
+            for size, batch in batches.items():
+                result = measure(run, batch, args.repeat)
+                agreement = top_k_agreement(reference[size], run(batch), k=1)
+                print(
+                    f"{name:<14}{size:>6}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+                    f"{result['images_per_second']:>10.1f}{agreement:>12.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Per-worker memory and aggregate throughput of the pre-fork server
+(app/server.py) against worker count, with the model loaded once in the
+master before forking and, for comparison, by every worker after it.
+
+The server runs against the same in-memory MongoDB stand-in and synthetic
+upload corpus as bench_api.py, and POST /moderate is driven by `--per-worker`
+concurrent clients per worker. Memory comes from /proc after the load: RSS
+per worker, the private (unshared) part of it, and the proportional set size
+(PSS) of the master and all workers together, which counts shared pages once
+and so is what the pod actually uses.
+
+Preloading only applies to runtimes that survive fork() (TFLite); with the
+Keras runtime both modes load the model in each worker.
+
+Usage (from the backend directory):
+    MODEL_RUNTIME=tflite MODEL_PATH=/models/mobilenet_v2.tflite \\
+        python benchmarks/bench_server.py --workers 1 2 4 --requests 400
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import subprocess
+import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+import bench_api  # noqa: E402
+from bench_api import Workload, build_corpus, free_port, run_level, seed_tokens  # noqa: E402
+
+
+def children_of(pid: int) -> List[int]:
+    children = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as stat:
+                # The parent pid is the second field after the parenthesised command name
+                if int(stat.read().rsplit(")", 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def memory_mb(pid: int) -> Dict[str, float]:
+    """RSS, PSS and private memory of a process, from /proc/<pid>/smaps_rollup."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0)
+    }
+
+
+def serve(args) -> None:
+    """The --serve child: the pre-fork server over the mock database."""
+    bench_api.configure_environment(args)
+    import server
+
+    server.configure_threads(args.count)
+    bench_api.use_mock_mongodb()
+    import main
+
+    # Each worker has its own in-memory database, so each seeds its tokens
+    lifespan = main.app.router.lifespan_context
+
+    @asynccontextmanager
+    async def seeded_lifespan(app):
+        async with lifespan(app):
+            await seed_tokens(app.mongodb, 0)
+            yield
+
+    main.app.router.lifespan_context = seeded_lifespan
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(process)d] %(message)s")
+    if not args.no_preload:
+        server.preload_model()
+    gc.collect()
+    gc.freeze()
+    master = server.Master(main.app, server.bind_socket("127.0.0.1", args.port), workers=args.count,
+                           log_level="warning")
+    master.run()
+
+
+async def wait_until_ready(base_url: str, workers: int, timeout: float, master: subprocess.Popen) -> None:
+    """Until a run of fresh connections, which land on any worker, all find the app ready."""
+    deadline = time.monotonic() + timeout
+    streak = 0
+    async with httpx.AsyncClient(base_url=base_url, limits=httpx.Limits(max_keepalive_connections=0)) as client:
+        while streak < 5 * workers:
+            if master.poll() is not None:
+                raise RuntimeError(f"server exited with status {master.returncode}")
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"server not ready after {timeout}s")
+            try:
+                ready = (await client.get("/health/ready")).status_code == 200
+            except httpx.HTTPError:
+                ready = False
+            streak = streak + 1 if ready else 0
+            if not ready:
+                await asyncio.sleep(0.2)
+
+
+async def measure(args, workers: int, preload: bool, workload: Workload) -> dict:
+    port = free_port()
+    command = [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(port),
+               "--count", str(workers), "--backend", args.backend]
+    if not preload:
+        command.append("--no-preload")
+    master = subprocess.Popen(command)
+    base_url = f"http://127.0.0.1:{port}"
+    concurrency = args.per_worker * workers
+    try:
+        await wait_until_ready(base_url, workers, args.startup_timeout, master)
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+            await run_level(client, workload, "moderate", concurrency, args.warmup, 0)
+            result = await run_level(client, workload, "moderate", concurrency, args.requests, args.warmup)
+        worker_memory = [memory_mb(pid) for pid in children_of(master.pid)]
+        master_memory = memory_mb(master.pid)
+    finally:
+        master.terminate()
+        master.wait(timeout=60)
+    result.update({
+        "workers": len(worker_memory),
+        "worker_rss_mb": sum(memory["rss"] for memory in worker_memory) / len(worker_memory),
+        "worker_private_mb": sum(memory["private"] for memory in worker_memory) / len(worker_memory),
+        "total_pss_mb": master_memory["pss"] + sum(memory["pss"] for memory in worker_memory)
+    })
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--preload", choices=["both", "on", "off"], default="both")
+    parser.add_argument("--per-worker", type=int, default=4, help="concurrent clients per worker")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--warmup", type=int, default=40)
+    parser.add_argument("--backend", default="local", help="MODERATION_BACKEND for the app")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--count", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--no-preload", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    bench_api.configure_environment(args)
+    from api.moderate import MAX_FILE_SIZE
+
+    workload = Workload(build_corpus(args.seed, MAX_FILE_SIZE), unique=True)
+    modes = {"both": [True, False], "on": [True], "off": [False]}[args.preload]
+    print(f"{'workers':>8}{'preload':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}"
+          f"{'rss/worker':>12}{'private/worker':>16}{'total pss':>11}{'req/s vs 1':>12}")
+    single = {}
+    for preload in modes:
+        for workers in args.workers:
+            result = asyncio.run(measure(args, workers, preload, workload))
+            single.setdefault(preload, result["rps"])
+            print(
+                f"{workers:>8}{'yes' if preload else 'no':>9}{result['rps']:>9.1f}{result['p50_ms']:>9.1f}"
+                f"{result['p95_ms']:>9.1f}{result['errors']:>8}{result['worker_rss_mb']:>12.1f}"
+                f"{result['worker_private_mb']:>16.1f}{result['total_pss_mb']:>11.1f}"
+                f"{result['rps'] / single[preload]:>11.2f}x",
+                flush=True
+            )
+
+
+if __name__ == "__main__":
+    main()
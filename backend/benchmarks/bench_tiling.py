@@ -0,0 +1,84 @@
+"""
+Latency cost of tiled analysis per tile budget: decoding and cutting a large
+photo into its thumbnail plus tiles, and the forward pass over all of them
+as one batch (the worst case, with no early stop).
+
+The model comes from MODEL_PATH, or MobileNetV2 with MODEL_WEIGHTS.
+
+Usage (from the backend directory):
+    python benchmarks/bench_tiling.py --budgets 1 3 5 10 17 --size 4000 3000 --repeat 10
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+from services.preprocessing import pack_batch, to_pixels  # noqa: E402
+from services.tiling import load_tiles  # noqa: E402
+
+
+def load_keras_model(weights: str):
+    import tensorflow as tf
+    if os.getenv("MODEL_PATH"):
+        return tf.keras.models.load_model(os.environ["MODEL_PATH"], compile=False)
+    return tf.keras.applications.MobileNetV2(weights=None if weights == "none" else weights)
+
+
+def synthetic_photo(width: int, height: int, image_format: str) -> bytes:
+    rng = np.random.default_rng(0)
+    coarse = rng.integers(0, 256, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **({"quality": 90} if image_format == "JPEG" else {}))
+    return buffer.getvalue()
+
+
+def percentiles(timings: list) -> tuple:
+    timings = np.array(timings) * 1000
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 95))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budgets", type=int, nargs="+", default=[1, 3, 5, 10, 17])
+    parser.add_argument("--size", type=int, nargs=2, default=[4000, 3000], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--format", default="JPEG", choices=["JPEG", "PNG"])
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--weights", default=os.getenv("MODEL_WEIGHTS", "imagenet"),
+                        help='MobileNetV2 weights when MODEL_PATH is unset ("none" for random)')
+    args = parser.parse_args()
+
+    contents = synthetic_photo(*args.size, args.format)
+    model = load_keras_model(args.weights)
+
+    print(f"{args.size[0]}x{args.size[1]} {args.format}, {len(contents) / 1024:.0f} KB")
+    print(f"{'budget':>7}{'inputs':>8}{'decode p50':>12}{'decode p95':>12}{'model p50':>11}{'model p95':>11}"
+          f"{'total p50':>11}{'vs 1':>7}")
+    baseline = None
+    for budget in args.budgets:
+        pixels = to_pixels(load_tiles(contents, budget))
+        model(pack_batch([pixels]), training=False)  # warm up this batch size
+        decode_timings, model_timings = [], []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            pixels = to_pixels(load_tiles(contents, budget))
+            decoded = time.perf_counter()
+            np.asarray(model(pack_batch([pixels]), training=False))
+            decode_timings.append(decoded - started)
+            model_timings.append(time.perf_counter() - decoded)
+        decode_p50, decode_p95 = percentiles(decode_timings)
+        model_p50, model_p95 = percentiles(model_timings)
+        total = decode_p50 + model_p50
+        baseline = baseline or total
+        print(f"{budget:>7}{len(pixels):>8}{decode_p50:>12.1f}{decode_p95:>12.1f}{model_p50:>11.1f}{model_p95:>11.1f}"
+              f"{total:>11.1f}{total / baseline:>6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,5 +9,24 @@ echo "MongoDB is ready!"
 echo "Initializing database..."
 python init_db.py
 
+# Pre-forked workers share one copy of the model only with the TFLite
+# runtime (see server.py); with Keras each worker loads its own. So when
+# several workers are asked for and no runtime is chosen, convert the Keras
+# model to TFLite once and serve that.
+if [ "${SERVER_WORKERS:-1}" -gt 1 ] && [ -z "$MODEL_RUNTIME" ]; then
+  SHARED_MODEL_PATH="${SHARED_MODEL_PATH:-/app/models/mobilenet_v2.tflite}"
+  if [ ! -f "$SHARED_MODEL_PATH" ]; then
+    echo "Exporting the model to TFLite so workers can share it..."
+    mkdir -p "$(dirname "$SHARED_MODEL_PATH")"
+    python -m services.model_registry --export "$SHARED_MODEL_PATH" --runtime tflite
+  fi
+  if [ -f "$SHARED_MODEL_PATH" ]; then
+    export MODEL_RUNTIME=tflite
+    export MODEL_PATH="$SHARED_MODEL_PATH"
+  else
+    echo "TFLite export failed; every worker will load its own Keras model"
+  fi
+fi
+
 echo "Starting application..."
-uvicorn main:app --host 0.0.0.0 --port 7000 
\ No newline at end of file
+exec python server.py --host 0.0.0.0 --port 7000 
\ No newline at end of file
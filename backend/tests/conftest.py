@@ -1,12 +1,20 @@
 import pytest
 import os
+import secrets
 import shutil
+import sys
 import time
 import httpx
+from datetime import datetime
+from fastapi.testclient import TestClient
 
-@pytest.fixture(scope="session", autouse=True)
-def setup_test_environment():
-    """Set up the test environment"""
+# Service modules import each other relative to app/, as they do when the
+# server runs from that directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "app"))
+
+@pytest.fixture(scope="session")
+def live_api():
+    """Wait for the API container on localhost:7000 (tests/test_docker.py)"""
     # Wait for services to be ready
     retries = 30
     api_url = "http://localhost:7000"
@@ -27,4 +35,43 @@ def setup_test_environment():
     
     # Cleanup after tests
     if os.path.exists("tests/test_files"):
-        shutil.rmtree("tests/test_files") 
\ No newline at end of file
+        shutil.rmtree("tests/test_files")
+
+@pytest.fixture(scope="session")
+def app_client():
+    """The app with its lifespan running in-process, so app.mongodb is connected."""
+    from app.main import app, rate_limiter
+    # Every request comes from the same client address, and tests that poll
+    # would otherwise run into the per-IP limit
+    rate_limiter.requests_per_minute = 1000000
+    with TestClient(app) as client:
+        yield client
+
+def insert_token(client, is_admin: bool) -> str:
+    """Store a new token directly in the app's database and return it."""
+    token = secrets.token_urlsafe(32)
+
+    async def insert():
+        await client.app.mongodb.tokens.insert_one(
+            {"token": token, "is_admin": is_admin, "created_at": datetime.utcnow()}
+        )
+
+    client.portal.call(insert)
+    return token
+
+@pytest.fixture
+def admin_token(app_client):
+    return insert_token(app_client, is_admin=True)
+
+@pytest.fixture
+def user_token(app_client):
+    return insert_token(app_client, is_admin=False)
+
+@pytest.fixture(scope="session")
+def model_client(app_client):
+    """app_client once the model has loaded and /moderate can answer."""
+    for _ in range(300):
+        if app_client.get("/health/ready").status_code == 200:
+            return app_client
+        time.sleep(1)
+    raise Exception("Model did not become ready")
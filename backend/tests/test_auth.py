@@ -1,15 +1,7 @@
-import pytest
-from fastapi.testclient import TestClient
-from app.main import app
-from app.core.auth import generate_token
-from datetime import datetime
+import json
 
-client = TestClient(app)
-
-def test_create_token():
-    # Create an admin token first
-    admin_token = generate_token()
-    response = client.post(
+def test_create_token(app_client, admin_token):
+    response = app_client.post(
         "/auth/tokens",
         json={"is_admin": True},
         headers={"Authorization": f"Bearer {admin_token}"}
@@ -19,21 +11,70 @@ def test_create_token():
     assert "token" in data
     assert data["is_admin"] is True
 
-def test_list_tokens():
-    # Create an admin token
-    admin_token = generate_token()
-    response = client.get(
+def test_list_tokens(app_client, admin_token):
+    response = app_client.get(
         "/auth/tokens",
         headers={"Authorization": f"Bearer {admin_token}"}
     )
     assert response.status_code == 200
     assert isinstance(response.json(), list)
 
-def test_revoke_token():
-    # Create an admin token
-    admin_token = generate_token()
+def test_list_tokens_pages(app_client, admin_token):
+    response = app_client.post(
+        "/auth/tokens/bulk",
+        json={"count": 3},
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == 3
+    
+    response = app_client.get(
+        "/auth/tokens?limit=2&fields=token,created_at",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    first_page = response.json()
+    assert len(first_page) == 2
+    assert set(first_page[0]) == {"token", "created_at"}
+    cursor = response.headers["X-Next-Cursor"]
+    
+    response = app_client.get(
+        f"/auth/tokens?limit=2&cursor={cursor}",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    assert not {token["token"] for token in first_page} & {token["token"] for token in response.json()}
+
+def test_list_tokens_ndjson(app_client, admin_token):
+    response = app_client.get(
+        "/auth/tokens?format=ndjson&limit=5",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = response.text.splitlines()
+    assert 0 < len(lines) <= 5
+    assert all("token" in json.loads(line) for line in lines)
+
+def test_bulk_revoke_tokens(app_client, admin_token):
+    response = app_client.post(
+        "/auth/tokens/bulk",
+        json={"count": 2},
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    tokens = [token["token"] for token in response.json()]
+    
+    response = app_client.post(
+        "/auth/tokens/revoke",
+        json={"tokens": tokens},
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    assert response.json()["deleted"] == 2
+
+def test_revoke_token(app_client, admin_token):
     # Create a token to revoke
-    response = client.post(
+    response = app_client.post(
         "/auth/tokens",
         json={"is_admin": False},
         headers={"Authorization": f"Bearer {admin_token}"}
@@ -41,25 +82,39 @@ def test_revoke_token():
     token_to_revoke = response.json()["token"]
     
     # Revoke the token
-    response = client.delete(
+    response = app_client.delete(
         f"/auth/tokens/{token_to_revoke}",
         headers={"Authorization": f"Bearer {admin_token}"}
     )
     assert response.status_code == 200
-    assert response.json()["message"] == "Token revoked successfully"
+    assert response.json()["message"] == "Token deleted successfully"
+
+def test_usage_report(app_client, admin_token):
+    response = app_client.get(
+        "/auth/usage?period=day",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["period"] == "day"
+    assert isinstance(data["tokens"], list)
+
+    response = app_client.get(
+        "/auth/usage?period=week",
+        headers={"Authorization": f"Bearer {admin_token}"}
+    )
+    assert response.status_code == 422
 
-def test_invalid_token():
-    response = client.get(
+def test_invalid_token(app_client):
+    response = app_client.get(
         "/auth/tokens",
         headers={"Authorization": "Bearer invalid_token"}
     )
     assert response.status_code == 401
 
-def test_non_admin_access():
-    # Create a non-admin token
-    non_admin_token = generate_token()
-    response = client.get(
+def test_non_admin_access(app_client, user_token):
+    response = app_client.get(
         "/auth/tokens",
-        headers={"Authorization": f"Bearer {non_admin_token}"}
+        headers={"Authorization": f"Bearer {user_token}"}
     )
     assert response.status_code == 403 
\ No newline at end of file
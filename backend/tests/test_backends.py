@@ -0,0 +1,21 @@
+import pytest
+from app.services.backends import FakeBackend, ModerationBackend
+
+
+class Incomplete(ModerationBackend):
+    name = "incomplete"
+
+
+def test_backends_must_implement_analyze_batch():
+    with pytest.raises(TypeError):
+        ModerationBackend()
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+@pytest.mark.asyncio
+async def test_analyze_uses_analyze_batch():
+    backend = FakeBackend(scores={"violence": 0.9})
+    result = await backend.analyze(b"image")
+    assert result["backend"] == "fake" and not result["safe"]
+    assert backend.stats()["images_total"] == 1
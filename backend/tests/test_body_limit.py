@@ -0,0 +1,34 @@
+import pytest
+from app.core.body_limit import BodySizeLimitMiddleware
+
+
+async def ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+def test_limits_cover_sub_paths():
+    middleware = BodySizeLimitMiddleware(ok_app, {"/moderate": 10, "/moderate/batch": 100})
+    assert middleware.limit_for("/moderate") == 10
+    assert middleware.limit_for("/moderate/") == 10
+    assert middleware.limit_for("//moderate") == 10
+    assert middleware.limit_for("/moderate/taxonomy/reload") == 10
+    assert middleware.limit_for("/moderate/batch/") == 100
+    assert middleware.limit_for("/moderated") is None
+    assert middleware.limit_for("/auth/tokens") is None
+
+
+@pytest.mark.asyncio
+async def test_trailing_slash_is_rejected_early():
+    middleware = BodySizeLimitMiddleware(ok_app, {"/moderate": 10})
+    sent = []
+
+    async def receive():
+        raise AssertionError("the body must not be read")
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/moderate/", "headers": [(b"content-length", b"11")]}
+    await middleware(scope, receive, send)
+    assert sent[0]["status"] == 413
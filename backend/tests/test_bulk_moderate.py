@@ -0,0 +1,82 @@
+import io
+import json
+import queue
+import tarfile
+import zipfile
+from PIL import Image
+from app.bulk_moderate import JsonlWriter, iter_source, read_ahead
+
+def png_bytes():
+    buffer = io.BytesIO()
+    Image.new("RGB", (8, 8), "red").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def test_directory_order_is_stable(tmp_path):
+    (tmp_path / "b").mkdir()
+    for name in ("b/2.png", "a.png", "notes.txt", "c.png"):
+        (tmp_path / name).write_bytes(png_bytes())
+    assert [key for key, _ in iter_source(str(tmp_path))] == ["a.png", "c.png", "b/2.png"]
+
+def test_tar_members_are_streamed(tmp_path):
+    path = tmp_path / "images.tar"
+    with tarfile.open(path, "w") as archive:
+        for name in ("x.png", "y.png"):
+            info = tarfile.TarInfo(name)
+            data = png_bytes()
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    items = [(key, load()) for key, load in iter_source(str(path))]
+    assert [key for key, _ in items] == ["x.png", "y.png"]
+    assert items[0][1] == png_bytes()
+
+def test_manifest_paths_are_relative_to_it(tmp_path):
+    (tmp_path / "one.png").write_bytes(png_bytes())
+    manifest = tmp_path / "manifest.jsonl"
+    manifest.write_text(json.dumps({"id": "first", "path": "one.png"}) + "\n\n" + json.dumps({"path": "one.png"}) + "\n")
+    items = list(iter_source(str(manifest)))
+    assert [key for key, _ in items] == ["first", "one.png"]
+    assert items[0][1]() == png_bytes()
+
+def test_oversized_inputs_are_rejected_before_reading(tmp_path, monkeypatch):
+    small, large = png_bytes(), png_bytes() + b"\0" * 1000
+    limit = len(small) + 10
+    with zipfile.ZipFile(tmp_path / "images.zip", "w") as archive:
+        archive.writestr("large.png", large)
+        archive.writestr("small.png", small)
+    real_open = zipfile.ZipFile.open
+
+    def guarded_open(archive, member, *args, **kwargs):
+        assert getattr(member, "filename", member) != "large.png", "the oversized member was read"
+        return real_open(archive, member, *args, **kwargs)
+
+    monkeypatch.setattr(zipfile.ZipFile, "open", guarded_open)
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "large.png").write_bytes(large)
+    (tmp_path / "dir" / "small.png").write_bytes(small)
+
+    for source in (tmp_path / "images.zip", tmp_path / "dir"):
+        out = queue.Queue()
+        read_ahead(iter_source(str(source)), 0, out, limit)
+        rows = []
+        for row in iter(out.get, None):
+            if isinstance(row, BaseException):
+                raise row
+            rows.append(row)
+        assert rows[0][0] == "large.png" and rows[0][1] is None and "exceeds" in rows[0][2]
+        assert rows[1] == ("small.png", small, None)
+
+def test_jsonl_resume_drops_rows_after_checkpoint(tmp_path):
+    path = str(tmp_path / "out.jsonl")
+    writer = JsonlWriter(path)
+    writer.write([{"key": "a"}])
+    state = writer.commit()
+    writer.write([{"key": "b"}])
+    writer.commit()
+    writer.close()
+
+    writer = JsonlWriter(path, state)
+    writer.write([{"key": "c"}])
+    writer.commit()
+    writer.close()
+    with open(path) as f:
+        assert [json.loads(line)["key"] for line in f] == ["a", "c"]
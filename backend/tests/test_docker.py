@@ -11,6 +11,9 @@ API_URL = "http://localhost:7000"
 ADMIN_TOKEN = "admin-token-here"  # from .env
 TEST_IMAGE_PATH = "tests/test_files/test_image.jpg"
 
+# These run against the docker-compose stack, not in-process
+pytestmark = pytest.mark.usefixtures("live_api")
+
 @pytest.fixture
 def test_image():
     """Create a test image in memory"""
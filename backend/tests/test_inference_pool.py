@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+from app.services.inference_pool import InferencePool, PoolSaturatedError, background_work
+
+@pytest.mark.asyncio
+async def test_admission_counts_images():
+    pool = InferencePool(max_pending=8)
+    async with pool.admission(6):
+        assert pool.stats()["pending"] == 6
+        async with pool.admission(2):
+            assert pool.stats()["pending"] == 8
+            with pytest.raises(PoolSaturatedError):
+                async with pool.admission():
+                    pass
+        with pytest.raises(PoolSaturatedError):
+            async with pool.admission(3):
+                pass
+        assert pool.stats()["pending"] == 6
+    assert pool.stats()["pending"] == 0
+
+@pytest.mark.asyncio
+async def test_oversized_batch_needs_an_idle_pool():
+    pool = InferencePool(max_pending=4)
+    async with pool.admission(10):
+        assert pool.stats()["pending"] == 4
+    async with pool.admission():
+        with pytest.raises(PoolSaturatedError):
+            async with pool.admission(10):
+                pass
+
+@pytest.mark.asyncio
+async def test_background_work_has_its_own_budget():
+    pool = InferencePool(max_pending=8, max_background=3)
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def job():
+        with background_work():
+            async with pool.admission(32):
+                with pytest.raises(PoolSaturatedError):
+                    async with pool.admission():
+                        pass
+                started.set()
+                await release.wait()
+
+    task = asyncio.create_task(job())
+    await started.wait()
+    assert pool.stats()["background_pending"] == 3
+    async with pool.admission(5):
+        assert pool.stats()["pending"] == 8
+    release.set()
+    await task
@@ -0,0 +1,34 @@
+from app.core.metrics import Counter, Histogram, MetricsRegistry, route_template
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    counter = Counter("requests_total", "Requests", ["route"], registry=registry)
+    histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0), registry=registry)
+    counter.labels('/a"b').inc()
+    counter.labels('/a"b').inc(2)
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE requests_total counter" in lines
+    assert 'requests_total{route="/a\\"b"} 3' in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 3' in lines
+    assert "latency_seconds_count 3" in lines
+    assert "latency_seconds_sum 5.55" in lines
+
+def test_register_stats_reads_at_scrape_time():
+    registry = MetricsRegistry()
+    stats = {"hits": 1, "hit_ratio": 0.5, "name": "ignored"}
+    registry.register_stats("cache", lambda: stats, counters=("hits",), gauges=("hit_ratio", "name"))
+    stats["hits"] = 7
+    lines = registry.render().splitlines()
+    assert "cache_hits 7" in lines
+    assert "cache_hit_ratio 0.5" in lines
+    assert not any(line.startswith("cache_name") for line in lines)
+
+def test_route_template():
+    assert route_template({"path": "/moderate/jobs/abc", "endpoint": object(), "path_params": {"job_id": "abc"}}) == "/moderate/jobs/{job_id}"
+    assert route_template({"path": "/moderate", "endpoint": object(), "path_params": {}}) == "/moderate"
+    assert route_template({"path": "/nope"}) == "unmatched"
@@ -1,12 +1,9 @@
 import pytest
-from fastapi.testclient import TestClient
-from app.main import app
-from app.core.auth import generate_token
 import os
 from PIL import Image
 import io
-
-client = TestClient(app)
+import time
+import zipfile
 
 def create_test_image():
     # Create a simple test image
@@ -16,70 +13,126 @@ def create_test_image():
     img_byte_arr.seek(0)
     return img_byte_arr
 
-def test_moderate_image():
-    # Create a token
-    token = generate_token()
-    
+def test_moderate_image(model_client, user_token):
     # Create test image
     image_data = create_test_image()
     
     # Test moderation
-    response = client.post(
+    response = model_client.post(
         "/moderate",
         files={"file": ("test.png", image_data, "image/png")},
-        headers={"Authorization": f"Bearer {token}"}
+        headers={"Authorization": f"Bearer {user_token}"}
     )
     assert response.status_code == 200
     data = response.json()
     assert "safe" in data
     assert "categories" in data
     assert "confidence" in data
+    assert "backend" in data
 
-def test_moderate_invalid_file():
-    # Create a token
-    token = generate_token()
-    
+def test_moderate_invalid_file(model_client, user_token):
     # Test with invalid file
-    response = client.post(
+    response = model_client.post(
         "/moderate",
         files={"file": ("test.txt", b"not an image", "text/plain")},
-        headers={"Authorization": f"Bearer {token}"}
+        headers={"Authorization": f"Bearer {user_token}"}
     )
     assert response.status_code == 400
 
-def test_moderate_large_file():
-    # Create a token
-    token = generate_token()
-    
-    # Create a large image (6MB)
-    img = Image.new('RGB', (2000, 2000), color='red')
+def test_moderate_large_file(model_client, user_token):
+    # Noise doesn't compress, so this PNG is just over MAX_FILE_SIZE (5MB);
+    # far larger bodies are cut off with 413 before the endpoint runs
+    noise = os.urandom(1750 * 1000 * 3)
+    img = Image.frombytes('RGB', (1750, 1000), noise)
     img_byte_arr = io.BytesIO()
-    img.save(img_byte_arr, format='PNG', quality=100)
+    img.save(img_byte_arr, format='PNG')
+    assert img_byte_arr.tell() > 5 * 1024 * 1024
     img_byte_arr.seek(0)
     
     # Test moderation
-    response = client.post(
+    response = model_client.post(
         "/moderate",
         files={"file": ("large.png", img_byte_arr, "image/png")},
-        headers={"Authorization": f"Bearer {token}"}
+        headers={"Authorization": f"Bearer {user_token}"}
     )
     assert response.status_code == 400
 
-def test_moderate_no_token():
+def test_moderate_no_token(app_client):
     # Test without token
     image_data = create_test_image()
-    response = client.post(
+    response = app_client.post(
         "/moderate",
         files={"file": ("test.png", image_data, "image/png")}
     )
     assert response.status_code == 401
 
-def test_moderate_invalid_token():
+def test_moderate_invalid_token(app_client):
     # Test with invalid token
     image_data = create_test_image()
-    response = client.post(
+    response = app_client.post(
         "/moderate",
         files={"file": ("test.png", image_data, "image/png")},
         headers={"Authorization": "Bearer invalid_token"}
     )
-    assert response.status_code == 401 
\ No newline at end of file
+    assert response.status_code == 401
+
+def test_moderate_batch(model_client, user_token):
+    # Two images, one invalid file and a zip archive holding one more image
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('inner.png', create_test_image().getvalue())
+    archive.seek(0)
+    
+    response = model_client.post(
+        "/moderate/batch",
+        files=[
+            ("files", ("first.png", create_test_image(), "image/png")),
+            ("files", ("test.txt", b"not an image", "text/plain")),
+            ("files", ("images.zip", archive, "application/zip")),
+            ("files", ("last.png", create_test_image(), "image/png"))
+        ],
+        headers={"Authorization": f"Bearer {user_token}"}
+    )
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["filename"] for r in results] == ["first.png", "test.txt", "inner.png", "last.png"]
+    assert "error" in results[1]
+    for result in (results[0], results[2], results[3]):
+        assert "safe" in result
+        assert "categories" in result
+
+def test_moderate_job(model_client, user_token):
+    headers = {"Authorization": f"Bearer {user_token}"}
+    
+    response = model_client.post(
+        "/moderate/jobs",
+        files=[
+            ("files", ("first.png", create_test_image(), "image/png")),
+            ("files", ("test.txt", b"not an image", "text/plain"))
+        ],
+        headers=headers
+    )
+    assert response.status_code == 202
+    job = response.json()
+    assert job["total"] == 2
+    
+    # Poll until a worker has finished it
+    for _ in range(100):
+        data = model_client.get(f"/moderate/jobs/{job['job_id']}", headers=headers).json()
+        if data["status"] in ("completed", "failed"):
+            break
+        time.sleep(0.1)
+    assert data["status"] == "completed"
+    assert data["processed"] == 2
+    assert data["failed"] == 1
+    results = data["results"]
+    assert [r["filename"] for r in results] == ["first.png", "test.txt"]
+    assert "safe" in results[0]["result"]
+    assert "error" in results[1]
+
+def test_moderate_job_not_found(app_client, user_token):
+    response = app_client.get(
+        "/moderate/jobs/does-not-exist",
+        headers={"Authorization": f"Bearer {user_token}"}
+    )
+    assert response.status_code == 404
@@ -0,0 +1,34 @@
+import pytest
+from app.services.moderator import ImageModerator, StubVisionClient, VisionError
+
+@pytest.mark.asyncio
+async def test_batches_up_to_api_limit():
+    client = StubVisionClient(labels=[("Knife", 0.9)])
+    moderator = ImageModerator(client=client)
+    results = await moderator.analyze_images([b"image"] * 20)
+    assert sorted(client.calls) == [4, 16]
+    assert len(results) == 20
+    assert results[0]["labels"] == ["Knife"]
+
+@pytest.mark.asyncio
+async def test_uses_shared_threshold():
+    client = StubVisionClient(safe_search={"violence": 4})  # LIKELY -> 0.7
+    result = await ImageModerator(client=client).analyze_image(b"image")
+    assert result["categories"]["violence"] == 0.7
+    assert result["safe"] is False
+
+@pytest.mark.asyncio
+async def test_retries_transient_errors():
+    client = StubVisionClient(failures=2)
+    moderator = ImageModerator(client=client, backoff_base=0.001)
+    result = await moderator.analyze_image(b"image")
+    assert result["safe"] is True
+    assert len(client.calls) == 3
+    assert moderator.retries_total == 2
+
+@pytest.mark.asyncio
+async def test_deadline_is_enforced():
+    client = StubVisionClient(latency=1.0)
+    moderator = ImageModerator(client=client, deadline=0.05, backoff_base=0.001)
+    with pytest.raises(VisionError):
+        await moderator.analyze_image(b"image")
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import OperationFailure
+from app.db.mongodb import ensure_index, raw_usage_index_options
+
+
+class ExistingIndexCollection:
+    """A collection that already has a plain index on `timestamp`."""
+
+    name = "usages"
+
+    def __init__(self, supports_coll_mod=True):
+        self.options = {}
+        self.calls = []
+        self.database = SimpleNamespace(command=self.command)
+        self.supports_coll_mod = supports_coll_mod
+        self.exists = True
+
+    async def create_index(self, keys, **options):
+        self.calls.append(("create_index", keys, options))
+        if self.exists and options != self.options:
+            raise OperationFailure("Index already exists with different options", code=85)
+        self.exists, self.options = True, options
+
+    async def command(self, name, collection, index):
+        self.calls.append((name, collection, index))
+        if not self.supports_coll_mod:
+            raise OperationFailure("no such command option", code=72)
+        self.options = {"expireAfterSeconds": index["expireAfterSeconds"]}
+
+    async def drop_index(self, keys):
+        self.calls.append(("drop_index", keys))
+        self.exists = False
+
+
+@pytest.mark.asyncio
+async def test_existing_index_is_converted_to_ttl():
+    collection = ExistingIndexCollection()
+    await ensure_index(collection, "timestamp", {"expireAfterSeconds": 60})
+    assert collection.options == {"expireAfterSeconds": 60}
+    assert ("collMod", "usages", {"keyPattern": {"timestamp": 1}, "expireAfterSeconds": 60}) in collection.calls
+
+
+@pytest.mark.asyncio
+async def test_older_servers_drop_and_recreate():
+    collection = ExistingIndexCollection(supports_coll_mod=False)
+    await ensure_index(collection, "timestamp", {"expireAfterSeconds": 60})
+    assert collection.options == {"expireAfterSeconds": 60}
+    assert ("drop_index", [("timestamp", 1)]) in collection.calls
+
+
+@pytest.mark.asyncio
+async def test_other_conflicts_are_raised():
+    collection = ExistingIndexCollection()
+    with pytest.raises(OperationFailure):
+        await ensure_index(collection, "timestamp", {"unique": True})
+
+
+def test_raw_usages_expire_only_when_opted_in():
+    assert raw_usage_index_options(False, 0) == {}
+    assert raw_usage_index_options(False, 3600) == {}
+    assert raw_usage_index_options(True, 0) == {}
+    assert raw_usage_index_options(True, 3600) == {"expireAfterSeconds": 3600}
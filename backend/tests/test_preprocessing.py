@@ -0,0 +1,67 @@
+import io
+import struct
+import zlib
+import numpy as np
+
+import pytest
+from PIL import Image
+from app.services import preprocessing
+from app.services.preprocessing import ImageTooLargeError, open_image
+
+
+def png_header(width, height):
+    """A small PNG whose header claims `width` x `height` pixels."""
+    buffer = io.BytesIO()
+    Image.new("L", (1, 1)).save(buffer, "PNG")
+    data = bytearray(buffer.getvalue())
+    # The IHDR chunk starts right after the 8-byte signature
+    ihdr = bytes(data[12:16]) + struct.pack(">II", width, height) + bytes(data[24:29])
+    data[16:24] = struct.pack(">II", width, height)
+    data[29:33] = struct.pack(">I", zlib.crc32(ihdr))
+    return bytes(data)
+
+
+def test_open_image_checks_header_dimensions():
+    assert open_image(png_header(4000, 3000)).size == (4000, 3000)
+    # Over our limit, and over twice PIL's, where it raises on open
+    for width, height in [(7000, 7000), (10000, 9000), (100000, 100000)]:
+        with pytest.raises(ImageTooLargeError):
+            open_image(png_header(width, height))
+
+
+def test_limit_is_configurable(monkeypatch):
+    monkeypatch.setattr(preprocessing, "MAX_IMAGE_PIXELS", 1000)
+    with pytest.raises(ImageTooLargeError):
+        open_image(png_header(100, 100))
+
+
+def test_animations_are_not_near_duplicate_keyed():
+    from app.services.image_analyzer import decode_upload
+
+    frames = [Image.new("RGB", (64, 64), color) for color in ("white", "black", "red")]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "GIF", save_all=True, append_images=frames[1:])
+    pixels, upload_hash = decode_upload(buffer.getvalue())
+    assert len(pixels) == 3 and upload_hash is None
+
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "PNG")
+    pixels, upload_hash = decode_upload(buffer.getvalue())
+    assert len(pixels) == 1 and isinstance(upload_hash, int)
+
+
+def test_predict_inputs_splits_into_model_batches(monkeypatch):
+    from app.services import image_analyzer
+
+    sizes = []
+
+    def fake_predict(batch):
+        sizes.append(len(batch))
+        # One row per input, identifying it by its first normalized pixel
+        return batch[:, 0, 0, :1].copy()
+
+    monkeypatch.setattr(image_analyzer, "predict_batch", fake_predict)
+    parts = [np.full((count, 224, 224, 3), value, dtype=np.uint8) for count, value in [(4, 0), (1, 255), (2, 0)]]
+    predictions = image_analyzer.predict_inputs(parts, max_batch=3)
+    assert sizes == [3, 3, 1]
+    assert predictions[:, 0].tolist() == [-1.0] * 4 + [1.0] + [-1.0] * 2
@@ -0,0 +1,36 @@
+import asyncio
+import pytest
+from app.core.rate_limit import InMemoryBackend, _evaluate
+
+@pytest.mark.asyncio
+async def test_allows_up_to_limit():
+    backend = InMemoryBackend()
+    results = [await backend.hit("ip:1.2.3.4", 5, 60) for _ in range(6)]
+    assert [allowed for allowed, _ in results] == [True] * 5 + [False]
+    assert results[-1][1] > 0
+
+@pytest.mark.asyncio
+async def test_keys_are_independent():
+    backend = InMemoryBackend()
+    for _ in range(3):
+        await backend.hit("token:a", 3, 60)
+    allowed, _ = await backend.hit("token:a", 3, 60)
+    assert not allowed
+    allowed, _ = await backend.hit("token:b", 3, 60)
+    assert allowed
+
+@pytest.mark.asyncio
+async def test_idle_keys_are_evicted():
+    backend = InMemoryBackend(shards=1, sweep_every=1)
+    await backend.hit("ip:old", 5, 0.01)
+    await backend.hit("ip:new", 5, 60)
+    assert len(backend) <= 2
+    await asyncio.sleep(0.03)
+    await backend.hit("ip:other", 5, 0.01)
+    assert len(backend) == 2
+
+def test_previous_window_is_weighted():
+    # Half way through the window, half of the previous window still counts
+    assert _evaluate(current=0, previous=10, limit=10, window=60, elapsed=30)[0]
+    assert not _evaluate(current=5, previous=10, limit=10, window=60, elapsed=30)[0]
+    assert _evaluate(current=5, previous=10, limit=10, window=60, elapsed=59)[0]
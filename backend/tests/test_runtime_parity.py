@@ -0,0 +1,69 @@
+import io
+import os
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+tf = pytest.importorskip("tensorflow")
+
+from app.services.preprocessing import load_frames, pack_batch, to_pixels
+from app.services.runtimes import EXPORTERS, load_runner, top_k_agreement
+
+def fixture_images(count=12):
+    """Deterministic images with some structure, so predictions aren't flat"""
+    rng = np.random.default_rng(0)
+    images = []
+    for index in range(count):
+        image = Image.new("RGB", (320, 240), tuple(int(v) for v in rng.integers(0, 256, 3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(6):
+            x0, y0 = rng.integers(0, 240), rng.integers(0, 160)
+            box = [int(x0), int(y0), int(x0 + rng.integers(20, 80)), int(y0 + rng.integers(20, 80))]
+            fill = tuple(int(v) for v in rng.integers(0, 256, 3))
+            (draw.ellipse if index % 2 else draw.rectangle)(box, fill=fill)
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG" if index % 3 else "PNG")
+        images.append(buffer.getvalue())
+    return images
+
+@pytest.fixture(scope="module")
+def keras_model():
+    try:
+        if os.getenv("MODEL_PATH"):
+            return tf.keras.models.load_model(os.environ["MODEL_PATH"], compile=False)
+        return tf.keras.applications.MobileNetV2(weights=os.getenv("MODEL_WEIGHTS", "imagenet"))
+    except Exception as e:
+        pytest.skip(f"Keras model unavailable: {e}")
+
+@pytest.fixture(scope="module")
+def calibration_dir(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("calibration")
+    for index, contents in enumerate(fixture_images(24)):
+        (directory / f"{index}.img").write_bytes(contents)
+    return str(directory)
+
+@pytest.fixture(scope="module")
+def batch():
+    return pack_batch([to_pixels(load_frames(contents)[:1]) for contents in fixture_images()])
+
+@pytest.mark.parametrize("runtime,quantize", [
+    ("tflite", None), ("tflite", "int8"), ("onnx", None), ("onnx", "int8")
+])
+def test_runtime_matches_keras(runtime, quantize, keras_model, calibration_dir, batch, tmp_path):
+    if runtime == "onnx":
+        pytest.importorskip("tf2onnx")
+        pytest.importorskip("onnxruntime")
+    path = str(tmp_path / f"model.{runtime}")
+    EXPORTERS[runtime](keras_model, path, quantize=quantize, calibration_dir=calibration_dir)
+
+    reference = np.asarray(keras_model(batch, training=False))
+    outputs = load_runner(runtime, path, intra_op_threads=2)(batch)
+    assert outputs.shape == reference.shape
+
+    if quantize is None:
+        assert np.abs(outputs - reference).max() < 1e-4
+        assert top_k_agreement(reference, outputs, k=1) == 1.0
+    else:
+        # INT8 may reorder near-ties but should keep the reference class close to the top
+        assert top_k_agreement(reference, outputs, k=5) >= 0.9
+        assert top_k_agreement(reference, outputs, k=1) >= 0.75
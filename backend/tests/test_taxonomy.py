@@ -0,0 +1,86 @@
+import json
+import numpy as np
+from types import SimpleNamespace
+from app.services.scoring import CATEGORIES, empty_categories
+from app.services.taxonomy import TAXONOMY_PATH, TaxonomyStore
+
+LABELS = ["assault_rifle", "tabby", "meat_cleaver", "pizza"]
+
+def write_taxonomy(path, spec):
+    path.write_text(json.dumps(spec))
+    return str(path)
+
+def test_imagenet_scoring_is_a_weighted_sum(tmp_path):
+    path = write_taxonomy(tmp_path / "taxonomy.json", {
+        "imagenet_scoring": {"method": "sum"},
+        "imagenet": {"violence": {"patterns": ["cleaver"], "weight": 0.5, "classes": {"assault_rifle": 1.0}}}
+    })
+    taxonomy = TaxonomyStore(path).current
+    scores = taxonomy.score_imagenet(np.array([0.2, 0.5, 0.3, 0.0]), LABELS)
+    assert np.isclose(scores[0], 0.2 * 1.0 + 0.3 * 0.5)
+    assert np.allclose(scores[1:], 0.0)
+
+def test_vision_labels_match_patterns(tmp_path):
+    path = write_taxonomy(tmp_path / "taxonomy.json", {"vision_labels": {"self_harm": ["wound", "blood"]}})
+    taxonomy = TaxonomyStore(path).current
+    labels = [SimpleNamespace(description="Bloody knife", score=0.8), SimpleNamespace(description="Kitchen", score=0.9)]
+    assert taxonomy.score_vision_labels(labels)["self_harm"] == 0.8
+
+def test_reload_swaps_taxonomy(tmp_path):
+    path = write_taxonomy(tmp_path / "taxonomy.json", {"version": "1"})
+    store = TaxonomyStore(path)
+    write_taxonomy(tmp_path / "taxonomy.json", {"version": "2", "imagenet": {"nudity": {"patterns": ["tabby"]}}})
+    store.reload()
+    assert store.current.version == "2"
+    assert store.current.score_imagenet(np.array([0.0, 1.0, 0.0, 0.0]), LABELS)[1] == 1.0
+
+
+def legacy_imagenet_scores(probabilities, labels):
+    """The substring rules over the top-5 labels that the taxonomy replaced."""
+    categories = empty_categories()
+    for index in np.argsort(probabilities)[::-1][:5]:
+        label, confidence = labels[index].lower(), float(probabilities[index])
+        if any(word in label for word in ["weapon", "knife", "gun"]):
+            categories["violence"] = max(categories["violence"], confidence)
+        elif any(word in label for word in ["flesh", "body"]):
+            categories["nudity"] = max(categories["nudity"], confidence)
+    return categories
+
+def legacy_vision_scores(labels):
+    """The _check_* methods of the Vision moderator that the taxonomy replaced."""
+    indicators = {
+        "hate_symbols": {"hate", "symbol", "flag", "gesture", "sign"},
+        "self_harm": {"self-harm", "suicide", "cut", "wound", "blood"},
+        "extremist_content": {"weapon", "terrorism", "extremist", "radical", "protest"}
+    }
+    return {
+        category: max(
+            (label.score for label in labels if any(word in label.description.lower() for word in words)),
+            default=0.0
+        )
+        for category, words in indicators.items()
+    }
+
+def test_shipped_taxonomy_matches_the_legacy_rules():
+    taxonomy = TaxonomyStore(TAXONOMY_PATH).current
+    labels = [
+        "assault_rifle", "gunboat", "letter_opener", "Knife_Block", "body_armor", "bodyguard_gun",
+        "flesh_wound", "tabby", "pizza", "revolver", "cleaver", "sunscreen"
+    ]
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        probabilities = rng.dirichlet(np.full(len(labels), 0.3)).astype(np.float32)
+        scores = taxonomy.score_imagenet(probabilities, labels)
+        expected = legacy_imagenet_scores(probabilities, labels)
+        assert np.allclose(scores, [expected[category] for category in CATEGORIES])
+
+    descriptions = ["Flag", "Blood", "Protest sign", "Weapon", "Cutlery", "Cat", "Self-harm", "Hateful gesture"]
+    for _ in range(50):
+        vision_labels = [
+            SimpleNamespace(description=description, score=float(score))
+            for description, score in zip(descriptions, rng.random(len(descriptions)))
+            if score > 0.3
+        ]
+        scores = taxonomy.score_vision_labels(vision_labels)
+        for category, expected in legacy_vision_scores(vision_labels).items():
+            assert np.isclose(scores[category], expected)
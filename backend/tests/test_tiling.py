@@ -0,0 +1,71 @@
+import io
+
+import numpy as np
+from PIL import Image
+from app.services import tiling
+from app.services.tiling import load_tiles, plan_tiles, tile_grid, wave_slices
+
+
+def encode(image, image_format="JPEG"):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def test_grid_adapts_to_size_and_budget():
+    assert tile_grid(400, 300, max_tiles=9, min_side=448) == (1, 1)
+    assert tile_grid(1000, 600, max_tiles=9, min_side=448) == (2, 1)
+    assert tile_grid(4000, 3000, max_tiles=9, min_side=448) == (3, 3)
+    assert tile_grid(4000, 3000, max_tiles=4, min_side=448) == (2, 2)
+    assert tile_grid(4000, 3000, max_tiles=1, min_side=448) == (1, 1)
+
+
+def test_tiles_cover_the_image_and_overlap():
+    boxes = plan_tiles(1000, 600, columns=3, rows=2, overlap=0.25)
+    assert len(boxes) == 6
+    assert min(box[0] for box in boxes) == 0 and max(box[2] for box in boxes) == 1000
+    assert min(box[1] for box in boxes) == 0 and max(box[3] for box in boxes) == 600
+    first, second = boxes[0], boxes[1]
+    assert second[0] < first[2]  # neighbours share a strip
+    assert round((first[2] - second[0]) / (first[2] - first[0]), 2) == 0.25
+
+
+def test_load_tiles_puts_the_thumbnail_first():
+    image = Image.new("RGB", (2000, 1000), "black")
+    image.paste(Image.new("RGB", (200, 200), "white"), (1700, 700))
+    tiles = load_tiles(encode(image, "PNG"), max_inputs=10)
+    assert len(tiles) == 9  # thumbnail plus a 4x2 grid
+    assert all(tile.size == (224, 224) for tile in tiles)
+    brightness = [np.asarray(tile).mean() for tile in tiles]
+    assert max(brightness[1:]) > 5 * brightness[0]
+
+    # JPEGs are decoded at a reduced scale, which must not change the tiling
+    assert len(load_tiles(encode(image), max_inputs=10)) == 9
+    # Small images and a budget of one keep the single whole-image input
+    assert len(load_tiles(encode(Image.new("RGB", (300, 200))), max_inputs=10)) == 1
+    assert len(load_tiles(encode(image), max_inputs=1)) == 1
+
+
+def test_wave_slices(monkeypatch):
+    assert wave_slices(10, wave_size=4) == [slice(0, 10)]
+    monkeypatch.setattr(tiling, "TILING_ENABLED", True)
+    assert wave_slices(10, wave_size=4) == [slice(0, 4), slice(4, 8), slice(8, 10)]
+    assert wave_slices(3, wave_size=4) == [slice(0, 3)]
+    assert wave_slices(10, wave_size=0) == [slice(0, 10)]
+
+
+def test_reduced_batches_are_not_full_analyses(monkeypatch):
+    import sys
+    from app.services import backends
+    from app.services.image_analyzer import result_fingerprint
+
+    local = backends.LocalModelBackend()
+    assert local.full_analysis(64)
+    # The backend reads the settings from the app-relative module
+    monkeypatch.setattr(sys.modules[backends.tile_budget.__module__], "TILING_ENABLED", True)
+    assert local.full_analysis(1) and local.full_analysis(6)
+    assert not local.full_analysis(7)  # 64 // 7 < TILE_BUDGET
+    cascade = backends.CascadeBackend(local, backends.FakeBackend())
+    assert not cascade.full_analysis(64)
+
+    assert "tiles=" not in result_fingerprint(tiled=False)
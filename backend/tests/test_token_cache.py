@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import pytest
+from app.core.auth import TokenCache, find_token, token_cache
+
+
+class SlowTokens:
+    """find_one that lets the test revoke the token mid-lookup."""
+
+    def __init__(self, document, during_lookup):
+        self.document = document
+        self.during_lookup = during_lookup
+
+    async def find_one(self, query):
+        self.during_lookup()
+        return self.document
+
+
+def test_unknown_tokens_do_not_evict_valid_ones():
+    cache = TokenCache(max_entries=2, max_negative_entries=3)
+    cache.set("valid", {"token": "valid"})
+    for index in range(100):
+        cache.set(f"random-{index}", None)
+    assert cache.get("valid") == (True, {"token": "valid"})
+    assert cache.get("random-99") == (True, None)
+    assert cache.get("random-0") == (False, None)
+    assert cache.stats()["negative_entries"] == 3
+    assert cache.stats()["evictions"] == 97
+
+
+def test_set_skips_results_older_than_an_invalidation():
+    cache = TokenCache()
+    generation = cache.generation
+    cache.invalidate("other")
+    cache.set("token", {"token": "token"}, generation)
+    assert cache.get("token") == (False, None)
+    cache.set("token", {"token": "token"}, cache.generation)
+    assert cache.get("token") == (True, {"token": "token"})
+
+
+@pytest.mark.asyncio
+async def test_revoke_during_lookup_is_not_cached():
+    token_cache.invalidate()
+    db = SimpleNamespace(tokens=SlowTokens({"token": "racy"}, lambda: token_cache.invalidate("racy")))
+    assert await find_token(db, "racy") == {"token": "racy"}
+    assert token_cache.get("racy") == (False, None)
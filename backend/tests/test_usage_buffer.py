@@ -0,0 +1,110 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from app.models.auth import UsageRecord
+from app.services.usage_buffer import UsageBuffer, period_start
+
+
+class RecordingCollection:
+    def __init__(self):
+        self.operations = []
+        self.documents = []
+
+    async def bulk_write(self, operations, ordered=True):
+        self.operations.extend(operations)
+
+    async def insert_many(self, documents, ordered=True):
+        self.documents.extend(documents)
+
+
+class SlowCollection(RecordingCollection):
+    async def bulk_write(self, operations, ordered=True):
+        await asyncio.sleep(0.05)
+        await super().bulk_write(operations, ordered)
+
+
+def recording_db():
+    return SimpleNamespace(
+        usage_buckets=RecordingCollection(),
+        usage_rollups=RecordingCollection(),
+        usages=RecordingCollection(),
+        tokens=RecordingCollection()
+    )
+
+
+def test_period_start():
+    when = datetime(2024, 3, 17, 14, 25, 31, 500)
+    assert period_start(when, "minute") == datetime(2024, 3, 17, 14, 25)
+    assert period_start(when, "hour") == datetime(2024, 3, 17, 14)
+    assert period_start(when, "day") == datetime(2024, 3, 17)
+    assert period_start(when, "month") == datetime(2024, 3, 1)
+    with pytest.raises(ValueError):
+        period_start(when, "week")
+
+
+@pytest.mark.asyncio
+async def test_flush_sums_records_into_buckets_and_rollups():
+    db = recording_db()
+    buffer = UsageBuffer(bucket="hour")
+    buffer._db = db
+    for minute, size in [(1, 100), (2, 50), (59, 10)]:
+        buffer.record(UsageRecord(token="a", endpoint="moderate", file_size=size,
+                                  timestamp=datetime(2024, 3, 17, 14, minute)))
+    buffer.record(UsageRecord(token="a", endpoint="moderate/batch", file_size=5,
+                              timestamp=datetime(2024, 3, 17, 15, 0)))
+    await buffer.flush()
+
+    buckets = {op._filter["start"].hour: op._doc["$inc"] for op in db.usage_buckets.operations}
+    assert buckets == {14: {"count": 3, "bytes": 160}, 15: {"count": 1, "bytes": 5}}
+
+    rollups = {(op._filter["period"], op._filter["start"]): op._doc["$inc"] for op in db.usage_rollups.operations}
+    assert len(rollups) == 4  # two hours, one day, one month
+    assert rollups[("month", datetime(2024, 3, 1))] == {
+        "count": 4, "bytes": 165, "endpoints.moderate": 3, "endpoints.moderate/batch": 1
+    }
+    assert db.usages.documents == []
+    assert buffer.stats()["flushed_total"] == 4
+
+
+@pytest.mark.asyncio
+async def test_raw_events_are_optional():
+    db = recording_db()
+    buffer = UsageBuffer(raw_events=True)
+    buffer._db = db
+    buffer.record(UsageRecord(token="a", endpoint="moderate", file_size=1))
+    await buffer.flush()
+    assert len(db.usages.documents) == 1
+
+
+@pytest.mark.asyncio
+async def test_stop_finishes_a_flush_in_progress():
+    db = recording_db()
+    db.usage_buckets = SlowCollection()
+    buffer = UsageBuffer(flush_size=1, flush_interval=60)
+    buffer.start(db)
+    buffer.record(UsageRecord(token="a", endpoint="moderate", file_size=1))
+    await asyncio.sleep(0.01)  # the loop is now waiting on the bucket write
+    await buffer.stop()
+    assert len(db.usage_buckets.operations) == 1
+    assert len(db.usage_rollups.operations) == 3
+    assert buffer.stats()["flushed_total"] == 1
+
+
+class FailingCollection(RecordingCollection):
+    async def bulk_write(self, operations, ordered=True):
+        raise RuntimeError("write failed")
+
+
+@pytest.mark.asyncio
+async def test_rollup_failure_is_reported_separately():
+    db = recording_db()
+    db.usage_rollups = FailingCollection()
+    buffer = UsageBuffer()
+    buffer._db = db
+    buffer.record(UsageRecord(token="a", endpoint="moderate", file_size=1))
+    await buffer.flush()
+    stats = buffer.stats()
+    assert len(db.usage_buckets.operations) == 1
+    assert (stats["flushed_total"], stats["dropped_total"], stats["rollup_dropped_total"]) == (1, 0, 1)